@@ -20,7 +20,7 @@ Output scripts:
 
 """
 
-import copy
+import collections
 import os
 
 from Tkinter import *
@@ -30,16 +30,24 @@ import tkFileDialog
 import tkColorChooser
 
 import maketree
+from corrections import ROW_COLUMN, STEVE, guess_format, \
+                        parse as parse_corrections
 from fms.detector import * # NORTH_LARGE etc
 import dialog
 from menus import Menus
 from imagewindow import ImageWindow
-import calibration
-import qt
 import files
-import lecroytools
-import smallcellscript
+import instrument
 import postscript
+import report
+import session
+import watcher
+
+# Number of cells for which corrections are computed between Tk events.
+CORRECTION_CHUNK = 20
+
+# Milliseconds between checks for input files changed by others.
+WATCH_INTERVAL = 1000
 
 class App(Tk):
     """Main fmsvoltages application class."""
@@ -50,14 +58,14 @@ class App(Tk):
         self.title("fmsvoltages")
         self.protocol("WM_TAKE_FOCUS", self.focus)
         self.protocol("WM_DELETE_WINDOW", self.exit)
-        # Create our detector objects.
-        # This is the main level of organising all the FMS data.
-        self.detectors = {
-            NORTH_LARGE: LargeDetector(NORTH_LARGE),
-            SOUTH_LARGE: LargeDetector(SOUTH_LARGE),
-            NORTH_SMALL: SmallDetector(NORTH_SMALL),
-            SOUTH_SMALL: SmallDetector(SOUTH_SMALL)
-        }
+        # The session holds our detector objects and does all the file
+        # handling; the application only adds the user interface.
+        self.session = session.Session()
+        self.detectors = self.session.detectors
+        # Watches the input files once read, see watch_input().
+        self.watcher = None
+        # Progress of the gain corrections being computed, if any.
+        self.progress = None
         # Create the graphics windows and menus.
         self.image_window = ImageWindow(self.detectors, self)
         self.menus = Menus(self)
@@ -77,20 +85,8 @@ class App(Tk):
         These contain geometrical and calibration information that
         isn't modified by the user.
         """
-        # Create a new file set and populate it with all the library files.
-        self.files = files.Files()
         try:
-            openfile = self.files.open_file
-            # Initialise miscellaneous cell info
-            with openfile('INFO') as file:
-                info = file.readlines()
-                for detector in self.detectors.itervalues():
-                    detector.set_info(info)
-            # Open calibration information
-            with openfile('CURVE_LARGE') as l, openfile('CURVE_SMALL') as s:
-                    cal = calibration.Table(l, s)
-                    for detector in self.detectors.itervalues():
-                        detector.set_calibration(cal)
+            self.session.read_library()
         except IOError as err:
             tkMessageBox.askyesno('I/O error', str(err))
             self.image_window.canvas.focus_set()
@@ -106,67 +102,159 @@ class App(Tk):
             if not path: # User the cancelled dialog box so bug out
                 return False
             # Search the user-provided path for all the input files.
-            foundall, missing = self.files.locate_input(path)
+            missing = self.session.read_input(path)
             # If any are missing show the user and error message
             # with the missing files listed.
-            if not foundall:
+            if missing:
                 # Give indentation and numbered bullets to the missing names
                 missing = [' {}) {}'.format(i, name)
-                           for i, name in enumerate(sorted(missing), 1)]
+                           for i, name in enumerate(missing, 1)]
                 missing.insert(0, 'The following files were not found:')
                 missing.append('Nothing was modified')
                 tkMessageBox.showerror('Error', '\n'.join(missing))
                 return False
-            # Files were successfully located.
-            # Read contents of gain/voltage files.
-            # This must come first, as it also sets the row and column numbers.
-            with self.files.open_file('GAIN_LARGE') as file:
-                largegains = file.readlines()
-                for x in NORTH_LARGE, SOUTH_LARGE:
-                    self.detectors[x].set_voltages(largegains)
-            with self.files.open_file('GAIN_SMALL') as file:
-                smallgains = file.readlines()
-                for x in NORTH_SMALL, SOUTH_SMALL:
-                    self.detectors[x].set_voltages(smallgains)
-            # Set QT information
-            qtdirname = os.path.dirname(self.files['QT1'])
-            self.qt = qt.System(qtdirname)
-            for det in self.detectors.itervalues():
-                det.set_qt(self.qt)
-            # Now that the detector information is complete,
-            # let's keep a copy of the initial detector state.
-            # This is required for when we make a ROOT
-            # tree with initial and final information.
-            self.initial = copy.deepcopy(self.detectors)
+            self.image_window.baseline = self.session.initial
+            self.watch_input()
         except IOError as err:
             tkMessageBox.askyesno('I/O error', str(err))
             self.image_window.canvas.focus_set()
 
+    def watch_input(self):
+        """Start watching the input files for changes by others."""
+        if self.watcher is None:
+            self.after(WATCH_INTERVAL, self.check_input)
+        else:
+            self.watcher.close()
+        self.watcher = watcher.watch(self.session.input_paths())
+
+    def check_input(self):
+        """Reload input files changed by others, then check again later.
+
+        Only the changed values are applied, keeping any unsaved changes
+        to the same cells, and a summary is shown in the status bar.
+        Reloading is postponed while gain corrections are being computed,
+        as they would otherwise be committed over the reloaded values.
+        """
+        self.after(WATCH_INTERVAL, self.check_input)
+        if self.progress is not None:
+            return
+        changed = self.session.changed_files(self.watcher.poll())
+        if not changed:
+            return
+        names = [os.path.basename(self.session.files[i]) for i in changed]
+        try:
+            outcomes = self.session.reload(changed)
+        except (IOError, ValueError) as err:
+            self.image_window.status.config(
+                text='Could not reload {}: {}'.format(', '.join(names), err))
+            return
+        summary = ['{} ({} updated, {} kept unsaved)'.format(
+                       name, outcomes[i][session.UPDATED],
+                       outcomes[i][session.KEPT])
+                   for i, name in zip(changed, names)]
+        self.image_window.status.config(
+            text='Reloaded ' + ', '.join(summary))
+
     def apply_corrections_from_file(self):
-        """Read gain corrections from a file and apply them."""
-        with self.open_file() as file:
-            lines = file.readlines()
-        for detector in self.detectors.itervalues():
-            nchanged = detector.apply_gain_corrections(lines)
-            # Set a modified state if any channels were changed
-            self.image_window.modified = nchanged > 0
+        """Read gain corrections from a file and apply them.
+        
+        The corrections are computed a few cells at a time between Tk
+        events, with a progress dialog allowing the user to cancel.
+        Nothing is changed until all corrections have been computed.
+        
+        """
+        file = self.open_file()
+        if not file:
+            return
+        with file:
+            lines = file.read().splitlines()
+        format = guess_format(lines)
+        if format is None:
+            answer = tkMessageBox.askyesnocancel('Corrections format',
+                'The file fits both formats. Read it as\n'
+                ' detector row column factor?\n'
+                'Choose No to read it as Steve\'s format\n'
+                ' eastOrWest detector channel factor', default='yes')
+            if answer is None:
+                return
+            format = ROW_COLUMN if answer else STEVE
+        factors = parse_corrections(lines, format)
+        corrections = self.session.factor_corrections(factors)
+        self.progress = dialog.ProgressDialog(self, 'Modifying gains',
+                                              len(corrections))
+        self.after_idle(self.compute_corrections, corrections, 0)
+
+    def compute_corrections(self, corrections, start):
+        """Compute the next chunk of corrections, starting at index start.
+        
+        Reschedules itself until all are computed, then commits them.
+        
+        """
+        if self.progress.cancelled:
+            self.progress.close()
+            self.progress = None
+            self.image_window.status.config(
+                text='Gain modification cancelled, nothing was changed')
+            return
+        end = start + CORRECTION_CHUNK
+        with instrument.timer('corrections.compute'):
+            Correction.compute_all(corrections[start:end])
+        self.progress.update_progress(end)
+        if end < len(corrections):
+            self.after(1, self.compute_corrections, corrections, end)
+        else:
+            self.progress.close()
+            self.progress = None
+            self.commit_corrections(corrections)
+
+    def commit_corrections(self, corrections):
+        """Apply computed corrections to the cells and summarise them."""
+        with instrument.timer('corrections.commit'):
+            outcomes = collections.Counter(i.commit() for i in corrections)
+        changed = outcomes[Correction.CHANGED]
+        clamped = outcomes[Correction.CLAMPED]
+        skipped = outcomes[Correction.SKIPPED]
+        # Set a modified state if any channels were changed
+        if changed or clamped:
+            self.image_window.modified = True
+        summary = '{} cells changed, {} clamped at limits, {} skipped'.format(
+            changed, clamped, skipped)
+        self.image_window.status.config(text='Modified gains: ' + summary)
+        tkMessageBox.showinfo('Modified gains', summary)
 
     def save_root(self, filename=None):
         """Populate and write a ROOT file."""
         if not filename:
             filename = tkFileDialog.asksaveasfilename()
         if filename:
-            maketree.populate(self.initial.itervalues(),
-                              self.detectors.itervalues())
-            maketree.write(filename)
+            self.session.save_root(filename)
 
     def save_postscript(self, filename=None):
         """Create a PostSript file."""
         if not filename:
             filename = tkFileDialog.asksaveasfilename()
-        maketree.populate(self.initial.itervalues(),
-                          self.detectors.itervalues())
-        postscript.generate(maketree.tree(), filename)
+        with instrument.timer('postscript'):
+            maketree.populate(self.session.initial.itervalues(),
+                              self.detectors.itervalues())
+            postscript.generate(maketree.tree(), filename)
+
+    def save_report(self, directory=None):
+        """Create an HTML/SVG QA report in a directory.
+
+        Pages whose contents haven't changed since the last report written
+        to the same directory are not re-rendered.
+
+        """
+        if not directory:
+            directory = tkFileDialog.askdirectory()
+        if directory:
+            with instrument.timer('report'):
+                rendered = report.generate(self.session.initial.itervalues(),
+                                           self.detectors.itervalues(),
+                                           directory)
+            self.image_window.status.config(
+                text='Report: updated {} page(s) in {}'.format(
+                    len(rendered), directory))
         
     def save_all(self):
         """Save all files to an output directory
@@ -192,31 +280,7 @@ class App(Tk):
         if True in exists and not tkMessageBox.askyesno('Files exist',
             'Do you wish to replace the existing files?'):
             return False
-        # Write updated gain/voltage files for large cells
-        filename = os.path.join(outdir, 'largeCellGains.txt')
-        with open(filename, 'w') as file:
-            self.detectors[NORTH_LARGE].write_gain_table(file)
-        with open(filename, 'a') as file:
-            self.detectors[SOUTH_LARGE].write_gain_table(file)
-        # ... and for small cells
-        filename = os.path.join(outdir, 'smallCellGains.txt')
-        with open(filename, 'w') as file:
-            self.detectors[NORTH_SMALL].write_gain_table(file)
-        with open(filename, 'a') as file:
-            self.detectors[SOUTH_SMALL].write_gain_table(file)
-        self.qt.write(outdir)
-        # Write the LeCroy scripts for large cells
-        for i in [7005, 7006]:
-            printer = lecroytools.Printer(i)
-            printer.generate(self.detectors[NORTH_LARGE], outdir)
-        for i in [7007, 7008]:
-            printer = lecroytools.Printer(i)
-            printer.generate(self.detectors[SOUTH_LARGE], outdir)
-        # Write script for small cells
-        smallcellscript.generate(self.detectors[NORTH_SMALL],
-                                 self.detectors[SOUTH_SMALL],
-                                 outdir)
-        self.save_root(os.path.join(outdir, 'tree.root'))
+        self.session.save_all(outdir)
         # Reset the modified flag so we don't prompt the user to save again
         self.image_window.modified = False
         # We saved, it's OK to quit now
@@ -242,7 +306,7 @@ class App(Tk):
             self.image_window.status.config(text='Opened: ' + filename)
             return file
         except:
-            self.status.config(text='You fool!')
+            self.image_window.status.config(text='You fool!')
             tkMessageBox.showwarning("Open file",
                                      "Cannot open file " + filename)
             return None
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+"""Time the main stages of an fmsvoltages iteration.
+
+Each stage is run several times and the minimum and median times are
+written as JSON, so runs before and after a change can be compared with
+--compare. Stages needing ROOT are skipped if it isn't available.
+
+The library files aren't part of the repository, so --synthetic writes
+a library consistent with the input directory (one QT channel, LeCroy or
+small-cell address and calibration curve per cell) to a temporary
+directory and uses that. --scale N runs every stage on N independent
+copies of the detectors, to estimate the cost for N times as many
+channels.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import copy
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import corrections
+import lecroytools
+import postscript
+import report
+from rootlib import ROOT
+import session
+import smallcellscript
+
+# Directory containing this file, for locating the example data.
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def synthesise(input, directory):
+    """Write library files consistent with the gain files in input.
+
+    Cells are assigned QT channels in file order, matching the order of
+    entries in the qt#_tac.dat files, and given smooth calibration curves
+    spanning a realistic range of gains.
+
+    """
+    cells = []
+    for name in 'largeCellGains.txt', 'smallCellGains.txt':
+        with open(os.path.join(input, name)) as file:
+            for line in file:
+                words = line.split()
+                if words:
+                    cells.append([int(i) for i in words[:4]])
+    info, large, small = [], [], []
+    for n, (detector, channel, row, column) in enumerate(cells):
+        # 11 boards of 32 channels per QT crate, info table slots from 1.
+        crate, slot, qtchannel = n / 352 + 1, n % 352 / 32 + 1, n % 32
+        if detector < 3:
+            telnet = 7005 + 2 * (detector - 1) + channel % 2
+            ids = [telnet, 0, channel / 16 % 16, str(channel % 16)]
+        else:
+            ids = [1 + channel % 4, channel / 64, channel % 16,
+                   '{:X}'.format(channel)]
+        info.append(' '.join(str(i) for i in [detector, channel, row, column,
+            crate, slot, qtchannel / 8, qtchannel % 8] + ids))
+        offset = 0.002 * (n % 50)
+        if detector < 3:
+            large.append('{} {} {} {} 0.005 -5e-07'.format(
+                detector, row, column, -2. + offset))
+        else:
+            small.append('{} {} {} {} 0.03 -2e-05'.format(
+                detector, row, column, -2. + offset))
+    for name, lines in [('fmsCellInfoTable.txt', info),
+                        ('large_gaincurve_par.txt', large),
+                        ('small_gaincurve_par.txt', small)]:
+        with open(os.path.join(directory, name), 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+def root_available():
+    """Returns True if ROOT can be imported."""
+    try:
+        ROOT.module()
+        return True
+    except ImportError:
+        return False
+
+
+class Suite(object):
+    """The benchmarked stages.
+
+    Each stage is a method taking the list of sessions to work on, after
+    setup() has prepared fresh copies of the loaded baseline.
+    """
+    def __init__(self, input, lines, scale, outdir):
+        self.input = input
+        self.lines = lines
+        self.scale = scale
+        self.outdir = outdir
+        self.baseline = session.Session()
+        self.baseline.read_library()
+        self.baseline.read_input(input)
+
+    def setup(self):
+        """Returns scale fresh copies of the baseline session."""
+        return [copy.deepcopy(self.baseline) for i in range(self.scale)]
+
+    def corrected(self):
+        """Returns copies of the baseline with the corrections applied."""
+        sessions = self.setup()
+        for fms in sessions:
+            fms.apply_corrections(self.lines, 'analytic')
+        return sessions
+
+    def read_library(self, sessions):
+        for i in sessions:
+            session.Session().read_library()
+
+    def read_input(self, sessions):
+        for fms in sessions:
+            fms.read_input(self.input)
+
+    def set_qt(self, sessions):
+        for fms in sessions:
+            for detector in fms.detectors.itervalues():
+                detector.set_qt(fms.qt)
+
+    def optimise_root(self, sessions):
+        for fms in sessions:
+            fms.apply_corrections(self.lines, 'root')
+
+    def optimise_analytic(self, sessions):
+        for fms in sessions:
+            fms.apply_corrections(self.lines, 'analytic')
+
+    def write_gain_table(self, sessions):
+        for fms in sessions:
+            with open(os.path.join(self.outdir, 'gains.txt'), 'w') as file:
+                for detector in fms.detectors.itervalues():
+                    detector.write_gain_table(file)
+
+    def lecroy(self, sessions):
+        for fms in sessions:
+            for telnet, detector in [(7005, 1), (7006, 1),
+                                     (7007, 2), (7008, 2)]:
+                lecroytools.Printer(telnet).generate(fms.detectors[detector],
+                                                     self.outdir)
+
+    def smallcellscript(self, sessions):
+        for fms in sessions:
+            smallcellscript.generate(fms.detectors[3], fms.detectors[4],
+                                     self.outdir)
+
+    def populate(self, sessions):
+        import maketree
+        for fms in sessions:
+            maketree.populate(fms.initial.itervalues(),
+                              fms.detectors.itervalues())
+
+    def postscript(self, sessions):
+        import maketree
+        for fms in sessions:
+            maketree.populate(fms.initial.itervalues(),
+                              fms.detectors.itervalues())
+            postscript.generate(maketree.tree(),
+                                os.path.join(self.outdir, 'qa.ps'))
+
+    def report(self, sessions):
+        for fms in sessions:
+            # Use a new directory each time so every page is rendered.
+            directory = tempfile.mkdtemp(dir=self.outdir)
+            report.generate(fms.initial.itervalues(),
+                            fms.detectors.itervalues(), directory)
+
+    # (name, setup method, needs ROOT) for each stage, in order.
+    STAGES = [('read_library', 'setup', False),
+              ('read_input', 'setup', False),
+              ('set_qt', 'setup', False),
+              ('optimise_root', 'setup', True),
+              ('optimise_analytic', 'setup', False),
+              ('write_gain_table', 'corrected', False),
+              ('lecroy', 'corrected', False),
+              ('smallcellscript', 'corrected', False),
+              ('populate', 'corrected', True),
+              ('postscript', 'corrected', True),
+              ('report', 'corrected', False)]
+
+    def run(self, repeat, names=None, root=True):
+        """Time each stage. Returns {name: result dictionary}."""
+        results = {}
+        for name, setup, needs_root in self.STAGES:
+            if names and name not in names:
+                continue
+            if needs_root and not root:
+                results[name] = {'skipped': 'ROOT not available'}
+                continue
+            times = []
+            for i in range(repeat):
+                sessions = getattr(self, setup)()
+                start = timeit.default_timer()
+                getattr(self, name)(sessions)
+                times.append(timeit.default_timer() - start)
+            times.sort()
+            results[name] = {'min': times[0],
+                             'median': times[len(times) / 2],
+                             'runs': len(times)}
+        return results
+
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--input',
+        default=os.path.join(DIRECTORY, 'example', 'iteration0'),
+        help='working directory to read')
+    parser.add_argument('--corrections',
+        default=os.path.join(DIRECTORY, 'example', 'corrections.txt'),
+        help='row/column corrections file to apply')
+    parser.add_argument('--synthetic', action='store_true',
+        help='generate library files instead of locating them as usual')
+    parser.add_argument('-n', '--scale', type=int, default=1,
+        help='number of copies of the detectors to process')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help='number of times to run each stage')
+    parser.add_argument('-s', '--stage', action='append', dest='stages',
+        help='only run the named stage(s)')
+    parser.add_argument('-o', '--output', help='file to write JSON results to')
+    parser.add_argument('--compare', metavar='JSON',
+        help='earlier results to compare against')
+    return parser.parse_args()
+
+def print_results(results, previous=None):
+    """Print a table of results, with ratios to previous results if given."""
+    print '{:<20}{:>12}{:>12}{:>10}'.format('stage', 'min ms', 'median ms',
+        'vs old' if previous else '')
+    for name, setup, needs_root in Suite.STAGES:
+        result = results.get(name)
+        if result is None:
+            continue
+        if 'skipped' in result:
+            print '{:<20}{:>12}'.format(name, 'skipped')
+            continue
+        ratio = ''
+        old = (previous or {}).get(name, {})
+        if old.get('min'):
+            ratio = '{:.2f}x'.format(result['min'] / old['min'])
+        print '{:<20}{:>12.2f}{:>12.2f}{:>10}'.format(name,
+            result['min'] * 1000., result['median'] * 1000., ratio)
+
+if __name__ == '__main__':
+    args = parse()
+    # Paths may be relative to the current directory, which can change.
+    for name in 'input', 'corrections', 'output', 'compare':
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    scratch = tempfile.mkdtemp(prefix='fmsbenchmark')
+    cwd = os.getcwd()
+    try:
+        if args.synthetic:
+            library = os.path.join(scratch, 'library')
+            os.mkdir(library)
+            synthesise(args.input, library)
+            # The current directory is searched for library files first.
+            os.chdir(library)
+        suite = Suite(args.input, corrections.read(args.corrections),
+                      args.scale, scratch)
+        root = root_available()
+        results = suite.run(args.repeat, args.stages, root)
+    except IOError as err:
+        print >> sys.stderr, 'benchmark:', err
+        sys.exit(1)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    output = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'host': platform.node(),
+              'python': platform.python_version(),
+              'root': root, 'synthetic': args.synthetic,
+              'scale': args.scale, 'repeat': args.repeat,
+              'results': results}
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)['results']
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=1, sort_keys=True)
@@ -2,25 +2,18 @@
 
 import math # For isnan, isinfo, floor...
 
-# I encountered the WEIRDEST bug importing from ROOT.
-# The programme worked fine on my Mac, and generally fine on a remote Linux
-# computer, to which I ssh'd. However, if I used Cmd-tab to move away from
-# the X11 window displaying the programme from the remove machine, when I
-# returned the window was completely unresponsive.
-# After much head-scratching, I found this was remedied by replacing all
-#   from ROOT import <something>
-# with just
-#   import ROOT
-# No idea why it should interfere with X11, but it does, at least for me.
-import ROOT
-# Only operate ROOT in batch mode to avoid some crashes I experienced on
-# RCF when using the programme over ssh.
-ROOT.gROOT.SetBatch(True)
-# May give to speed up on ROOT calls.
-ROOT.SetSignalPolicy(ROOT.kSignalFast)
+# ROOT is only imported when a calibration curve is first evaluated.
+from rootlib import ROOT
 
+import fms.cellid as cellid
+import instrument
 import qt
 
+# Maximum number of ADC values for which each Channel memoizes the voltage.
+# Requested ADCs are floats, so in a long-lived process they would
+# otherwise accumulate without limit.
+VOLTAGE_MEMO_SIZE = 256
+
 class Channel(object):
     """Base class for gain calibration curves.
     
@@ -45,6 +38,10 @@ class Channel(object):
         if string:
             self.set(string)
         self.function = None
+        # ADC at the minimum and maximum voltages, see adc_range().
+        self.limits = None
+        # Memoized curve evaluations, see get_adc() and get_voltage_for_adc().
+        self.adcs, self.voltages = {}, {}
 
     def set(self, string):
         """Sets all attributes via a string.
@@ -60,11 +57,25 @@ class Channel(object):
             # Set calibration curve parameters from the last three elements
             self.p = [float(i) for i in values[3:6]]
             self.function = None
+            self.limits = None
+            self.adcs, self.voltages = {}, {}
             return True
         except IndexError:
             print 'calibration.Channel passed improperly formatted string:'
             print string
 
+    def values(self):
+        """Returns (detector, row, column, p0, p1, p2)."""
+        return (self.detector, self.row, self.column) + tuple(self.p)
+
+    @classmethod
+    def from_values(cls, values):
+        """Returns a channel initialised from a tuple returned by values()."""
+        channel = cls()
+        channel.detector, channel.row, channel.column = values[:3]
+        channel.p = list(values[3:6])
+        return channel
+
     @classmethod
     def min_voltage(cls, bitshift=0):
         """Returns the minimum voltage for the parameterisation curve."""
@@ -93,17 +104,37 @@ class Channel(object):
         """Evaluates the ADC value at the input voltage.
         
         Returns None if the input voltage cannot be evaluated for some reason.
+        Results are memoized, as the same voltages are evaluated repeatedly
+        (voltages are integers, so the number of distinct values is small).
         
         """
         # Large cells store negative voltage values, but the calibration
         # curves are always stored in terms of positive voltages.
         voltage = abs(voltage)
+        try:
+            return self.adcs[voltage]
+        except KeyError:
+            pass
+        instrument.count('ROOT.TF1.Eval')
         adc = self.get_function().Eval(voltage)
         # Check for error values
         if adc < 0. or math.isnan(adc) or math.isinf(adc):
             adc = None
+        self.adcs[voltage] = adc
         return adc
 
+    def adc_range(self):
+        """Returns the ADC values at the minimum and maximum voltages.
+        
+        These are evaluated once and then cached, as they are needed for
+        every voltage lookup.
+        
+        """
+        if not self.limits:
+            self.limits = (self.get_adc(self.min_voltage()),
+                           self.get_adc(self.max_voltage()))
+        return self.limits
+
     def get_voltage_for_adc(self, adc):
         """Returns the voltage required to obtain the requested ADC value.
         
@@ -112,18 +143,29 @@ class Channel(object):
         If the voltage is outside the valid range for the cell, or if the
         ADC cannot be evaluated for some reason, returns None.
         Otherwise returns the ADC value as an integer.
+        Results are memoized by ADC value, up to VOLTAGE_MEMO_SIZE values,
+        after which the memo is cleared.
         
         """
+        try:
+            return self.voltages[adc]
+        except KeyError:
+            pass
         # Find the minimum and maximum ADCs achievable by the cell
-        minadc = self.get_adc(self.min_voltage())
-        maxadc = self.get_adc(self.max_voltage())
-        if not minadc < adc < maxadc:
-            return None
-        v = self.get_function().GetX(adc)
-        if math.isnan(v) or math.isinf(v):
-            return None
-        # GetX() returns a float, so round to the nearest integer value
-        return int(round(v))
+        minadc, maxadc = self.adc_range()
+        v = None
+        if minadc < adc < maxadc:
+            instrument.count('ROOT.TF1.GetX')
+            v = self.get_function().GetX(adc)
+            if math.isnan(v) or math.isinf(v):
+                v = None
+            else:
+                # GetX() returns a float, so round to the nearest integer
+                v = int(round(v))
+        if len(self.voltages) >= VOLTAGE_MEMO_SIZE:
+            self.voltages.clear()
+        self.voltages[adc] = v
+        return v
 
 
 class ChannelSmall(Channel):
@@ -175,17 +217,35 @@ class Table:
         memory in a single table.
         
         """
-        # Dictionary of calibration curves keyed by (detector, row, column)
-        self.entries = {}
+        # List of calibration curves indexed by cell ID (see fms.cellid),
+        # with None where there is no curve
+        self.entries = [None] * cellid.COUNT
         if large_file:
-            entries = [ChannelLarge(line) for line in large_file.readlines()]
-            self.entries.update({(e.detector, e.row, e.column): e
-                                for e in entries})
+            self.add([ChannelLarge(line) for line in large_file.readlines()])
         if small_file:
-            entries = [ChannelSmall(line) for line in small_file.readlines()]
-            self.entries.update({(e.detector, e.row, e.column): e
-                                for e in entries})
+            self.add([ChannelSmall(line) for line in small_file.readlines()])
+        
+    @classmethod
+    def from_values(cls, large, small):
+        """Returns a table from lists of ChannelLarge and ChannelSmall
+        values() tuples."""
+        table = cls()
+        table.add([ChannelLarge.from_values(v) for v in large] +
+                  [ChannelSmall.from_values(v) for v in small])
+        return table
+
+    def add(self, channels):
+        """Add calibration curves, replacing any for the same cells.
         
+        Curves for positions outside the detectors are ignored.
+        
+        """
+        for channel in channels:
+            id = cellid.from_position(channel.detector, channel.row,
+                                      channel.column)
+            if id is not None:
+                self.entries[id] = channel
+
     def find(self, detector, row, column):
         """Returns the calibration curve for a detector channel.
         
@@ -193,20 +253,128 @@ class Table:
         column can be located.
         
         """
-        try:
-            return self.entries[detector, row, column]
-        except KeyError:
+        return self.find_id(cellid.from_position(detector, row, column))
+
+    def find_id(self, id):
+        """Returns the calibration curve for a cell ID, or None."""
+        if id is None:
             return None
+        return self.entries[id]
 
     def find_cell(self, cell):
         """Returns the calibration curve corresponding to the input Cell."""
-        return self.find(cell.detector, cell.row, cell.column)
+        if cell.id is None:
+            return self.find(cell.detector, cell.row, cell.column)
+        return self.entries[cell.id]
 
 # A list of locked bitshifts.
 # Input cells with any of these bitshifts will not be modified by optimise().
 LOCKED_BITSHIFTS = [-5]
 
-def optimise(cell, newgain):
+# Outcomes of solve().
+# The cell has a locked bitshift and was not changed.
+LOCKED = 'locked'
+# The requested gain was achieved.
+OPTIMAL = 'optimal'
+# The requested gain was out of reach, so the voltage and bitshift were
+# set to their limits.
+CLAMPED = 'clamped'
+
+# Bitshifts in the order solve() tries them: by increasing magnitude, with
+# negative before positive, e.g. [0, -1, 1, -2, 2, ...].
+SEARCH_ORDER = sorted(qt.VALID_BITSHIFTS, key=abs)
+
+class RootEngine(object):
+    """Evaluates calibration curves with ROOT, via Channel.
+    
+    This is the reference implementation.
+    
+    """
+    name = 'root'
+
+    def adc(self, channel, voltage):
+        """Returns the ADC at a voltage, or None. See Channel.get_adc()."""
+        return channel.get_adc(voltage)
+
+    def voltage_for_adc(self, channel, adc):
+        """Returns the integer voltage giving an ADC value, or None.
+        
+        See Channel.get_voltage_for_adc().
+        
+        """
+        return channel.get_voltage_for_adc(adc)
+
+
+class AnalyticEngine(object):
+    """Evaluates calibration curves in closed form without ROOT.
+    
+    ADC = exp(p0 + p1*V + p2*V^2) is inverted by solving the quadratic
+    p2*V^2 + p1*V + p0 - log(ADC) = 0 for V in the curve's voltage range,
+    rather than by the numerical root-finding of TF1::GetX().
+    This is much faster, which matters when re-optimising every cell
+    interactively.
+    
+    """
+    name = 'analytic'
+
+    def adc(self, channel, voltage):
+        """Returns the ADC at a voltage, or None if it can't be evaluated."""
+        p0, p1, p2 = channel.p
+        voltage = abs(voltage)
+        try:
+            adc = math.exp(p0 + p1 * voltage + p2 * voltage * voltage)
+        except OverflowError:
+            return None
+        if math.isnan(adc) or math.isinf(adc):
+            return None
+        return adc
+
+    def voltage_for_adc(self, channel, adc):
+        """Returns the integer voltage giving an ADC value, or None.
+        
+        Returns None if the ADC is outside the range reachable within the
+        curve's voltage limits.
+        
+        """
+        vmin, vmax = channel.min_voltage(), channel.max_voltage()
+        minadc = self.adc(channel, vmin)
+        maxadc = self.adc(channel, vmax)
+        if minadc is None or maxadc is None or not minadc < adc < maxadc:
+            return None
+        p0, p1, p2 = channel.p
+        c = p0 - math.log(adc)
+        if p2 == 0.:
+            if p1 == 0.:
+                return None
+            roots = [-c / p1]
+        else:
+            discriminant = p1 * p1 - 4. * p2 * c
+            if discriminant < 0.:
+                return None
+            root = math.sqrt(discriminant)
+            roots = sorted([(-p1 - root) / (2. * p2),
+                            (-p1 + root) / (2. * p2)])
+        for v in roots:
+            if vmin <= v <= vmax:
+                return int(round(v))
+        return None
+
+
+# Available engines, keyed by name.
+ENGINES = {'root': RootEngine(), 'analytic': AnalyticEngine()}
+
+# Name of the engine used when none is specified.
+DEFAULT_ENGINE = 'root'
+
+def get_engine(engine=None):
+    """Returns an engine object from a name, an engine, or None (default)."""
+    if engine is None:
+        engine = DEFAULT_ENGINE
+    if isinstance(engine, basestring):
+        return ENGINES[engine]
+    return engine
+
+def optimise(cell, newgain, engine=None):
     """Returns the optimal voltage and bitshift that give the desired gain.
     
     If the gain can be achieved with multiple voltage/bitshift
@@ -215,38 +383,55 @@ def optimise(cell, newgain):
     If no combination exists that can achieve the gain, returns None for
     both values.
     
+    """
+    return solve(cell, newgain, engine)[:3]
+
+def solve_many(cells, newgains, engine=None):
+    """Returns solve() results for a list of cells and requested gains.
+    
+    This is a convenience that calls solve() for each cell in turn,
+    looking up the engine only once.
+    
+    """
+    engine = get_engine(engine)
+    return [solve(cell, gain, engine) for cell, gain in zip(cells, newgains)]
+
+def solve(cell, newgain, engine=None):
+    """Returns the optimal voltage, bitshift and gain, and the outcome.
+
+    As optimise(), but also returns one of LOCKED, OPTIMAL or CLAMPED
+    describing how the result was reached.
+    The calibration curves are evaluated by the named engine (see ENGINES),
+    or the DEFAULT_ENGINE if None.
+
     """
     # First, skip the cell if it has a locked bitshift.
     if cell.qt.bitshift in LOCKED_BITSHIFTS:
         # Return existing values.
-        return cell.voltage, cell.qt.bitshift, cell.gain
+        return cell.voltage, cell.qt.bitshift, cell.gain, LOCKED
+    engine = get_engine(engine)
     calibration = cell.calibration
     # Gain = normalisation * ADC * 2^bitshift
     # The normalisation is determined by the current gain/ADC of the cell.
-    norm = cell.gain / calibration.get_adc(cell.voltage)
-    # Collect the bitshift/voltage combinations that allow us to
-    # achieve the desired gain
-    valid = []
-    for shift in qt.VALID_BITSHIFTS:
+    norm = cell.gain / engine.adc(calibration, cell.voltage)
+    # Look for a bitshift/voltage combination that allows us to achieve
+    # the desired gain. Bitshifts are tried in order of increasing
+    # magnitude, so the first valid combination is the one we want.
+    v, shift, gain = None, None, newgain
+    for trial in SEARCH_ORDER:
         # Find the ADC required to give the desired gain at each bitshift,
         # accounting for the change in bitshift
         try:
-            adc = newgain / norm / math.pow(2., shift - cell.qt.bitshift)
-            v = calibration.get_voltage_for_adc(adc)
-            if not cell.is_valid_voltage(v, shift):
-                continue;
-            valid.append((v, shift))
+            adc = newgain / norm / math.pow(2., trial - cell.qt.bitshift)
+            trialv = engine.voltage_for_adc(calibration, adc)
+            if cell.is_valid_voltage(trialv, trial):
+                v, shift = trialv, trial
+                break
         except ZeroDivisionError:
             print 'cell', cell.detector, cell.channel, cell.row, cell.column, cell.voltage
-            print 'newgain', newgain, 'norm', norm, 'shift', shift, 'cell.qt.bitshift', cell.qt.bitshift
-    v, shift, gain = None, None, newgain
-    # Sort (voltage, bitshift) pairs by absolute value of bitshift.
-    # Bitshifts become ordered sush that for example [-2, -1, 0, 1, 2]
-    # would become [0, -1, 1, -2, 2].
-    valid.sort(key=lambda x: abs(x[1]))
-    if valid:
-        v = valid[0][0]
-        shift = valid[0][1]
+            print 'newgain', newgain, 'norm', norm, 'shift', trial, 'cell.qt.bitshift', cell.qt.bitshift
+    if v is not None:
+        outcome = OPTIMAL
     else:
         # If we didn't find a valid voltage, the gain was either too high
         # or low to be achieved. Set both the voltage and bitshift to
@@ -260,5 +445,7 @@ def optimise(cell, newgain):
             # We want an increased gain, set voltage and bitshift to max.
             shift = qt.VALID_BITSHIFTS[-1]
             v = cell.max_voltage(shift)
-        gain = norm * calibration.get_adc(v) * math.pow(2., shift - oldshift)
-    return v, shift, gain
\ No newline at end of file
+        gain = norm * engine.adc(calibration, v) * \
+               math.pow(2., shift - oldshift)
+        outcome = CLAMPED
+    return v, shift, gain, outcome
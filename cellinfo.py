@@ -1,7 +1,5 @@
 """Cell summary information."""
 
-from Tkinter import *
-
 import calibration
 import fms.cell
 
@@ -60,6 +58,25 @@ class Cell:
         # For consistency with that, we store it internally here as [0, 10].
         self.qtslot -= 1
 
+    # Names of the attributes set from the table, in column order.
+    FIELDS = ['detector', 'channel', 'row', 'column', 'qtcrate', 'qtslot',
+              'qtdaughtercard', 'qtdaughterchannel', 'id1', 'id2', 'id3', 'id4']
+
+    def values(self):
+        """Returns a tuple of the attributes named in FIELDS.
+
+        The QT slot is in the internal range [0, 10].
+        """
+        return tuple(getattr(self, name) for name in Cell.FIELDS)
+
+    @classmethod
+    def from_values(cls, values):
+        """Returns a Cell initialised from a tuple returned by values()."""
+        cell = cls()
+        cell.__dict__.update(zip(Cell.FIELDS, values))
+        cell.qtchannel = 8 * cell.qtdaughtercard + cell.qtdaughterchannel
+        return cell
+
     def to_string(self):
         # Print the last entry as a hexadecimal if this is a small cell.
         id4 = self.id4
@@ -77,6 +94,26 @@ class Table:
     def __init__(self, filename='fmsCellInfoTable.txt'):
         with open(filename) as file:
             self.entries = [Cell(line) for line in file.readlines()]
+        # Index of entries by hardware address, see from_address().
+        self.addresses = {}
+        for entry in self.entries:
+            if entry.id1 >= 7005:
+                # Large cell: LeCroy telnet, slot, channel
+                key = ('large', entry.id1, entry.id3, entry.id4)
+            else:
+                # Small cell: device, chip, channel, address
+                # Note offset of 1 between id1 stored in table and device
+                key = ('small', entry.id1 - 1, entry.id2, entry.id3,
+                       entry.id4)
+            self.addresses.setdefault(key, entry)
+
+    def find_large(self, telnet, slot, channel):
+        """Returns the entry for a LeCroy address, or None."""
+        return self.addresses.get(('large', telnet, slot, channel))
+
+    def find_small(self, device, chip, channel, address):
+        """Returns the entry for a small cell address, or None."""
+        return self.addresses.get(('small', device, chip, channel, address))
 
     def from_address(self, obj):
         """Locate a cell via address information.
@@ -85,30 +122,26 @@ class Table:
         Finds Large cells via lecroy telnet/slot/channel.
         """
         if isinstance(obj, fms.cell.Large):
-            for entry in self.entries:
-                if entry.id1 == obj.lecroy.telnet and \
-                   entry.id3 == obj.lecroy.slot and \
-                   entry.id4 == obj.lecroy.channel:
-                    return entry
+            return self.find_large(obj.lecroy.telnet, obj.lecroy.slot,
+                                   obj.lecroy.channel)
         elif isinstance(obj, fms.cell.Small):
-            for entry in self.entries:
-                # Note offset of 1 between id1 stored in table and device
-                if entry.id1 == (1 + obj.device) and entry.id2 == obj.chip and \
-                   entry.id3 == obj.channel and entry.id4 == obj.address:
-                    return entry
+            return self.find_small(obj.device, obj.chip, obj.channel,
+                                   obj.address)
         return None
 
     def view(self, root=None):
         """Create a window containing table contents."""
+        # Only import Tkinter here, so the table can be used without it.
+        import Tkinter as tk
         if root == None:
-            root = Tk()
-        scrollbar = Scrollbar(root)
-        scrollbar.pack(side=RIGHT, fill=Y)
-        listbox = Listbox(root, yscrollcommand=scrollbar.set,
+            root = tk.Tk()
+        scrollbar = tk.Scrollbar(root)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        listbox = tk.Listbox(root, yscrollcommand=scrollbar.set,
             height=30, width=120,
             font=('Courier', '14'))
         for entry in self.entries:
-            listbox.insert(END, entry.to_string())
-        listbox.pack(side=TOP, fill=NONE)
+            listbox.insert(tk.END, entry.to_string())
+        listbox.pack(side=tk.TOP, fill=tk.NONE)
         scrollbar.config(command=listbox.yview)
-        mainloop()
+        tk.mainloop()
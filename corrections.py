@@ -0,0 +1,209 @@
+"""Reading, checking and merging gain correction files.
+
+Corrections are read in one of two formats, both with four columns:
+ detector row column factor
+which is what Detector.corrections() expects, or Steve's format
+ eastOrWest detector channel factor
+which is converted to the first. The format of a file can be guessed
+with AUTO, so Steve's files can be used directly without first running
+scripts/toRowColumn.py. Some files fit both formats, in which case AUTO
+raises ValueError and the format must be given.
+
+Corrections are parsed to a dictionary of factors keyed by
+(detector, row, column), which Session.factor_corrections() accepts.
+Several sets of factors can be combined with merge().
+"""
+
+import math
+
+import fms.cellid as cellid
+
+# Names of the supported file formats.
+ROW_COLUMN = 'rowcol'
+STEVE = 'steve'
+AUTO = 'auto'
+FORMATS = [ROW_COLUMN, STEVE, AUTO]
+
+# Names of the ways of combining several sets of corrections.
+PRODUCT = 'product'
+GEOMETRIC = 'geometric'
+METHODS = [PRODUCT, GEOMETRIC]
+
+def fits_row_column(words):
+    """Returns True if the words of a line are a row/column position."""
+    return cellid.from_position(*[int(i) for i in words[:3]]) is not None
+
+def fits_steve(words):
+    """Returns True if the words of a line are a position in Steve's format.
+
+    East (1) lines are dropped, so only their detector number is checked.
+
+    """
+    side, detector, channel = [int(i) for i in words[:3]]
+    if side == 1:
+        return detector != 0
+    return side == 2 and cellid.from_channel(detector, channel) is not None
+
+def guess_format(lines):
+    """Returns STEVE or ROW_COLUMN for the format of some lines.
+
+    Returns None if every line fits both formats, e.g. Steve's lines
+    for channels below the number of columns, and ROW_COLUMN if the
+    lines fit neither (or there are none), so their errors are reported
+    when they are read.
+
+    """
+    formats = set([ROW_COLUMN, STEVE])
+    checked = False
+    for line in lines:
+        words = line.split()
+        if len(words) < 4:
+            continue
+        checked = True
+        if not fits_row_column(words):
+            formats.discard(ROW_COLUMN)
+        if not fits_steve(words):
+            formats.discard(STEVE)
+        if len(formats) < 2:
+            break
+    if checked and len(formats) == 2:
+        return None
+    if formats == set([STEVE]):
+        return STEVE
+    return ROW_COLUMN
+
+def check_format(lines, format):
+    """Returns the format of some lines, guessing it if format is AUTO.
+
+    Raises ValueError if format is unknown, or is AUTO and the lines fit
+    both formats.
+
+    """
+    if format not in FORMATS:
+        raise ValueError('Unknown corrections format ' + repr(format))
+    if format != AUTO:
+        return format
+    guess = guess_format(lines)
+    if guess is None:
+        raise ValueError('Corrections fit both row/column and Steve\'s '
+                         'format, give the format explicitly')
+    return guess
+
+def parse_row_column(lines):
+    """Returns {(detector, row, column): factor} from row/column lines.
+
+    If a cell is listed more than once the last entry is used.
+
+    """
+    factors = {}
+    for line in lines:
+        words = line.split()
+        if words:
+            factors[(int(words[0]), int(words[1]), int(words[2]))] = \
+                float(words[3])
+    return factors
+
+def parse_steve(lines):
+    """Returns {(detector, row, column): factor} from Steve's format.
+
+    Lines for the FPD, which start with 1 (east), are dropped.
+    If a channel is listed more than once the last entry is used.
+
+    """
+    factors = {}
+    for line in lines:
+        words = line.split()
+        if not words or words[0] == '1':
+            continue
+        detector, channel = int(words[1]), int(words[2])
+        row, column = cellid.GEOMETRY[detector].position(channel)
+        factors[(detector, row, column)] = float(words[3])
+    return factors
+
+def parse(lines, format=ROW_COLUMN):
+    """Returns {(detector, row, column): factor} from lines in a format.
+
+    Raises ValueError if format is AUTO and the lines fit both formats.
+
+    """
+    if check_format(lines, format) == STEVE:
+        return parse_steve(lines)
+    return parse_row_column(lines)
+
+def to_lines(factors):
+    """Returns row/column format lines for a dictionary of factors."""
+    return ['{} {} {} {}'.format(detector, row, column, factor)
+            for (detector, row, column), factor in sorted(factors.iteritems())]
+
+def from_steve(lines):
+    """Returns row/column format lines from lines in Steve's format."""
+    return to_lines(parse_steve(lines))
+
+def exists(detector, row, column):
+    """Returns True if there is a cell at a position."""
+    id = cellid.from_position(detector, row, column)
+    return id is not None and cellid.EXISTS[id]
+
+def invalid(factors):
+    """Returns the sorted (detector, row, column) of factors with no cell."""
+    return sorted(key for key in factors if not exists(*key))
+
+def valid(factors):
+    """Returns the factors for positions that have a cell.
+
+    Steve's files list every position, with 0 where there is no cell.
+
+    """
+    return {key: factor for key, factor in factors.iteritems()
+            if exists(*key)}
+
+def merge(sources, method=PRODUCT, weights=None):
+    """Combine several dictionaries of factors into one.
+
+    PRODUCT multiplies the factors for each cell, as if the corrections
+    were applied one after the other. GEOMETRIC takes the weighted
+    geometric mean of the factors for each cell, over the sources
+    listing that cell, leaving out factors that aren't positive (which
+    can't be applied). Weights default to 1.
+
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown merge method ' + repr(method))
+    if weights is None:
+        weights = [1.] * len(sources)
+    if len(weights) != len(sources):
+        raise ValueError('{} weights given for {} sources'.format(
+            len(weights), len(sources)))
+    if method == PRODUCT:
+        merged = {}
+        for factors in sources:
+            for key, factor in factors.iteritems():
+                merged[key] = merged.get(key, 1.) * factor
+        return merged
+    # Sums of weighted log factors and of weights for each cell.
+    logs, totals = {}, {}
+    for factors, weight in zip(sources, weights):
+        for key, factor in factors.iteritems():
+            if factor <= 0.:
+                continue
+            logs[key] = logs.get(key, 0.) + weight * math.log(factor)
+            totals[key] = totals.get(key, 0.) + weight
+    return {key: math.exp(logs[key] / totals[key]) for key in logs
+            if totals[key]}
+
+def load(filename, format=AUTO):
+    """Returns {(detector, row, column): factor} read from a file."""
+    with open(filename) as file:
+        return parse(file.read().splitlines(), format)
+
+def read(filename, format=ROW_COLUMN):
+    """Returns the lines of a corrections file in row/column format.
+
+    Blank lines are skipped.
+
+    """
+    with open(filename) as file:
+        lines = [line for line in file.read().splitlines() if line.strip()]
+    if check_format(lines, format) == STEVE:
+        lines = from_steve(lines)
+    return lines
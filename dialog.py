@@ -7,6 +7,7 @@ from Tkinter import *
 import tkMessageBox
 
 from fms.cell import Large, Small
+from fms.detector import Correction, VoltageOffset
 import calibration
 import qt
 
@@ -101,12 +102,14 @@ class CellDialog(Dialog):
         self.bitshiftscale.config(state=DISABLED)
         self.entry_volt.config(state=DISABLED)
         self.entry_gain.config(state=NORMAL)
+        self.predict()
         
     def enable_voltage_change(self):
         """Enables setting of voltage Entry by user."""
         self.bitshiftscale.config(state=NORMAL)
         self.entry_volt.config(state=NORMAL)
         self.entry_gain.config(state=DISABLED)
+        self.predict()
 
     def make_radio(self, gridrow):
         """Create the voltage/gain radio buttons"""
@@ -174,17 +177,26 @@ class CellDialog(Dialog):
         self.make_radio(gridrow)
         gridrow += 1
         # Label and entry box for voltage.
-        self.entry_volt = Entry(self.frame, font=LABEL_FONT, width=10)
+        self.volt_text = StringVar()
+        self.entry_volt = Entry(self.frame, font=LABEL_FONT, width=10,
+                                textvariable=self.volt_text)
         self.entry_volt.grid(row=gridrow, column=1)
         Label(self.frame, text="Voltage", font=LABEL_FONT, justify=LEFT).grid(
             row=gridrow, column=0)
         gridrow += 1
         # Label and entry box for gain.
-        self.entry_gain = Entry(self.frame, font=LABEL_FONT, width=10)
+        self.gain_text = StringVar()
+        self.entry_gain = Entry(self.frame, font=LABEL_FONT, width=10,
+                                textvariable=self.gain_text)
         self.entry_gain.grid(row=gridrow, column=1)
         Label(self.frame, text="Gain", font=LABEL_FONT, justify=LEFT).grid(
             row=gridrow, column=0)
         gridrow += 1
+        # Live prediction of the result of the voltage/bitshift or gain
+        # entered, updated as the user types.
+        self.prediction = Label(self.frame, font=LABEL_FONT, justify=LEFT)
+        self.prediction.grid(row=gridrow, column=0, columnspan=2)
+        gridrow += 1
         # Standard cell information.
         gridrow = self.labels(
             [cell.detector, cell.channel, cell.row, cell.column],
@@ -220,8 +232,48 @@ class CellDialog(Dialog):
         self.bitshiftscale.grid(row=gridrow, column=1)
         # Initialise all entries
         self.reset()
+        # Update the prediction whenever any input changes.
+        for variable in self.volt_text, self.gain_text, self.bitshift:
+            variable.trace('w', self.predict)
+        self.predict()
         return self.entry_volt # initial focus
 
+    def predict(self, *args):
+        """Show the outcome of the current input without applying it.
+        
+        In voltage mode shows the gain the voltage and bitshift would give.
+        In gain mode shows the voltage and bitshift needed for the gain.
+        The calibration curve evaluations are memoized by the cell's
+        calibration.Channel, so repeated predictions are cheap.
+        
+        """
+        cell = self.cell
+        try:
+            if self.radio.get() == 'Gain':
+                gain = float(self.gain_text.get())
+                if not gain > 0. or math.isinf(gain):
+                    raise ValueError
+                volt, shift, gain, outcome = calibration.solve(cell, gain)
+                text = 'Needs voltage {} bitshift {}'.format(
+                    cell.voltage_int_to_str(volt), shift)
+                if outcome == calibration.CLAMPED:
+                    text += '\n(limit reached, gain {:.3f})'.format(gain)
+                elif outcome == calibration.LOCKED:
+                    text = 'Bitshift is locked'
+            else:
+                volt = cell.voltage_str_to_int(self.volt_text.get())
+                shift = self.bitshift.get()
+                gain = cell.compute_gain(volt, shift)
+                if not cell.is_valid_voltage(volt, shift):
+                    text = 'Voltage out of range'
+                elif gain is None:
+                    text = 'Gain cannot be computed'
+                else:
+                    text = 'Gives gain {:.3f}'.format(gain)
+        except (ValueError, TypeError, ZeroDivisionError):
+            text = 'Invalid input'
+        self.prediction.config(text=text)
+
     def validate(self):
         """Check that user input was valid"""
         # Each Entry stores the input as a string, so we have to convert.
@@ -232,7 +284,8 @@ class CellDialog(Dialog):
         self.changes = []
         error = False
         # Validate the voltage and/or bitshift change
-        if not self.cell.is_valid_voltage(volt, self.bitshift.get()):
+        shift = self.bitshift.get()
+        if not self.cell.is_valid_voltage(volt, shift):
             vmin = self.cell.min_voltage(shift)
             vmax = self.cell.max_voltage(shift)
             tkMessageBox.showerror('WTF?!',
@@ -258,6 +311,13 @@ class CellDialog(Dialog):
                 'Gain cannot be manually changed at the same time ' +
                 'as voltage or bitshift')
             error = True
+        # The calibration curve may not give a gain at the new voltage.
+        elif ('volt' in self.changes or 'shift' in self.changes) and \
+            self.cell.compute_gain(volt, shift) is None:
+            tkMessageBox.showerror('Invalid input',
+                'Cannot compute the gain at voltage {}'.format(
+                    self.cell.voltage_int_to_str(volt)))
+            error = True
         # If we hit an error reset the dialog so the user can try again.
         # If we're OK, cache the input voltage and gain so we can apply().
         if error:
@@ -289,4 +349,295 @@ class CellDialog(Dialog):
             self.cell.gain = gain
             self.cell.voltage = self.inputvolt
             self.cell.qt.bitshift = self.bitshift.get()
-        self.modified = any(self.changes)
\ No newline at end of file
+        self.modified = any(self.changes)
+
+
+class BatchDialog(Dialog):
+    """Applies a gain factor or voltage offset to many cells at once.
+    
+    The user can preview the effect of the change before committing it.
+    
+    """
+    def __init__(self, parent, title, cells):
+        self.cells = cells
+        # The computed changes, one Correction per cell.
+        self.changes = []
+        # The (mode, value) the current changes were computed for.
+        self.computed = None
+        Dialog.__init__(self, parent, title)
+
+    def body(self):
+        """Construct the dialog contents"""
+        self.mode = StringVar()
+        self.mode.set('Gain')
+        Radiobutton(self.frame, variable=self.mode, text='Gain factor',
+            value='Gain', font=LABEL_FONT).grid(row=0, column=0)
+        Radiobutton(self.frame, variable=self.mode, text='Voltage offset',
+            value='Voltage', font=LABEL_FONT).grid(row=0, column=1)
+        Label(self.frame, text='Value', font=LABEL_FONT).grid(row=1, column=0)
+        self.entry = Entry(self.frame, font=LABEL_FONT, width=10)
+        self.entry.insert(0, '1.0')
+        self.entry.grid(row=1, column=1)
+        Button(self.frame, text='Preview', command=self.preview).grid(
+            row=2, column=0, columnspan=2)
+        self.summary = Label(self.frame, font=LABEL_FONT, justify=LEFT,
+            text='{} cells selected'.format(len(self.cells)))
+        self.summary.grid(row=3, column=0, columnspan=2)
+        return self.entry
+
+    def compute(self):
+        """Compute the changes for the current input.
+        
+        Returns False if the input is invalid.
+        
+        """
+        mode = self.mode.get()
+        try:
+            if mode == 'Gain':
+                value = float(self.entry.get())
+            else:
+                value = int(self.entry.get())
+        except ValueError:
+            tkMessageBox.showerror('Invalid input',
+                'Enter a gain factor or an integer voltage offset')
+            return False
+        if mode == 'Gain' and (value <= 0. or math.isinf(value)):
+            tkMessageBox.showerror('Invalid input', 'Invalid gain factor')
+            return False
+        if self.computed == (mode, value):
+            return True
+        if mode == 'Gain':
+            self.changes = [Correction(cell, value) for cell in self.cells]
+            Correction.compute_all(self.changes)
+        else:
+            self.changes = [VoltageOffset(cell, value) for cell in self.cells]
+            for change in self.changes:
+                change.compute()
+        self.computed = (mode, value)
+        return True
+
+    def preview(self):
+        """Show a summary of what the changes would do."""
+        if not self.compute():
+            return
+        results = [change.result() for change in self.changes]
+        applied = [change for change, result in zip(self.changes, results)
+                   if result != Correction.SKIPPED]
+        deltas = [change.voltage - change.cell.voltage for change in applied]
+        shifts = len([change for change in applied
+                      if change.bitshift != change.cell.qt.bitshift])
+        lines = [
+            '{:<18}{:>6}'.format('Changed', results.count(Correction.CHANGED)),
+            '{:<18}{:>6}'.format('Clamped', results.count(Correction.CLAMPED)),
+            '{:<18}{:>6}'.format('Skipped', results.count(Correction.SKIPPED)),
+            '{:<18}{:>6}'.format('Bitshift changes', shifts)]
+        if deltas:
+            lines.append('{:<18}{:>6}'.format('Min voltage change',
+                                              min(deltas)))
+            lines.append('{:<18}{:>6}'.format('Max voltage change',
+                                              max(deltas)))
+        self.summary.config(text='\n'.join(lines))
+
+    def validate(self):
+        return self.compute()
+
+    def apply(self):
+        """Commit the computed changes to the cells."""
+        results = [change.commit() for change in self.changes]
+        self.modified = any(i != Correction.SKIPPED for i in results)
+
+
+class ProgressDialog(Toplevel):
+    """Shows the progress of a long-running task, with a Cancel button.
+    
+    Unlike Dialog this does not block: the caller does the work in pieces
+    scheduled with after(), calling update_progress() after each one and
+    checking the cancelled attribute before starting the next.
+    
+    """
+    def __init__(self, parent, title, total):
+        Toplevel.__init__(self, parent)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.geometry("+{}+{}".format(
+            parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
+        self.transient(parent)
+        self.title(title)
+        self.resizable(FALSE, FALSE)
+        self.parent = parent
+        self.total = max(total, 1)
+        self.cancelled = False
+        self.label = Label(self, font=LABEL_FONT, width=30)
+        self.label.pack(padx=5, pady=5)
+        self.bar = Canvas(self, width=300, height=16, background='white')
+        self.bar.pack(padx=5)
+        self.fill = self.bar.create_rectangle(0, 0, 0, 16, fill='blue',
+                                              width=0)
+        Button(self, text="Cancel", width=10, command=self.cancel).pack(
+            padx=5, pady=5)
+        self.bind("<Escape>", self.cancel)
+        self.update_progress(0)
+        # Stop the user editing cells while the task runs.
+        self.wait_visibility()
+        self.grab_set()
+
+    def update_progress(self, done):
+        """Show that 'done' out of the total number of items are finished."""
+        done = min(done, self.total)
+        self.label.config(text='{} of {}'.format(done, self.total))
+        self.bar.coords(self.fill, 0, 0, 300 * done / self.total, 16)
+
+    def cancel(self, event=None):
+        """Flag the task as cancelled. The caller should then close()."""
+        self.cancelled = True
+
+    def close(self):
+        self.grab_release()
+        self.parent.focus_set()
+        self.destroy()
+
+
+class WhatIfDialog(Toplevel):
+    """Tries out a gain scale on many cells before committing to it.
+    
+    Moving the slider re-optimises the cells with the fast analytic
+    calibration engine and recolours the image window with the predicted
+    settings. Nothing is changed until Accept is pressed, when the
+    corrections are recomputed with the default engine and applied.
+    Unlike Dialog this does not block, so cells can still be selected
+    (e.g. an eta band) while it is open.
+    
+    """
+    def __init__(self, parent):
+        """Constructor.
+        
+        parent is the ImageWindow whose cells are corrected.
+        
+        """
+        Toplevel.__init__(self, parent)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.geometry("+{}+{}".format(
+            parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
+        self.transient(parent)
+        self.title('What if')
+        self.resizable(FALSE, FALSE)
+        self.parent = parent
+        # The latest trial corrections, one per cell in scope.
+        self.changes = []
+        # Whether an update is waiting to run.
+        self.pending = False
+        self.scale = DoubleVar()
+        self.scale.set(100.)
+        Scale(self, variable=self.scale, from_=50., to=200., resolution=0.5,
+              orient=HORIZONTAL, length=300, label='Gain scale (%)',
+              command=self.schedule).grid(row=0, column=0, columnspan=2)
+        self.scope = StringVar()
+        self.scope.set('all')
+        Radiobutton(self, variable=self.scope, text='All cells', value='all',
+            font=LABEL_FONT, command=self.schedule).grid(row=1, column=0)
+        Radiobutton(self, variable=self.scope, text='Selected cells',
+            value='selected', font=LABEL_FONT, command=self.schedule).grid(
+            row=1, column=1)
+        self.colour = StringVar()
+        self.colour.set('voltage')
+        Radiobutton(self, variable=self.colour, text='Voltage',
+            value='voltage', font=LABEL_FONT, command=self.schedule).grid(
+            row=2, column=0)
+        Radiobutton(self, variable=self.colour, text='Bitshift',
+            value='bitshift', font=LABEL_FONT, command=self.schedule).grid(
+            row=2, column=1)
+        self.summary = Label(self, font=LABEL_FONT, justify=LEFT)
+        self.summary.grid(row=3, column=0, columnspan=2)
+        box = Frame(self)
+        Button(box, text='Accept', width=10, command=self.accept).pack(
+            side=LEFT, padx=5, pady=5)
+        Button(box, text='Cancel', width=10, command=self.cancel).pack(
+            side=LEFT, padx=5, pady=5)
+        box.grid(row=4, column=0, columnspan=2)
+        self.bind("<Escape>", self.cancel)
+        self.update_preview()
+
+    def ids(self):
+        """Returns the canvas ids of the cells the scale applies to."""
+        if self.scope.get() == 'selected':
+            return list(self.parent.selection)
+        return self.parent.cells.keys()
+
+    def schedule(self, *args):
+        """Update the preview once pending Tk events are handled.
+        
+        The slider generates many events while dragged; coalescing them
+        means only the latest position is computed.
+        
+        """
+        if not self.pending:
+            self.pending = True
+            self.after_idle(self.update_preview)
+
+    def update_preview(self):
+        """Re-optimise the cells in scope and recolour the image window."""
+        self.pending = False
+        cells = self.parent.cells
+        ids = self.ids()
+        factor = self.scale.get() / 100.
+        self.changes = [Correction(cells[id], factor) for id in ids]
+        Correction.compute_all(self.changes, 'analytic')
+        # Cells outside the scope are shown with their current settings.
+        settings = {id: (cell.voltage, cell.qt.bitshift)
+                    for id, cell in cells.iteritems()}
+        for id, change in zip(ids, self.changes):
+            if change.result() != Correction.SKIPPED:
+                settings[id] = (change.voltage, change.bitshift)
+        if self.colour.get() == 'bitshift':
+            values = {id: shift for id, (_, shift) in settings.iteritems()}
+            self.parent.display_values('whatif-bitshift', 'Predicted bitshift',
+                values, qt.VALID_BITSHIFTS[0], qt.VALID_BITSHIFTS[-1])
+        else:
+            # Large and small cells have different voltage ranges, so show
+            # the voltage as a fraction of the cell's maximum.
+            values = {}
+            for id, (voltage, shift) in settings.iteritems():
+                vmax = cells[id].max_voltage(shift)
+                values[id] = float(voltage) / vmax if vmax else None
+            self.parent.display_values('whatif-voltage',
+                'Predicted voltage / maximum', values, 0., 1.)
+        self.summarise()
+
+    def summarise(self):
+        """Show counts of the cells affected by the trial scale."""
+        applied = [change for change in self.changes
+                   if change.result() != Correction.SKIPPED]
+        at_min = len([change for change in applied if change.voltage <=
+                      change.cell.min_voltage(change.bitshift)])
+        at_max = len([change for change in applied if change.voltage >=
+                      change.cell.max_voltage(change.bitshift)])
+        shifts = len([change for change in applied
+                      if change.bitshift != change.cell.qt.bitshift])
+        clamped = len([change for change in applied
+                       if change.result() == Correction.CLAMPED])
+        lines = [
+            '{:<18}{:>6}'.format('Cells', len(self.changes)),
+            '{:<18}{:>6}'.format('Skipped', len(self.changes) - len(applied)),
+            '{:<18}{:>6}'.format('At min voltage', at_min),
+            '{:<18}{:>6}'.format('At max voltage', at_max),
+            '{:<18}{:>6}'.format('Bitshift changes', shifts),
+            '{:<18}{:>6}'.format('Clamped', clamped)]
+        self.summary.config(text='\n'.join(lines))
+
+    def accept(self, event=None):
+        """Recompute the corrections with the default engine and apply them."""
+        if self.pending:
+            self.update_preview()
+        Correction.compute_all(self.changes)
+        results = [change.commit() for change in self.changes]
+        if any(i != Correction.SKIPPED for i in results):
+            self.parent.modified = True
+        self.close()
+
+    def cancel(self, event=None):
+        """Close without changing any cells."""
+        self.close()
+
+    def close(self):
+        self.parent.display_detector()
+        self.parent.canvas.focus_set()
+        self.destroy()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""Check that an alternate calibration engine gives the same results as ROOT.
+
+The example corrections, and a number of random sets of corrections,
+are applied to the same working directory with the reference engine and
+with the alternate engine (see calibration.ENGINES). For each cell the
+voltage, bitshift and gain are compared, and every output file is
+written for both and compared line by line. The time each engine takes
+to compute the corrections is reported side by side.
+
+The reference results can also be compared to an expected output
+directory, e.g. example/iteration1, made from the same input with the
+real library files.
+
+The exit status is 0 if all results agree within tolerance, otherwise 1.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import copy
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import benchmark
+import corrections
+import files
+from fms.detector import Correction
+import session
+
+# Directory containing this file, for locating the example data.
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+def random_corrections(fms, rng, spread):
+    """Returns random correction lines for every cell.
+
+    Factors are log-normally distributed with the given spread, with one
+    in twenty five times wider so that some cells reach their limits.
+
+    """
+    lines = []
+    for detector in fms.detectors.itervalues():
+        for cell in detector.cells:
+            width = spread * 5. if rng.random() < 0.05 else spread
+            factor = round(math.exp(rng.gauss(0., width)), 3)
+            lines.append('{} {} {} {}'.format(cell.detector, cell.row,
+                                              cell.column, factor))
+    return lines
+
+def apply(baseline, lines, engine):
+    """Apply corrections to a copy of the baseline with an engine.
+
+    Returns the session and the time taken to compute the corrections.
+
+    """
+    fms = copy.deepcopy(baseline)
+    changes = fms.corrections(lines)
+    start = timeit.default_timer()
+    Correction.compute_all(changes, engine)
+    elapsed = timeit.default_timer() - start
+    for change in changes:
+        change.commit()
+    return fms, elapsed
+
+def compare_cells(reference, alternate, voltage_tolerance, gain_tolerance):
+    """Returns a list of differences between the cells of two sessions.
+
+    Each difference is (detector, row, column, quantity, reference value,
+    alternate value). Voltages may differ by voltage_tolerance and gains
+    by a relative gain_tolerance.
+
+    """
+    differences = []
+    for number, detector in sorted(reference.detectors.iteritems()):
+        for i, j in zip(detector.cells, alternate.detectors[number].cells):
+            where = (i.detector, i.row, i.column)
+            if abs(i.voltage - j.voltage) > voltage_tolerance:
+                differences.append(where + ('voltage', i.voltage, j.voltage))
+            if i.qt.bitshift != j.qt.bitshift:
+                differences.append(where + ('bitshift', i.qt.bitshift,
+                                            j.qt.bitshift))
+            if abs(i.gain - j.gain) > gain_tolerance * abs(i.gain):
+                differences.append(where + ('gain', i.gain, j.gain))
+    return differences
+
+def compare_files(reference, alternate, names=files.OUTPUT_NAMES):
+    """Returns {file name: number of differing lines} for two directories.
+
+    Only files with differences are listed; a missing file counts as -1.
+
+    """
+    differences = {}
+    for name in names:
+        try:
+            with open(os.path.join(reference, name)) as file:
+                a = file.read().splitlines()
+            with open(os.path.join(alternate, name)) as file:
+                b = file.read().splitlines()
+        except IOError:
+            differences[name] = -1
+            continue
+        n = abs(len(a) - len(b)) + sum(i != j for i, j in zip(a, b))
+        if n:
+            differences[name] = n
+    return differences
+
+def check(baseline, lines, args, scratch, label):
+    """Run one set of corrections through both engines.
+
+    Returns a dictionary of results.
+
+    """
+    outputs = {}
+    results = {'corrections': label}
+    sessions = {}
+    for role, engine in ('reference', args.reference), \
+                        ('alternate', args.alternate):
+        fms, elapsed = apply(baseline, lines, engine)
+        directory = tempfile.mkdtemp(dir=scratch)
+        fms.save_all(directory, root=False)
+        sessions[role], outputs[role] = fms, directory
+        results[role + '_seconds'] = elapsed
+    cells = compare_cells(sessions['reference'], sessions['alternate'],
+                          args.voltage_tolerance, args.gain_tolerance)
+    results['cell_differences'] = len(cells)
+    results['examples'] = cells[:args.examples]
+    results['file_differences'] = compare_files(outputs['reference'],
+                                                outputs['alternate'])
+    results['reference_output'] = outputs['reference']
+    return results
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--input',
+        default=os.path.join(DIRECTORY, 'example', 'iteration0'),
+        help='working directory to read')
+    parser.add_argument('--corrections',
+        default=os.path.join(DIRECTORY, 'example', 'corrections.txt'),
+        help='row/column corrections file to apply')
+    parser.add_argument('--expected',
+        help='directory of expected output for --corrections from the '
+             'reference engine, e.g. example/iteration1')
+    parser.add_argument('--reference', default='root',
+        help='reference engine')
+    parser.add_argument('--alternate', default='analytic',
+        help='engine to check')
+    parser.add_argument('--random', type=int, default=10,
+        help='number of random correction sets')
+    parser.add_argument('--spread', type=float, default=0.2,
+        help='width of the random log gain factors')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--voltage-tolerance', type=int, default=0,
+        help='allowed voltage difference')
+    parser.add_argument('--gain-tolerance', type=float, default=1e-5,
+        help='allowed relative gain difference')
+    parser.add_argument('--examples', type=int, default=5,
+        help='number of differing cells to list per set')
+    parser.add_argument('--synthetic', action='store_true',
+        help='generate library files, as for benchmark.py')
+    parser.add_argument('--json', help='file to write results to')
+    return parser.parse_args()
+
+def print_results(results):
+    print '{:<28}{:>12}{:>12}{:>8}{:>8}  {}'.format('corrections',
+        'ref ms', 'alt ms', 'speedup', 'cells', 'files')
+    for r in results:
+        speedup = r['reference_seconds'] / max(r['alternate_seconds'], 1e-9)
+        print '{:<28}{:>12.2f}{:>12.2f}{:>7.1f}x{:>8}  {}'.format(
+            r['corrections'], r['reference_seconds'] * 1000.,
+            r['alternate_seconds'] * 1000., speedup, r['cell_differences'],
+            ', '.join('{} ({})'.format(name, n) for name, n in
+                      sorted(r['file_differences'].iteritems())) or 'same')
+        for example in r['examples']:
+            print '    detector {} row {} column {}: {} {} != {}'.format(
+                *example)
+
+if __name__ == '__main__':
+    args = parse()
+    for name in 'input', 'corrections', 'expected', 'json':
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    scratch = tempfile.mkdtemp(prefix='fmsequivalence')
+    cwd = os.getcwd()
+    try:
+        if args.synthetic:
+            library = os.path.join(scratch, 'library')
+            os.mkdir(library)
+            benchmark.synthesise(args.input, library)
+            os.chdir(library)
+        baseline = session.Session()
+        baseline.read_library()
+        missing = baseline.read_input(args.input)
+        if missing:
+            raise IOError('files not found: ' + ', '.join(missing))
+        results = [check(baseline, corrections.read(args.corrections), args,
+                         scratch, os.path.basename(args.corrections))]
+        rng = random.Random(args.seed)
+        for n in range(args.random):
+            results.append(check(baseline,
+                                 random_corrections(baseline, rng, args.spread),
+                                 args, scratch, 'random {}'.format(n)))
+        expected = None
+        if args.expected:
+            expected = compare_files(results[0]['reference_output'],
+                                     args.expected)
+    except IOError as err:
+        print >> sys.stderr, 'equivalence:', err
+        sys.exit(1)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    for r in results:
+        del r['reference_output']
+    print_results(results)
+    if expected is not None:
+        print 'reference vs {}: {}'.format(args.expected, ', '.join(
+            '{} ({})'.format(name, n) for name, n in
+            sorted(expected.iteritems())) or 'same')
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'reference': args.reference,
+                       'alternate': args.alternate,
+                       'results': results, 'expected': expected},
+                      file, indent=1, sort_keys=True)
+    failed = any(r['cell_differences'] or r['file_differences']
+                 for r in results) or bool(expected)
+    sys.exit(1 if failed else 0)
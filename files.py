@@ -51,6 +51,33 @@ INPUT_NAMES = {'GAIN_LARGE' : 'largeCellGains.txt',
                'QT3'        : 'qt3_tac.dat',
                'QT4'        : 'qt4_tac.dat'}
 
+def search_paths():
+    """Returns the existing directories searched for files, in order.
+
+    These are the current directory, <user home>/.fms and the directory
+    named by the FMSVOLTAGES environment variable, if set.
+    """
+    # Construct the directory names in the order to be searched.
+    names = [os.curdir, os.path.expanduser('~/.fms')]
+    # If the FMSVOLTAGES environment variable is set add
+    # that top directory as well.
+    if 'FMSVOLTAGES' in os.environ:
+        names.append(os.environ['FMSVOLTAGES'])
+    # Keep only those directories that exist.
+    return [path for path in names if os.path.exists(path)]
+
+def locate(name):
+    """Returns the path to a named file in the first of search_paths()
+    holding it, or None if none does.
+
+    Unlike Files(), this doesn't need the other library files.
+    """
+    for path in search_paths():
+        if os.path.exists(os.path.join(path, name)):
+            return os.path.join(path, name)
+    return None
+
+
 class Files:
     """
     Collects full path of all input files required to run the application.
@@ -96,15 +123,7 @@ class Files:
         Therefore the first entry is the directory that should be used.
         
         """
-        # Construct the directory names in the order to be searched.
-        names = [os.curdir, os.path.expanduser('~/.fms')]
-        # If the FMSVOLTAGES environment variable is set add
-        # that top directory as well.
-        if 'FMSVOLTAGES' in os.environ:
-            names.append(os.environ['FMSVOLTAGES'])
-        # Check for the existence of each of these are store only those
-        # that exist in self.paths.
-        self.paths = [path for path in names if os.path.exists(path)]
+        self.paths = search_paths()
 
     def locate(self, name, userpath=None):
         """Returns the full path to the named file.
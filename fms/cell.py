@@ -77,6 +77,8 @@ class Base(object):
         # Geometrical information
         self.detector, self.channel = -1, -1
         self.row, self.column = row, col
+        # Cell ID (see fms.cellid), set once the detector is known
+        self.id = None
         # Voltage (integer), gain (float) information
         self.voltage, self.gain = 0, 0.
         # QT system information
@@ -204,14 +206,18 @@ class Base(object):
         If the bitshift argument is None, the current bitshift of the cell
         is used.
         If the voltage argument is None, the current voltage is used.
+        Returns None if the calibration curve can't be evaluated at the
+        current or requested voltage.
         """
         gain = self.gain
         # Evaluate ADC at the current and requested voltages so we can find
         # the relative change in ADC (and hence gain) due to voltage change.
+        # get_adc() memoizes its results so repeated calls are cheap.
         if voltage:
-            function = self.calibration.get_function()
-            oldadc = function.Eval(self.voltage)
-            newadc = function.Eval(voltage)
+            oldadc = self.calibration.get_adc(self.voltage)
+            newadc = self.calibration.get_adc(voltage)
+            if oldadc is None or newadc is None:
+                return None
             gain *= newadc / oldadc
         # If the bitshift changes, apply another factor of 2^change
         if bitshift is not None:
@@ -247,7 +253,7 @@ class Small(Base):
            self.column >= self.geometry.ncolumns():
             self.channel = -1
         else:
-            self.channel = row * self.geometry.ncolumns() + col + 1
+            self.channel = self.geometry.channel(row, col)
 
         self.device = -1
         self.chip = -1
@@ -350,7 +356,7 @@ class Large(Base):
            self.column >= self.geometry.ncolumns():
             self.channel = -1
         else:
-            self.channel = row * self.geometry.ncolumns() + col + 1
+            self.channel = self.geometry.channel(row, col)
 
         self.lecroy = lecroytools.Channel()
 
@@ -0,0 +1,94 @@
+"""Dense integer IDs for the cell positions of all four detectors.
+
+Every (detector, row, column) position of detectors 1 to 4, including
+those in the hole and corners where there is no cell, has an ID in
+[0, COUNT). Each detector takes a consecutive block of IDs, in which
+the ID is the channel number less one, so
+ id = OFFSETS[detector] + channel - 1
+ channel = row * ncolumns + column + 1
+A list of COUNT values can therefore hold a value for every cell,
+indexed by ID, with EXISTS telling which IDs are cells.
+
+DETECTOR, ROW, COLUMN, CHANNEL and EXISTS are lists indexed by ID, so
+converting many IDs is a lookup per ID; see positions() and channels().
+Conversions to IDs return None for positions outside the detectors.
+"""
+
+import fms.geometry as fmsgeom
+
+# Geometry of each detector, by detector number.
+GEOMETRY = {1: fmsgeom.Large, 2: fmsgeom.Large,
+            3: fmsgeom.Small, 4: fmsgeom.Small}
+
+# (number of rows, number of columns) of each detector.
+SHAPES = {detector: (geometry.nrows(), geometry.ncolumns())
+          for detector, geometry in GEOMETRY.iteritems()}
+
+def layout():
+    """Returns the values of OFFSETS, DETECTOR, ROW, COLUMN, CHANNEL and
+    EXISTS."""
+    offsets = {}
+    detectors, rows, columns, channels, exists = [], [], [], [], []
+    for detector in sorted(GEOMETRY):
+        offsets[detector] = len(detectors)
+        table = GEOMETRY[detector].table()
+        nrows, ncolumns = SHAPES[detector]
+        for row in range(nrows):
+            for column in range(ncolumns):
+                detectors.append(detector)
+                rows.append(row)
+                columns.append(column)
+                channels.append(GEOMETRY[detector].channel(row, column))
+                exists.append(table.exists[row][column])
+    return offsets, detectors, rows, columns, channels, exists
+
+# First ID of each detector, and values indexed by ID.
+OFFSETS, DETECTOR, ROW, COLUMN, CHANNEL, EXISTS = layout()
+
+# Total number of IDs.
+COUNT = len(DETECTOR)
+
+def from_position(detector, row, column):
+    """Returns the ID of a (detector, row, column) position, or None."""
+    try:
+        nrows, ncolumns = SHAPES[detector]
+    except KeyError:
+        return None
+    if 0 <= row < nrows and 0 <= column < ncolumns:
+        return OFFSETS[detector] + row * ncolumns + column
+    return None
+
+def from_channel(detector, channel):
+    """Returns the ID of a (detector, channel) position, or None."""
+    try:
+        nrows, ncolumns = SHAPES[detector]
+    except KeyError:
+        return None
+    if 1 <= channel <= nrows * ncolumns:
+        return OFFSETS[detector] + channel - 1
+    return None
+
+def position(id):
+    """Returns (detector, row, column) for an ID."""
+    return DETECTOR[id], ROW[id], COLUMN[id]
+
+def channel(id):
+    """Returns (detector, channel) for an ID."""
+    return DETECTOR[id], CHANNEL[id]
+
+def from_positions(detectors, rows, columns):
+    """Returns the list of IDs of positions given as three sequences."""
+    return [from_position(*i) for i in zip(detectors, rows, columns)]
+
+def from_channels(detectors, channels):
+    """Returns the list of IDs of positions given as two sequences."""
+    return [from_channel(*i) for i in zip(detectors, channels)]
+
+def positions(ids):
+    """Returns lists of the detectors, rows and columns of IDs."""
+    return ([DETECTOR[i] for i in ids], [ROW[i] for i in ids],
+            [COLUMN[i] for i in ids])
+
+def channels(ids):
+    """Returns lists of the detectors and channels of IDs."""
+    return [DETECTOR[i] for i in ids], [CHANNEL[i] for i in ids]
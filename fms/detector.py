@@ -6,6 +6,7 @@ import copy
 import calibration
 from fms.cell import Base, Small, Large
 import cellinfo
+import fms.cellid as cellid
 import fms.geometry as fmsgeom # Want to call the Cell attribute geometry
 
 NORTH_LARGE = 1
@@ -36,6 +37,26 @@ class Detector(object):
         # do not appear here. Aside from that, the contents are the same
         # as the array.
         self.cells = []
+
+    def make_cells(self):
+        """Fill array and cells with a celltype at each geometry position.
+        
+        Positions without a cell are None in the array.
+        """
+        table = self.geometry.table()
+        for row, exists in enumerate(table.exists):
+            li = []
+            for column, present in enumerate(exists):
+                if present:
+                    thecell = self.celltype(row, column)
+                    thecell.detector = self.number
+                    thecell.id = cellid.from_position(self.number, row,
+                                                      column)
+                    self.cells.append(thecell)
+                    li.append(thecell)
+                else:
+                    li.append(None)
+            self.array.append(li)
         
     def set_voltages(self, lines):
         """Set all channel voltages and gains from a list of strings.
@@ -63,8 +84,14 @@ class Detector(object):
         """
         if len(self.cells) == 0:
             return
-        for line in lines:
-            info = cellinfo.Cell(line)
+        self.set_info_entries(cellinfo.Cell(line) for line in lines)
+
+    def set_info_entries(self, entries):
+        """Set miscellaneous cell info for all cells from cellinfo.Cells.
+        
+        Entries for other detectors or absent cells are ignored.
+        """
+        for info in entries:
             if info.detector != self.number:
                 continue
             cell = self.get_cell(info.row, info.column)
@@ -145,6 +172,45 @@ class Detector(object):
             c.speak()
 
 
+    ##########################################################################
+    def corrections(self, lines):
+        """Returns a list of Corrections for this detector from input lines.
+        
+        The input lines should have the following format:
+        detector row column change
+        where 'change' is a factor by which to multiply the gain.
+        Lines for other detectors, for absent cells, or with a change
+        of 1 are ignored. If a cell is listed more than once the last
+        line is used.
+        The returned Corrections have not yet been computed.
+        """
+        factors = {}
+        for line in lines:
+            # Split the line up into its constituent parts, namely
+            # detector, row, column and correction
+            values = line.split()
+            if int(values[0]) == self.number:
+                factors[(int(values[1]), int(values[2]))] = float(values[3])
+        return self.factor_corrections(factors)
+
+    def factor_corrections(self, factors):
+        """Returns a list of Corrections for this detector from factors.
+        
+        factors is a dictionary of gain factors keyed by (row, column).
+        Factors for absent cells or of 1 are ignored.
+        The returned Corrections have not yet been computed.
+        """
+        corrections = []
+        for (row, column), correction in sorted(factors.iteritems()):
+            if correction == 1.:
+                continue
+            cell = self.get_cell(row, column)
+            if cell is None:
+                continue
+            corrections.append(Correction(cell, correction))
+        return corrections
+
+
     ##########################################################################
     def apply_gain_corrections(self, file):
         """Compute new voltages from a list of gain modification factors.
@@ -155,42 +221,127 @@ class Detector(object):
         The voltage of each cell is changed so as to change the gain by
         this factor, using the calibration curve for that cell to
         compute the required voltage change.
-        Returns the number of modified cells.
+        Returns the number of modified cells, not counting cells with a
+        locked bitshift, which are left unchanged.
+        If a cell is listed more than once only the last line is used,
+        applied to the original gain; the factors are not compounded.
         
         Adds another field to the cell, 'requested_correction' which stores
         the gain factor asked for (not necessarily delivered).
         """
-        
         modified = 0 # Count the number of cells that change
-        # Object performing gain/voltage change calculations
-        for line in file:
-            # Split the line up into its constituent parts, namely
-            # detector, row, column and correction
-            values = line.split()
-            detector = int(values[0])
-            if detector != self.number:
-                continue
-            correction = float(values[3])
-            if correction == 1.:
-                continue
-            row = int(values[1])
-            column = int(values[2])
-            if not self.cell_exists(row, column):
-                continue
-            cell = self.get_cell(row, column)
-            cell.requested_correction = correction
-            newgain = cell.gain * correction
-            v, s, g = calibration.optimise(cell, newgain)
-            if newgain is None or v is None or s is None:
-                continue
-            cell.voltage = v
-            cell.gain = g
-            cell.qt.bitshift = s
-            modified += 1
-
+        for correction in self.corrections(file):
+            correction.compute()
+            if correction.commit() != Correction.SKIPPED:
+                modified += 1
         return modified
 
 
+class Correction(object):
+    """A gain correction to a single cell.
+    
+    The new voltage, bitshift and gain are computed by compute() without
+    modifying the cell, and only applied to the cell by commit().
+    This allows all the corrections for a file to be computed before any
+    are applied.
+    """
+    # Outcomes of commit().
+    # The requested gain was achieved.
+    CHANGED = 'changed'
+    # The voltage and bitshift were set to their limits.
+    CLAMPED = 'clamped'
+    # The cell was not changed (e.g. it has a locked bitshift).
+    SKIPPED = 'skipped'
+
+    def __init__(self, cell, factor):
+        """Constructor.
+        
+        factor is the factor by which to multiply the cell's gain.
+        """
+        self.cell = cell
+        self.factor = factor
+        self.voltage, self.bitshift, self.gain = None, None, None
+        self.outcome = None
+
+    @staticmethod
+    def compute_all(corrections, engine=None):
+        """Compute a list of Corrections with calibration.solve_many().
+        
+        engine names the calibration engine to use (see calibration.ENGINES).
+        """
+        cells = [i.cell for i in corrections]
+        gains = [i.cell.gain * i.factor for i in corrections]
+        results = calibration.solve_many(cells, gains, engine)
+        for correction, result in zip(corrections, results):
+            correction.voltage, correction.bitshift, correction.gain, \
+                correction.outcome = result
+
+    def compute(self):
+        """Compute the new cell settings. Does not modify the cell."""
+        self.voltage, self.bitshift, self.gain, self.outcome = \
+            calibration.solve(self.cell, self.cell.gain * self.factor)
+
+    def result(self):
+        """Returns what commit() will do: CHANGED, CLAMPED or SKIPPED."""
+        if self.outcome in (None, calibration.LOCKED) or \
+           self.voltage is None or self.bitshift is None:
+            return self.SKIPPED
+        if self.outcome == calibration.CLAMPED:
+            return self.CLAMPED
+        return self.CHANGED
+
+    def commit(self):
+        """Apply the computed settings to the cell.
+        
+        Returns CHANGED, CLAMPED or SKIPPED.
+        """
+        cell = self.cell
+        if self.factor is not None:
+            cell.requested_correction = self.factor
+        result = self.result()
+        if result != self.SKIPPED:
+            cell.voltage = self.voltage
+            cell.gain = self.gain
+            cell.qt.bitshift = self.bitshift
+        return result
+
+
+class VoltageOffset(Correction):
+    """A fixed change to the voltage of a single cell.
+    
+    The bitshift is unchanged and the new gain is computed from the
+    calibration curve. Voltages beyond the cell's limits are clamped.
+    """
+    def __init__(self, cell, offset):
+        """Constructor.
+        
+        offset is the voltage to add to the cell's current voltage.
+        """
+        super(VoltageOffset, self).__init__(cell, None)
+        self.offset = offset
+
+    def compute(self):
+        """Compute the new cell settings. Does not modify the cell."""
+        cell = self.cell
+        shift = cell.qt.bitshift
+        if shift in calibration.LOCKED_BITSHIFTS:
+            self.outcome = calibration.LOCKED
+            return
+        vmin, vmax = cell.min_voltage(shift), cell.max_voltage(shift)
+        voltage = cell.voltage + self.offset
+        outcome = calibration.OPTIMAL
+        if not vmin <= voltage <= vmax:
+            voltage = min(max(voltage, vmin), vmax)
+            outcome = calibration.CLAMPED
+        gain = cell.compute_gain(voltage)
+        if gain is None:
+            # The calibration curve can't be evaluated, so skip the cell.
+            self.outcome = None
+            return
+        self.voltage, self.bitshift, self.gain = voltage, shift, gain
+        self.outcome = outcome
+
+
 ##############################################################################
 #
 # A small-cell detector
@@ -209,21 +360,8 @@ class SmallDetector(Detector):
         
         super(SmallDetector, self).__init__(number)
 
-        # Populate the Cell list
-        for row in range(0, self.geometry.nrows()):
-            # Fill a list of cells for all columns in this row
-            li = []
-            for column in range(0, self.geometry.ncolumns()):
-                # Skip the hole around the beam pipe
-                if row > 6 and row < 17 and column < 5:
-                    li.append(None)
-                else:
-                    thecell = Small(row, column)
-                    thecell.detector = self.number
-                    li.append(thecell)
-                    self.cells.append(thecell)
-            # Add the columns for this row
-            self.array.append(li)
+        # Populate the Cell list, skipping the hole around the beam pipe
+        self.make_cells()
 
 
 ##############################################################################
@@ -235,6 +373,7 @@ class LargeDetector(Detector):
 
 
     geometry = fmsgeom.Large
+    celltype = Large
 
 
     ##########################################################################
@@ -243,31 +382,9 @@ class LargeDetector(Detector):
 
         super(LargeDetector, self).__init__(number)
 
-        # Populate the Cell list
-        for row in range(0, self.geometry.nrows()):
-            li = []
-            for column in range(0, self.geometry.ncolumns()):
-                # Skip the hole around the beam pipe
-                absent = False
-                if row > 8 and row < 25 and column < 8:
-                    absent = True
-                # This is a bit funny-looking, but it just skips
-                # the cells at the corners
-                altrow = row
-                if row < 16:
-                    altrow = self.geometry.nrows() - 1 - row
-                if column + altrow > 42:
-                    absent = True
-                # Add the cell if it exists
-                if absent:
-                    li.append(None)
-                else:
-                    thecell = Large(row, column)
-                    thecell.detector = self.number
-                    li.append(thecell)
-                    self.cells.append(thecell)
-            # Add the columns for this row
-            self.array.append(li)
+        # Populate the Cell list, skipping the hole around the beam pipe
+        # and the corners
+        self.make_cells()
 
 
     ##########################################################################
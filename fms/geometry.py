@@ -7,6 +7,53 @@ define small- and large-cell detector geometry information
 respectively.
 """
 
+## Precomputed geometry of every position in a detector type
+class Table(object):
+
+    """Geometry of every (row, column) position of a detector type.
+
+    Each attribute is a list with an entry per row, each a list with a
+    value per column, so e.g. table.eta[row][column]:
+     exists  True if there is a cell at the position
+     x, y    coordinates of the centre in cm, with x along the rows,
+             away from the beam, and y up from the detector's mid-height
+     r       distance of the centre from the beam in cm
+     eta     pseudorapidity of the centre
+     phi     azimuth of the centre in radians, from the x axis
+    Positions without a cell have coordinates too, so every list is
+    complete. The north and south detectors are mirror images, so phi
+    is in the frame of either one.
+    cells lists the (row, column) of each cell, by row then column.
+    Build Tables with Base.table(), which only builds each one once.
+    """
+
+    def __init__(self, geometry):
+        """Compute the table for a geometry class e.g. Large."""
+        rows = range(geometry.nrows())
+        columns = range(geometry.ncolumns())
+        self.exists = [[geometry.hascell(row, column) for column in columns]
+                       for row in rows]
+        self.cells = [(row, column) for row in rows for column in columns
+                      if self.exists[row][column]]
+        self.x = [[(column + 0.5) * geometry.cellheight()
+                   for column in columns] for row in rows]
+        self.y = [[(geometry.nrows() / 2 - row - 0.5) * geometry.cellwidth()
+                   for column in columns] for row in rows]
+        self.r = [[math.sqrt(math.pow(x, 2.) + math.pow(y, 2.))
+                   for x, y in zip(xs, ys)]
+                  for xs, ys in zip(self.x, self.y)]
+        # eta = -log(tan(theta/2))
+        self.eta = [[-(math.log(math.tan(
+                        math.atan(r / geometry.zposition()) / 2.)))
+                     for r in rs] for rs in self.r]
+        self.phi = [[math.atan2(y, x) for x, y in zip(xs, ys)]
+                    for xs, ys in zip(self.x, self.y)]
+
+
+# Tables already built, keyed by geometry class.
+TABLES = {}
+
+
 ## Base class defining geometry interface
 class Base(object):
 
@@ -58,6 +105,28 @@ class Base(object):
         pass
 
 
+    @classmethod
+    def channel(cls, row, column):
+        """Returns the channel number, counting from 1, of a position."""
+        return row * cls.ncolumns() + column + 1
+
+
+    @classmethod
+    def position(cls, channel):
+        """Returns the (row, column) of a channel number."""
+        return divmod(channel - 1, cls.ncolumns())
+
+
+    @classmethod
+    def table(cls):
+        """Returns the Table for this detector type.
+        It is computed the first time it is needed and shared after.
+        """
+        if cls not in TABLES:
+            TABLES[cls] = Table(cls)
+        return TABLES[cls]
+
+
     @classmethod
     def pseudorapidity(cls, row, column):
         """Returns the pseudorapidity of the cell at (row, column).
@@ -67,14 +136,7 @@ class Base(object):
         if not cls.hascell(row, column):
             print 'no such cell'
             return None
-
-        # Compute the coordinates of the centre
-        x = (column + 0.5) * cls.cellheight()
-        y = (cls.nrows() / 2 - row - 0.5) * cls.cellwidth()
-        r = math.sqrt(math.pow(x, 2.) + math.pow(y, 2.))
-        # eta = -log(tan(theta/2))
-        theta = math.atan(r / cls.zposition())
-        return -(math.log(math.tan(theta / 2.)))
+        return cls.table().eta[row][column]
 
 
 ## Defines geometry of small cells and small-cell detectors
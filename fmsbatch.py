@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""Apply gain corrections and write the output files without a GUI.
+
+Does the same as opening a working directory in App.py, applying
+Edit -> Modify gains for each corrections file, then File -> Save,
+but doesn't need Tkinter so it can run in batch jobs.
+Corrections files are applied in the order given on the command line,
+or with --merge are first combined into a single set of corrections.
+
+Statistics are printed to standard output as JSON. The exit status is
+0 on success, 1 if files couldn't be read or written and 2 if output
+files already exist and --force wasn't given.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import json
+import os
+import sys
+
+import corrections
+import files
+from fms.detector import Correction
+import session
+
+def parse(argv=None):
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input', help='working directory with input files')
+    parser.add_argument('-c', '--corrections', action='append',
+        dest='corrections', default=[], metavar='FILE',
+        type=lambda name: (corrections.ROW_COLUMN, name),
+        help='corrections file in "detector row column factor" format')
+    parser.add_argument('-s', '--steve', action='append',
+        dest='corrections', metavar='FILE',
+        type=lambda name: (corrections.STEVE, name),
+        help='corrections file in "eastOrWest detector channel factor" format')
+    parser.add_argument('-m', '--merge', choices=corrections.METHODS,
+        help='combine all corrections files and apply them once')
+    parser.add_argument('-o', '--output', default=None,
+        help='output directory (default: the input directory)')
+    parser.add_argument('-f', '--force', action='store_true',
+        help='replace existing output files')
+    parser.add_argument('--no-root', action='store_false', dest='root',
+        help="don't write tree.root")
+    return parser.parse_args(argv)
+
+def error(message, status=1):
+    """Print an error message and return an exit status."""
+    print >> sys.stderr, 'fmsbatch:', message
+    return status
+
+def run(args):
+    """Run the pipeline for parsed arguments. Returns the exit status."""
+    outdir = args.output or args.input
+    fms = session.Session()
+    try:
+        fms.read_library()
+        missing = fms.read_input(args.input)
+        if missing:
+            return error('files not found in {}: {}'.format(
+                args.input, ', '.join(missing)))
+        sources = [(name, format, corrections.load(name, format))
+                   for format, name in args.corrections]
+        if args.merge and sources:
+            merged = corrections.merge([corrections.valid(factors) for
+                                        name, format, factors in sources],
+                                       args.merge)
+            sources = [(' '.join(name for name, format, factors in sources),
+                        args.merge, merged)]
+        applied = []
+        for name, format, factors in sources:
+            outcomes = fms.apply_factors(corrections.valid(factors))
+            applied.append({'file': name, 'format': format,
+                            'changed': outcomes[Correction.CHANGED],
+                            'clamped': outcomes[Correction.CLAMPED],
+                            'skipped': outcomes[Correction.SKIPPED]})
+        # Only the modifiable input files are checked, as in App.save_all().
+        exists = [name for name in files.INPUT_NAMES.itervalues()
+                  if os.path.exists(os.path.join(outdir, name))]
+        if exists and not args.force:
+            return error('output files exist in {}, use --force to replace '
+                         'them'.format(outdir), 2)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        fms.save_all(outdir, args.root)
+    except (IOError, OSError, ValueError) as err:
+        return error(str(err))
+    stats = fms.stats()
+    stats.update({'input': args.input, 'output': outdir,
+                  'corrections': applied})
+    json.dump(stats, sys.stdout, indent=1, sort_keys=True)
+    print
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(parse()))
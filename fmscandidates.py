@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""Apply several candidate corrections files to the same working directory.
+
+The library and the baseline working directory are read once. Each
+candidate is then applied to its own copy of the detectors in a pool of
+worker processes, and the results are written to a separate output
+directory per candidate, named after the corrections file.
+A comparison of the candidates is printed and written to summary.json
+in the output directory.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import copy
+import json
+import multiprocessing
+import os
+import sys
+
+import corrections
+from fms.detector import Correction
+import session
+
+# The session with the baseline read, shared with worker processes.
+# Workers are forked, so they inherit it without it being pickled.
+BASELINE = None
+
+def parse(argv=None):
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input', help='baseline working directory')
+    parser.add_argument('output', help='directory in which to write one '
+        'output directory per candidate')
+    parser.add_argument('candidates', nargs='+', metavar='FILE',
+        help='corrections files')
+    parser.add_argument('-s', '--steve', action='store_const',
+        dest='format', const=corrections.STEVE, default=corrections.ROW_COLUMN,
+        help="corrections files are in Steve's format")
+    parser.add_argument('-j', '--jobs', type=int,
+        default=multiprocessing.cpu_count(), help='number of processes')
+    parser.add_argument('--no-root', action='store_false', dest='root',
+        help="don't write tree.root for each candidate")
+    return parser.parse_args(argv)
+
+def outdir_name(filename):
+    """Returns the output directory name for a candidate file."""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def summarise(fms, outcomes):
+    """Returns a dictionary comparing a candidate to the baseline.
+
+    outcomes is the Counter returned by Session.apply_corrections().
+    Voltage changes are given separately for large and small cells, as
+    they are in different units.
+
+    """
+    summary = fms.stats()
+    summary.update({'changed': outcomes[Correction.CHANGED],
+                    'clamped': outcomes[Correction.CLAMPED],
+                    'skipped': outcomes[Correction.SKIPPED]})
+    for name, detectors in ('large', (1, 2)), ('small', (3, 4)):
+        deltas = [abs(j.voltage) - abs(i.voltage)
+                  for number in detectors
+                  for i, j in zip(fms.initial[number].cells,
+                                  fms.detectors[number].cells)]
+        moved = [d for d in deltas if d]
+        summary[name] = {
+            'min_delta': min(deltas) if deltas else 0,
+            'max_delta': max(deltas) if deltas else 0,
+            'mean_abs_delta': (sum(abs(d) for d in moved) / float(len(moved))
+                               if moved else 0.)}
+    return summary
+
+def run_candidate(job):
+    """Apply one candidate to a copy of the baseline and write the output.
+
+    job is (corrections file, format, output directory, write ROOT file).
+    Returns the summary dictionary, or one with an 'error' on failure.
+
+    """
+    filename, format, outdir, root = job
+    try:
+        fms = copy.deepcopy(BASELINE)
+        outcomes = fms.apply_corrections(corrections.read(filename, format))
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        fms.save_all(outdir, root)
+        summary = summarise(fms, outcomes)
+    except (IOError, OSError, ValueError) as err:
+        summary = {'error': str(err)}
+    except Exception as err:
+        # Any other failure, e.g. evaluating a curve, only loses this
+        # candidate, not the results of the others.
+        summary = {'error': '{}: {}'.format(type(err).__name__, err)}
+    summary.update({'candidate': filename, 'output': outdir})
+    return summary
+
+def print_table(summaries):
+    """Print a one-line comparison of each candidate."""
+    print '{:<24}{:>8}{:>8}{:>8}{:>9}{:>14}{:>14}'.format('candidate',
+        'changed', 'clamped', 'skipped', 'bitshift', 'large dV', 'small dV')
+    for s in summaries:
+        name = outdir_name(s['candidate'])
+        if 'error' in s:
+            print '{:<24}{}'.format(name, s['error'])
+            continue
+        print '{:<24}{:>8}{:>8}{:>8}{:>9}{:>14}{:>14}'.format(name,
+            s['changed'], s['clamped'], s['skipped'], s['bitshift_changes'],
+            '{:+d}..{:+d}'.format(s['large']['min_delta'],
+                                  s['large']['max_delta']),
+            '{:+d}..{:+d}'.format(s['small']['min_delta'],
+                                  s['small']['max_delta']))
+
+def run(args):
+    """Run all candidates for parsed arguments. Returns the exit status."""
+    global BASELINE
+    names = [outdir_name(i) for i in args.candidates]
+    if len(set(names)) != len(names):
+        print >> sys.stderr, 'fmscandidates: candidate file names must ' \
+            'differ, as they name the output directories'
+        return 1
+    BASELINE = session.Session()
+    try:
+        BASELINE.read_library()
+        missing = BASELINE.read_input(args.input)
+    except IOError as err:
+        print >> sys.stderr, 'fmscandidates:', err
+        return 1
+    if missing:
+        print >> sys.stderr, 'fmscandidates: files not found in {}: {}'.format(
+            args.input, ', '.join(missing))
+        return 1
+    jobs = [(filename, args.format, os.path.join(args.output, name),
+             args.root) for filename, name in zip(args.candidates, names)]
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        try:
+            summaries = pool.map(run_candidate, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        summaries = map(run_candidate, jobs)
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    with open(os.path.join(args.output, 'summary.json'), 'w') as file:
+        json.dump(summaries, file, indent=1, sort_keys=True)
+    print_table(summaries)
+    return 1 if any('error' in s for s in summaries) else 0
+
+if __name__ == '__main__':
+    sys.exit(run(parse()))
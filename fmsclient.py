@@ -0,0 +1,94 @@
+"""Client for the fmsvoltages service (see fmsservice.py).
+
+For example:
+ import fmsclient
+ client = fmsclient.Client()
+ client.load('working/')
+ print client.cell(1, 0, 0)['voltage']
+The connection, over the service's Unix-domain socket, is kept open
+between requests, so repeated queries only cost a round trip to the
+local service.
+"""
+
+import httplib
+import json
+import os
+import socket
+
+# Default socket of the service. Must match fmsservice.SOCKET.
+SOCKET = os.path.join(os.path.expanduser('~/.fms'), 'service.sock')
+
+class Error(Exception):
+    """The service rejected a request."""
+    pass
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """An HTTP connection over a Unix-domain socket."""
+    def __init__(self, socket_path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+class Client(object):
+    """Sends requests to a running fmsservice."""
+    def __init__(self, path=SOCKET):
+        self.connection = UnixHTTPConnection(path)
+        self.connection.connect()
+
+    def request(self, operation, **arguments):
+        """Send a request and return the decoded response.
+
+        Raises Error if the service reports an error.
+
+        """
+        body = json.dumps(arguments)
+        self.connection.request('POST', '/' + operation, body,
+                                {'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise Error(result.get('error', response.reason))
+        return result
+
+    def load(self, path):
+        """Load a working directory, discarding any unsaved changes."""
+        return self.request('load', path=path)
+
+    def apply(self, lines=None, file=None, format='rowcol', engine=None):
+        """Apply corrections from a list of lines or from a file.
+
+        Returns a dictionary of changed, clamped and skipped cell counts.
+
+        """
+        if lines is not None:
+            return self.request('apply', lines=lines, engine=engine)
+        return self.request('apply', file=file, format=format, engine=engine)
+
+    def cell(self, detector, row, column):
+        """Returns a dictionary of the settings of a cell."""
+        return self.request('cell', detector=detector, row=row, column=column)
+
+    def optimise(self, detector, row, column, factor, engine=None):
+        """Returns the settings that would give a cell a gain factor.
+
+        The cell is not changed.
+
+        """
+        return self.request('optimise', detector=detector, row=row,
+                            column=column, factor=factor, engine=engine)
+
+    def save(self, path, root=True):
+        """Write all output files to a directory."""
+        return self.request('save', path=path, root=root)
+
+    def stats(self):
+        """Returns a summary of changes since the directory was loaded."""
+        return self.request('stats')
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+"""A local service keeping fmsvoltages state loaded between requests.
+
+The library files are read once at start-up, and a working directory
+stays loaded until another is requested, so scripts can query and modify
+cells without paying the start-up and loading cost every time.
+Use fmsclient.Client to talk to the service.
+
+Requests are HTTP POSTs to /<operation> with a JSON object body, and the
+response is a JSON object. Errors give a 4xx status and {"error": ...}.
+Operations:
+ load      {"path": dir} - read a working directory, discarding changes
+ apply     {"lines": [...]} or {"file": name, "format": "rowcol"|"steve"}
+           - apply gain corrections, returns outcome counts
+ cell      {"detector": d, "row": r, "column": c} - current cell settings
+ optimise  {"detector": d, "row": r, "column": c, "factor": f}
+           - the settings solve() gives for a gain factor, without
+             changing the cell; optional "engine" (see calibration.ENGINES)
+ save      {"path": dir, "root": true} - write all output files
+ stats     {} - summary of changes since loading
+The service listens on a Unix-domain socket, by default in ~/.fms, that
+only its owner can connect to, since requests can read and write any of
+the owner's files. Each client connection is
+served by its own thread, so a client keeping its connection open
+doesn't block others, but only one request is handled at a time, so
+requests never see partially-applied changes.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import BaseHTTPServer
+import copy
+import json
+import os
+import socket
+import SocketServer
+import stat
+import sys
+import threading
+import traceback
+
+import calibration
+import corrections
+from fms.detector import Correction
+import session
+
+# Default socket to listen on. Must match fmsclient.SOCKET.
+SOCKET = os.path.join(os.path.expanduser('~/.fms'), 'service.sock')
+
+class UnknownOperation(Exception):
+    """A request for an operation the service doesn't provide."""
+    pass
+
+
+class Request(dict):
+    """The arguments of a request. Missing arguments raise ValueError."""
+    def __missing__(self, key):
+        raise ValueError('missing {}'.format(key))
+
+
+class Service(object):
+    """Implements the operations, independent of HTTP."""
+    def __init__(self):
+        """Constructor. Reads the library files."""
+        # A session with only the library read, copied for each load.
+        self.library = session.Session()
+        self.library.read_library()
+        # The session for the loaded working directory, if any.
+        self.session = None
+        self.path = None
+        # Held while handling a request, so requests run one at a time.
+        self.lock = threading.Lock()
+
+    def loaded(self):
+        """Returns the current session, raising ValueError if there is none."""
+        if self.session is None:
+            raise ValueError('no working directory loaded')
+        return self.session
+
+    def engine(self, request):
+        """Returns the engine name in a request, or None if there is none.
+
+        Raises ValueError for an unknown engine.
+        """
+        engine = request.get('engine')
+        if engine is not None and engine not in calibration.ENGINES:
+            raise ValueError("unknown engine '{}', expected one of {}".format(
+                engine, ', '.join(sorted(calibration.ENGINES))))
+        return engine
+
+    def find_cell(self, request):
+        """Returns the cell identified by detector, row and column."""
+        fms = self.loaded()
+        try:
+            detector = fms.detectors[int(request['detector'])]
+            cell = detector.get_cell(int(request['row']),
+                                     int(request['column']))
+        except KeyError as err:
+            raise ValueError('missing or invalid {}'.format(err))
+        if cell is None:
+            raise ValueError('no such cell')
+        return cell
+
+    def load(self, request):
+        """Read a working directory into a new session."""
+        fms = copy.deepcopy(self.library)
+        missing = fms.read_input(request['path'])
+        if missing:
+            raise ValueError('files not found: ' + ', '.join(missing))
+        self.session, self.path = fms, request['path']
+        return {'path': self.path}
+
+    def apply(self, request):
+        """Apply gain corrections to the loaded cells."""
+        if 'lines' in request:
+            lines = request['lines']
+        else:
+            lines = corrections.read(request['file'],
+                request.get('format', corrections.ROW_COLUMN))
+        try:
+            factors = corrections.parse(lines)
+        except IndexError:
+            raise ValueError('correction lines need 4 columns: '
+                             'detector row column factor')
+        outcomes = self.loaded().apply_factors(factors, self.engine(request))
+        return {'changed': outcomes[Correction.CHANGED],
+                'clamped': outcomes[Correction.CLAMPED],
+                'skipped': outcomes[Correction.SKIPPED]}
+
+    def cell(self, request):
+        """Returns the settings of a cell."""
+        cell = self.find_cell(request)
+        return {'detector': cell.detector, 'channel': cell.channel,
+                'row': cell.row, 'column': cell.column,
+                'voltage': cell.voltage, 'gain': cell.gain,
+                'bitshift': cell.qt.bitshift,
+                'qt': [cell.qt.crate, cell.qt.board, cell.qt.number],
+                'curve': cell.calibration.p,
+                'requested_correction': getattr(cell, 'requested_correction',
+                                                None)}
+
+    def optimise(self, request):
+        """Returns the optimal settings for a gain factor."""
+        cell = self.find_cell(request)
+        factor = float(request['factor'])
+        voltage, bitshift, gain, outcome = calibration.solve(
+            cell, cell.gain * factor, self.engine(request))
+        return {'voltage': voltage, 'bitshift': bitshift, 'gain': gain,
+                'outcome': outcome}
+
+    def save(self, request):
+        """Write all output files to a directory."""
+        path = request['path']
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.loaded().save_all(path, request.get('root', True))
+        return {'path': path}
+
+    def stats(self, request):
+        """Returns a summary of changes since loading."""
+        stats = self.loaded().stats()
+        stats['path'] = self.path
+        return stats
+
+    # Names of the methods that can be requested.
+    OPERATIONS = ['load', 'apply', 'cell', 'optimise', 'save', 'stats']
+
+    def handle(self, operation, request):
+        """Run a named operation. Returns the response dictionary.
+
+        Raises UnknownOperation for an unknown operation and ValueError
+        for an invalid request.
+
+        """
+        if operation not in self.OPERATIONS:
+            raise UnknownOperation('unknown operation ' + operation)
+        with self.lock:
+            return getattr(self, operation)(Request(request))
+
+
+def remove_stale(path):
+    """Remove a socket left by a service that didn't exit cleanly.
+
+    Raises IOError if path isn't a socket or a service is listening on it.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise IOError(path + ' exists and is not a socket')
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        os.remove(path)
+    else:
+        raise IOError('another service is listening on ' + path)
+    finally:
+        probe.close()
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server on a Unix-domain socket only its owner can use,
+    handling each connection in a new thread."""
+    address_family = socket.AF_UNIX
+    # Don't wait for open client connections when exiting.
+    daemon_threads = True
+
+    def server_bind(self):
+        remove_stale(self.server_address)
+        # Create the socket with permissions 0600.
+        umask = os.umask(0o177)
+        try:
+            SocketServer.TCPServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        self.server_name, self.server_port = 'localhost', 0
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Decodes HTTP requests and passes them to the server's Service."""
+    # Keep connections open so clients don't reconnect for every request.
+    protocol_version = 'HTTP/1.1'
+    # Buffer the response so it is sent in one packet, not one per header.
+    wbufsize = -1
+
+    def respond(self, status, response):
+        body = json.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or '{}')
+            if not isinstance(request, dict):
+                raise ValueError('request must be a JSON object')
+            operation = self.path.strip('/')
+            self.respond(200, self.server.service.handle(operation, request))
+        except UnknownOperation as err:
+            self.respond(404, {'error': str(err)})
+        except (ValueError, TypeError, IOError, OSError) as err:
+            self.respond(400, {'error': str(err)})
+        except Exception as err:
+            # Report the bug rather than dropping the connection.
+            traceback.print_exc()
+            self.respond(500, {'error': 'internal error: {}'.format(err)})
+
+    def log_message(self, format, *args):
+        # Unix-domain clients have no address to log.
+        if self.server.verbose:
+            sys.stderr.write('[{}] {}\n'.format(self.log_date_time_string(),
+                                                format % args))
+
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-s', '--socket', default=SOCKET,
+        help='Unix-domain socket to listen on')
+    parser.add_argument('-l', '--load', metavar='DIR',
+        help='working directory to load at start-up')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='log every request')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse()
+    try:
+        service = Service()
+        if args.load:
+            service.load({'path': args.load})
+        directory = os.path.dirname(os.path.abspath(args.socket))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        server = Server(args.socket, Handler)
+    except (IOError, OSError, ValueError) as err:
+        print >> sys.stderr, 'fmsservice:', err
+        sys.exit(1)
+    server.service = service
+    server.verbose = args.verbose
+    print 'fmsservice listening on', args.socket
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
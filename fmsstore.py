@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+"""Keep iterations in a store of deduplicated files instead of copies.
+
+Each saved iteration is a manifest listing the files of a working
+directory by the SHA-1 digest of their contents, and each distinct file
+is stored once, so saving an iteration only costs the files that
+changed. Any iteration can be checked out into a working directory, and
+a new branch can start from any iteration.
+
+Layout of a store directory:
+ objects/ab/cdef...  file contents, named by digest
+ iterations/NAME     JSON manifest: name, parent, time, message, files
+A working directory remembers the store and iteration it was checked
+out from or saved as in .fmsstore, which also records the size,
+modification time and digest of each file, so unchanged files aren't
+read again when the directory is next saved.
+
+Commands:
+ init STORE                    create an empty store
+ save STORE DIR [-n NAME]      save a working directory as an iteration
+ checkout STORE NAME DIR       write an iteration's files to a directory
+ branch STORE NAME NEW         start a new iteration from an old one
+ log STORE                     list iterations
+ diff STORE NAME1 NAME2        list files that differ between iterations
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+# Name of the file recording where a working directory came from.
+MARKER = '.fmsstore'
+
+# Size of the blocks files are read in when computing digests.
+BLOCK = 1 << 20
+
+def digest(path):
+    """Returns the SHA-1 digest of a file's contents."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def write_atomic(path, write):
+    """Create a file by calling write(file) on a temporary file and renaming.
+
+    Readers never see a partially written file.
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path),
+                                             prefix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            write(file)
+        # mkstemp() only gives the owner access, so give the permissions
+        # open() would. The umask can only be read by setting it.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.rename(temporary, path)
+    except:
+        os.remove(temporary)
+        raise
+
+class Store(object):
+    """A directory of content-addressed files and iteration manifests."""
+    def __init__(self, path):
+        """Open an existing store. Raises IOError if there isn't one."""
+        self.path = path
+        if not os.path.isdir(self.directory('iterations')):
+            raise IOError('{} is not an iteration store'.format(path))
+
+    @classmethod
+    def create(cls, path):
+        """Create an empty store, or open an existing one."""
+        for name in 'objects', 'iterations':
+            directory = os.path.join(path, name)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        return cls(path)
+
+    def directory(self, *names):
+        return os.path.join(self.path, *names)
+
+    def object_path(self, sha1):
+        return self.directory('objects', sha1[:2], sha1[2:])
+
+    def add(self, path, sha1):
+        """Store a file's contents under its digest unless already stored.
+
+        Returns the number of bytes added to the store.
+        """
+        destination = self.object_path(sha1)
+        if os.path.exists(destination):
+            return 0
+        if not os.path.isdir(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        with open(path, 'rb') as source:
+            write_atomic(destination,
+                         lambda file: shutil.copyfileobj(source, file))
+        return os.path.getsize(destination)
+
+    def names(self):
+        """Returns the names of all iterations, oldest first."""
+        manifests = [self.manifest(name) for name in
+                     os.listdir(self.directory('iterations'))
+                     if not name.startswith('.')]
+        return [i['name'] for i in sorted(manifests,
+                                         key=lambda i: (i['time'], i['name']))]
+
+    def manifest(self, name):
+        """Returns the manifest of an iteration. Raises ValueError if absent."""
+        try:
+            with open(self.directory('iterations', name)) as file:
+                return json.load(file)
+        except IOError:
+            raise ValueError('no iteration called {!r}'.format(name))
+
+    def next_name(self):
+        """Returns iterationN for the lowest N above any existing one."""
+        numbers = [int(match.group(1)) for match in
+                   (re.match(r'iteration(\d+)$', name) for name in
+                    os.listdir(self.directory('iterations'))) if match]
+        return 'iteration{}'.format(max(numbers) + 1 if numbers else 0)
+
+    def write_manifest(self, manifest):
+        if not re.match(r'[\w.-]+$', manifest['name']) or \
+           manifest['name'].startswith('.'):
+            raise ValueError('invalid iteration name {!r}'.format(
+                manifest['name']))
+        path = self.directory('iterations', manifest['name'])
+        if os.path.exists(path):
+            raise ValueError('iteration {!r} already exists'.format(
+                manifest['name']))
+        write_atomic(path, lambda file: json.dump(manifest, file, indent=1,
+                                                  sort_keys=True))
+
+    def save(self, workdir, name=None, parent=None, message=''):
+        """Save the files in a working directory as a new iteration.
+
+        The parent defaults to the iteration the directory was last
+        checked out from or saved as. Returns the manifest and the
+        number of bytes added to the store.
+        """
+        marker = read_marker(workdir)
+        if parent is None and marker.get('store') == os.path.abspath(
+                self.path):
+            parent = marker.get('iteration')
+        if parent is not None:
+            self.manifest(parent)
+        known = marker.get('files', {})
+        entries, added = {}, 0
+        for filename in sorted(os.listdir(workdir)):
+            path = os.path.join(workdir, filename)
+            if filename.startswith('.') or not os.path.isfile(path):
+                continue
+            status = os.stat(path)
+            previous = known.get(filename)
+            if previous and previous['size'] == status.st_size and \
+               previous['mtime'] == status.st_mtime and \
+               os.path.exists(self.object_path(previous['sha1'])):
+                sha1 = previous['sha1']
+            else:
+                sha1 = digest(path)
+                added += self.add(path, sha1)
+            entries[filename] = {'sha1': sha1, 'size': status.st_size,
+                                 'mtime': status.st_mtime}
+        manifest = {'name': name or self.next_name(), 'parent': parent,
+                    'time': time.time(), 'message': message,
+                    'files': {filename: {'sha1': entry['sha1'],
+                                         'size': entry['size']}
+                              for filename, entry in entries.iteritems()}}
+        self.write_manifest(manifest)
+        write_marker(workdir, self, manifest['name'], entries)
+        return manifest, added
+
+    def branch(self, name, new, message=''):
+        """Start a new iteration with the same files as an existing one."""
+        manifest = dict(self.manifest(name), name=new, parent=name,
+                        time=time.time(), message=message)
+        self.write_manifest(manifest)
+        return manifest
+
+    def checkout(self, name, workdir, force=False):
+        """Write the files of an iteration to a working directory.
+
+        Files whose contents already match are left alone, and other
+        files in the directory are kept. Unless force is True, raises
+        ValueError rather than replace files changed since the directory
+        was last checked out or saved. Returns the names of files written.
+        """
+        manifest = self.manifest(name)
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        marker = read_marker(workdir)
+        known = marker.get('files', {})
+        entries, written, modified = {}, [], []
+        for filename, entry in sorted(manifest['files'].iteritems()):
+            path = os.path.join(workdir, filename)
+            if os.path.exists(path):
+                status = os.stat(path)
+                previous = known.get(filename)
+                if previous and previous['size'] == status.st_size and \
+                   previous['mtime'] == status.st_mtime:
+                    current = previous['sha1']
+                else:
+                    current = digest(path)
+                if current == entry['sha1']:
+                    entries[filename] = dict(entry, mtime=status.st_mtime)
+                    continue
+                if not previous or previous['sha1'] != current:
+                    modified.append(filename)
+            written.append(filename)
+        if modified and not force:
+            raise ValueError('unsaved changes in {}: {}'.format(
+                workdir, ', '.join(modified)))
+        for filename in written:
+            entry = manifest['files'][filename]
+            with open(self.object_path(entry['sha1']), 'rb') as source:
+                write_atomic(os.path.join(workdir, filename),
+                             lambda file: shutil.copyfileobj(source, file))
+            entries[filename] = dict(entry, mtime=os.stat(
+                os.path.join(workdir, filename)).st_mtime)
+        write_marker(workdir, self, name, entries)
+        return written
+
+    def diff(self, name1, name2):
+        """Returns sorted (file name, change) for files that differ.
+
+        change is 'added', 'removed' or 'changed'.
+        """
+        files1 = self.manifest(name1)['files']
+        files2 = self.manifest(name2)['files']
+        changes = []
+        for filename in sorted(set(files1) | set(files2)):
+            if filename not in files1:
+                changes.append((filename, 'added'))
+            elif filename not in files2:
+                changes.append((filename, 'removed'))
+            elif files1[filename]['sha1'] != files2[filename]['sha1']:
+                changes.append((filename, 'changed'))
+        return changes
+
+
+def read_marker(workdir):
+    """Returns the contents of a working directory's marker file, or {}."""
+    try:
+        with open(os.path.join(workdir, MARKER)) as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+def write_marker(workdir, store, name, entries):
+    write_atomic(os.path.join(workdir, MARKER),
+                 lambda file: json.dump({'store': os.path.abspath(store.path),
+                                         'iteration': name,
+                                         'files': entries},
+                                        file, indent=1, sort_keys=True))
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('init', help='create an empty store')
+    command.add_argument('store')
+    command = commands.add_parser('save',
+        help='save a working directory as an iteration')
+    command.add_argument('store')
+    command.add_argument('workdir')
+    command.add_argument('-n', '--name',
+        help='iteration name (default: the next iterationN)')
+    command.add_argument('-p', '--parent',
+        help='parent iteration (default: the one last checked out)')
+    command.add_argument('-m', '--message', default='', help='description')
+    command = commands.add_parser('checkout',
+        help='write an iteration to a working directory')
+    command.add_argument('store')
+    command.add_argument('name')
+    command.add_argument('workdir')
+    command.add_argument('-f', '--force', action='store_true',
+        help='replace files with unsaved changes')
+    command = commands.add_parser('branch',
+        help='start a new iteration from an existing one')
+    command.add_argument('store')
+    command.add_argument('name')
+    command.add_argument('new')
+    command.add_argument('-m', '--message', default='', help='description')
+    command = commands.add_parser('log', help='list iterations')
+    command.add_argument('store')
+    command = commands.add_parser('diff',
+        help='list files that differ between two iterations')
+    command.add_argument('store')
+    command.add_argument('name1')
+    command.add_argument('name2')
+    return parser.parse_args()
+
+def run(args):
+    """Run a parsed command. Returns the exit status."""
+    if args.command == 'init':
+        Store.create(args.store)
+        return 0
+    store = Store(args.store)
+    if args.command == 'save':
+        manifest, added = store.save(args.workdir, args.name, args.parent,
+                                     args.message)
+        print 'Saved {} ({} files, {} bytes new)'.format(manifest['name'],
+            len(manifest['files']), added)
+    elif args.command == 'checkout':
+        written = store.checkout(args.name, args.workdir, args.force)
+        print 'Checked out {} ({} files written)'.format(args.name,
+                                                         len(written))
+    elif args.command == 'branch':
+        store.branch(args.name, args.new, args.message)
+    elif args.command == 'log':
+        for name in store.names():
+            manifest = store.manifest(name)
+            print '{:<20}{:<20}{}  {}'.format(name, manifest['parent'] or '-',
+                time.strftime('%Y-%m-%d %H:%M',
+                              time.localtime(manifest['time'])),
+                manifest['message'])
+    elif args.command == 'diff':
+        for filename, change in store.diff(args.name1, args.name2):
+            print '{:<8} {}'.format(change, filename)
+    return 0
+
+if __name__ == '__main__':
+    args = parse()
+    try:
+        sys.exit(run(args))
+    except (IOError, OSError, ValueError) as err:
+        print >> sys.stderr, 'fmsstore:', err
+        sys.exit(1)
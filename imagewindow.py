@@ -1,12 +1,21 @@
 from Tkinter import *
+import tkMessageBox
 import tkSimpleDialog
-import math
 import dialog
 from fms.detector import *
 import calibration
 import fms.cell as cell
 import os
 import fms.geometry as fmsgeom
+import instrument
+import palette
+import qt
+
+# Number of colour levels used for continuous heatmaps.
+HEATMAP_LEVELS = 40
+
+# Colour of cells with no value in a heatmap.
+MISSING_COLOUR = 'gray25'
 
 class CellGraphicsInfo:
     """Stores the graphical properties of cells as drawn on the window."""
@@ -15,6 +24,52 @@ class CellGraphicsInfo:
         self.height = height_pixels
 
 
+class CellGrid:
+    """Lookup of the cell rectangle at a canvas position.
+
+    Covers one cell size (large or small) across both halves of the canvas.
+    Positions are converted to a grid row and column by integer division
+    and the rectangle id is read from a precomputed list-of-lists, so
+    lookup doesn't depend on the number of cells.
+
+    """
+    def __init__(self, info, nrows, ncolumns, xcentre, ybottom):
+        """Constructor.
+
+        info is the CellGraphicsInfo for the cell size, nrows and ncolumns
+        the number of rows and columns per sub-detector, xcentre the x
+        position dividing the two sub-detectors and ybottom the bottom edge
+        of the bottom row.
+
+        """
+        self.info = info
+        self.nrows = nrows
+        self.ncolumns = ncolumns
+        self.left = xcentre - ncolumns * info.width
+        self.ybottom = ybottom
+        # Grid columns run left to right across both sub-detectors.
+        self.ids = [2 * ncolumns * [None] for row in range(nrows)]
+
+    def add(self, id, row, column, right):
+        """Register the rectangle for a cell.
+
+        right should be True for the sub-detector drawn right of centre.
+
+        """
+        if right:
+            self.ids[row][self.ncolumns + column] = id
+        else:
+            self.ids[row][self.ncolumns - 1 - column] = id
+
+    def find(self, x, y):
+        """Returns the rectangle id at (x, y), or None if there is none."""
+        gridcolumn = (x - self.left) // self.info.width
+        row = self.nrows - 1 - (self.ybottom - y) // self.info.height
+        if 0 <= gridcolumn < 2 * self.ncolumns and 0 <= row < self.nrows:
+            return self.ids[row][gridcolumn]
+        return None
+
+
 class ImageWindow(Frame):
     """The graphical area on which images of the cells are drawn.
     
@@ -62,6 +117,17 @@ class ImageWindow(Frame):
         # key - canvas object id number
         # value - actual cell object from input detectors
         self.cells = {}
+        # The colour group of each rectangle for each display mode.
+        # key - display mode name e.g. 'voltage'
+        # value - dictionary of {canvas object id: colour group}
+        # Every rectangle carries a tag '<mode>:<group>' for each mode, so
+        # a mode is redrawn with one itemconfig call per colour group.
+        self.colour_groups = {}
+        # Detectors as they were when input was loaded, set by the
+        # application. Used to display changes since loading.
+        self.baseline = None
+        # Legend window, created when first needed and reused after.
+        self.legend = None
         # Store a reference to the input directories.
         # This is a dictionary, keyed by NORTH_LARGE... etc
         # and storing a LargeDetector or SmallDetector for each.
@@ -104,6 +170,21 @@ class ImageWindow(Frame):
         self.canvas = Canvas(self, bg='black', width=self.canvas_width, height=self.canvas_height)
         self.canvas.bind("<Button-2>", self.determine_cell)
         self.canvas.bind("<Button-3>", self.determine_cell)
+        # A single handler tracks the cell under the pointer.
+        self.canvas.bind("<Motion>", self.track_pointer)
+        # Canvas id of the cell under the pointer, and whether a status bar
+        # update is waiting to run.
+        self.hover = None
+        self.hover_pending = False
+        # Dragging with the left button selects a box of cells.
+        self.canvas.bind("<ButtonPress-1>", self.start_selection)
+        self.canvas.bind("<B1-Motion>", self.drag_selection)
+        self.canvas.bind("<ButtonRelease-1>", self.end_selection)
+        # Canvas ids of the selected cells, and the corner where the
+        # current drag started and the rectangle showing it.
+        self.selection = []
+        self.band_start = None
+        self.band = None
         self.canvas.pack(side=TOP)
         # xoffset marks the start of the right half of the window.
         # Cells for the north detector are drawn in the right half,
@@ -129,59 +210,50 @@ class ImageWindow(Frame):
         nrows_large_gap = fmsgeom.Large.gapsize()
         nrows_small = fmsgeom.Small.nrows()
         nrows_small_gap = fmsgeom.Small.gapsize()
-        # Create rectangles for each large cell
-        for column in range(0, nrows_large / 2):
-            for row in range(0, nrows_large):
-                # Skip central hole where small cells go
-                if column < 8 and row > 8 and row < 25:
-                    continue
-                # Skip corners
-                # Number bottom rows symmetrically with top rows
-                # allowing easy skipping of both top & bottom
-                # corners at once.
-                altrow = row
-                if row < 16:
-                    altrow = nrows_large - 1 - row
-                if column + altrow > 42:
-                    continue
-                x = self.xoffset + self.large.width * column
-                y = self.large_yoffset - self.large.height * (nrows_large - 1 - row)
-                label = str(column) + ', ' + str(row)
-                # Cells for columns right of centre.
-                # Column number increases left to right.
-                rec1 = self.canvas.create_rectangle(x, y ,
-                   x + self.large.width - 1, y - (self.large.height - 1))
-                self.canvas.tag_bind(rec1, '<Enter>', self.update_status_with_current_cell)
-                # Cells for columns left of centre
-                x = self.xoffset - self.large.width * (1 + column)
-                rec2 = self.canvas.create_rectangle(x, y,
-                   x + self.large.width - 1, y - (self.large.height - 1))
-                self.canvas.tag_bind(rec2, '<Enter>', self.update_status_with_current_cell)
-                self.cells[rec1] = detectors[SOUTH_LARGE].get_cell(row, column)
-                self.cells[rec2] = detectors[NORTH_LARGE].get_cell(row, column)
+        self.large_grid = CellGrid(self.large, nrows_large, nrows_large / 2,
+                                   self.xoffset, self.large_yoffset)
+        # Create rectangles for each large cell, skipping the central hole
+        # where small cells go and the corners
+        for row, column in fmsgeom.Large.table().cells:
+            x = self.xoffset + self.large.width * column
+            y = self.large_yoffset - self.large.height * (nrows_large - 1 - row)
+            label = str(column) + ', ' + str(row)
+            # Cells for columns right of centre.
+            # Column number increases left to right.
+            rec1 = self.canvas.create_rectangle(x, y ,
+               x + self.large.width - 1, y - (self.large.height - 1),
+               tags='cell')
+            # Cells for columns left of centre
+            x = self.xoffset - self.large.width * (1 + column)
+            rec2 = self.canvas.create_rectangle(x, y,
+               x + self.large.width - 1, y - (self.large.height - 1),
+               tags='cell')
+            self.cells[rec1] = detectors[SOUTH_LARGE].get_cell(row, column)
+            self.cells[rec2] = detectors[NORTH_LARGE].get_cell(row, column)
+            self.large_grid.add(rec1, row, column, True)
+            self.large_grid.add(rec2, row, column, False)
         # Create rectangles for each small cell
-        small = SmallDetector(3)
         # Move up by the height of 9 large rows to get to the
         # bottom of the bottom small cell row.
         self.small_yoffset = self.large_yoffset - 9 * self.large.height
-        for row in range(0, fmsgeom.Small.nrows()):
-            for column in range(0, fmsgeom.Small.ncolumns()):
-                if not small.cell_exists(row, column):
-                    continue
-                x = self.xoffset + self.small.width * column
-                y = self.small_yoffset - self.small.height * (fmsgeom.Small.nrows() - 1 - row)
-                label = str(column) + ', ' + str(row)
-                rec1 = self.canvas.create_rectangle(x, y,
-                    x + self.small.width - 1,
-                    y - (self.small.height - 1))
-                self.canvas.tag_bind(rec1, '<Enter>', self.update_status_with_current_cell)
-                x = self.xoffset - self.small.width * (1 + column)
-                rec2 = self.canvas.create_rectangle(x, y,
-                    x + self.small.width - 1,
-                    y - (self.small.height - 1))
-                self.canvas.tag_bind(rec2, '<Enter>', self.update_status_with_current_cell)
-                self.cells[rec1] = detectors[SOUTH_SMALL].get_cell(row, column)
-                self.cells[rec2] = detectors[NORTH_SMALL].get_cell(row, column)
+        self.small_grid = CellGrid(self.small, fmsgeom.Small.nrows(),
+                                   fmsgeom.Small.ncolumns(),
+                                   self.xoffset, self.small_yoffset)
+        for row, column in fmsgeom.Small.table().cells:
+            x = self.xoffset + self.small.width * column
+            y = self.small_yoffset - self.small.height * (fmsgeom.Small.nrows() - 1 - row)
+            label = str(column) + ', ' + str(row)
+            rec1 = self.canvas.create_rectangle(x, y,
+                x + self.small.width - 1,
+                y - (self.small.height - 1), tags='cell')
+            x = self.xoffset - self.small.width * (1 + column)
+            rec2 = self.canvas.create_rectangle(x, y,
+                x + self.small.width - 1,
+                y - (self.small.height - 1), tags='cell')
+            self.cells[rec1] = detectors[SOUTH_SMALL].get_cell(row, column)
+            self.cells[rec2] = detectors[NORTH_SMALL].get_cell(row, column)
+            self.small_grid.add(rec1, row, column, True)
+            self.small_grid.add(rec2, row, column, False)
         self.canvas.create_line(0, self.canvas_height / 2+1,
                                 self.canvas_width, self.canvas_height / 2+1, width=2, fill='blue')
         self.canvas.create_line(self.canvas_width / 2, 0,
@@ -190,26 +262,42 @@ class ImageWindow(Frame):
         self.canvas.create_text(self.canvas_width - self.padding_width, self.padding_height, text='South', fill='white', anchor='ne')
         self.display_detector() # Colour cells by detector number
 
+    @instrument.timed('tk.recolour')
+    def recolour(self, mode, groups, colours):
+        """Colour the cells by grouping them under per-colour canvas tags.
+
+        groups is a dictionary of {canvas object id: colour group} and
+        colours maps each group to a colour.
+        Only rectangles whose group changed since the mode was last drawn
+        are re-tagged, then each group is filled with a single call.
+
+        """
+        current = self.colour_groups.setdefault(mode, {})
+        for id, group in groups.iteritems():
+            old = current.get(id)
+            if old == group:
+                continue
+            if old is not None:
+                self.canvas.dtag(id, '{}:{}'.format(mode, old))
+            self.canvas.addtag_withtag('{}:{}'.format(mode, group), id)
+            current[id] = group
+        for group, colour in colours.iteritems():
+            self.canvas.itemconfig('{}:{}'.format(mode, group), fill=colour)
+
     def display_voltage(self):
         colours = {0: "red", 200: "green", 400: "blue", 600: "pink",
             800: "orange", 1000: "brown", 1200: "yellow", 1400: "magenta",
             1600: "cyan"}
-        for id, cell in self.cells.iteritems():
-            v = cell.voltage
-            delta = {abs(v - i): i for i in colours.iterkeys()}
-            colour = colours[delta[min(delta)]]
-            self.canvas.itemconfig(id, fill=colour)
-        voltagelegend = Toplevel()
-        voltagelegend.resizable(FALSE, FALSE) # Prevent resizing by the user
-        canvas = Canvas(voltagelegend, background='black',
-            width=200, height=400)
-        canvas.pack()
-        for i, colour in colours.iteritems():
-            # Add 1 from slot number to give range [1, N]
-            # This matches Steve's output format
-            Label(canvas, fg=colour, justify=LEFT, font=('Courier', '14'),
-                text='{:>4} V'.format(i), background='black').grid(row=i)
-        
+        # Find the nearest listed voltage for all cells in one pass.
+        points = sorted(colours)
+        ids = self.cells.keys()
+        nearest = palette.nearest([self.cells[i].voltage for i in ids],
+                                  points)
+        groups = {id: points[n] for id, n in zip(ids, nearest)}
+        self.recolour('voltage', groups, colours)
+        self.show_legend('Voltage', [(colour, '{:>4} V'.format(i))
+                                     for i, colour in sorted(colours.items())])
+
     def display_detector(self):
         """Sets cell colours by detector number."""
         # Default options.
@@ -239,11 +327,11 @@ class ImageWindow(Frame):
             options.update(useropts)
         except IOError:
             pass
-        # Key 'col' option by detector number.
-        # The colour for detector i is then options[colours[i]].
-        colours = {i: 'col{}'.format(i) for i in range(1, 5)}
-        for id, cell in self.cells.iteritems():
-            self.canvas.itemconfig(id, fill=options[colours[cell.detector]])
+        # Look up the 'col' option for each detector number.
+        colours = {i: options['col{}'.format(i)] for i in range(1, 5)}
+        self.recolour('detector',
+                      {id: cell.detector for id, cell in self.cells.iteritems()},
+                      colours)
 
     def display_qt_boards(self):
         # Colours keyed by QT board number
@@ -258,62 +346,117 @@ class ImageWindow(Frame):
                    8: "cyan",
                    9: "gray",
                    10: "white"}
-        for id, cell in self.cells.iteritems():
-            board = cell.qt.board
-            self.canvas.itemconfig(id, fill=colours[board])
-        self.qtboardlegend = Toplevel()
-        self.qtboardlegend.resizable(FALSE, FALSE) # Prevent resizing by the user
-        canvas = Canvas(self.qtboardlegend, background='black',
-            width=200, height=400)
-        canvas.pack()
-        for i, colour in colours.iteritems():
-            # Add 1 from slot number to give range [1, N]
-            # This matches Steve's output format
-            Label(canvas, fg=colour, justify=LEFT, font=('Courier', '14'),
-                text='Board{:>3}'.format(i + 1), background='black').grid(row=i)
-
-    def compute_row_col(self, x, y):
-        """Compute the row and column number from a position in the canvas."""
-        if self.is_in_small_cell_area(x, y):
-            x = int(math.fabs(x - self.xoffset))
-            col = x / self.small.width
-            row = (self.small_yoffset - y) / self.small.height
-        else:
-            col = (x - self.xoffset) / self.large.width
-            row = (self.large_yoffset - y) / self.large.height
-        return row, col
+        self.recolour('qt',
+                      {id: cell.qt.board for id, cell in self.cells.iteritems()},
+                      colours)
+        # Add 1 to slot number to give range [1, N]
+        # This matches Steve's output format
+        self.show_legend('QT', [(colour, 'Board{:>3}'.format(i + 1))
+                                for i, colour in sorted(colours.items())])
 
-    def compute_cell(self, x, y):
-        type = None # Type of fms.cell object to create
-        nrows = -1
-        if self.is_in_small_cell_area(x, y):
-            yoffset = self.small_yoffset
-            type = Small
-            width = self.small.width
-            height = self.small.height
-            nrows = fmsgeom.Small.nrows()
-            if x > self.xoffset:
-                det = SOUTH_SMALL
-            else:
-                det = NORTH_SMALL
-        else:
-            yoffset = self.large_yoffset
-            type = Large
-            width = self.large.width
-            height = self.large.height
-            nrows = fmsgeom.Large.nrows()
-            if x > self.xoffset:
-                det = SOUTH_LARGE
-            else:
-                det = NORTH_LARGE
-        # Now just consider the absolute value of x from the window
-        # centre, for easier calculation of column number
-        x = int(math.fabs(x - self.xoffset))
-        col = x / width
-        row = nrows - 1 - ((yoffset - y) / height)
-        cell = type(int(row), int(col))
-        cell.detector = det
-        return cell
+    def show_legend(self, title, entries):
+        """Show a list of (colour, text) entries in the legend window.
+
+        The legend window is created the first time it is needed and
+        redrawn in place after that.
+
+        """
+        if self.legend is None or not self.legend.winfo_exists():
+            self.legend = Toplevel()
+            self.legend.resizable(FALSE, FALSE) # Prevent resizing by the user
+            # Closing the legend just hides it so it can be reused.
+            self.legend.protocol('WM_DELETE_WINDOW', self.legend.withdraw)
+            self.legend_canvas = Canvas(self.legend, background='black',
+                                        width=200)
+            self.legend_canvas.pack()
+        self.legend.title(title)
+        canvas = self.legend_canvas
+        canvas.delete('all')
+        canvas.config(height=20 * len(entries) + 20)
+        for n, (colour, text) in enumerate(entries):
+            canvas.create_text(10, 20 + 20 * n, anchor=W, fill=colour,
+                               text=text, font=('Courier', '14'))
+        self.legend.deiconify()
+        self.legend.lift()
+
+    def baseline_cell(self, cell):
+        """Returns the cell as it was when input was loaded, or None."""
+        if not self.baseline:
+            return None
+        return self.baseline[cell.detector].get_cell(cell.row, cell.column)
+
+    def display_heatmap(self, mode, title, value, vmin=None, vmax=None):
+        """Colour cells on a continuous scale.
+
+        value is a function of (cell, baseline cell) returning the value
+        to display, or None if there is no value for that cell.
+        The scale runs from the smallest to largest value unless vmin
+        and/or vmax are given.
+
+        """
+        values = {id: value(cell, self.baseline_cell(cell))
+                  for id, cell in self.cells.iteritems()}
+        self.display_values(mode, title, values, vmin, vmax)
+
+    def display_values(self, mode, title, values, vmin=None, vmax=None):
+        """Colour cells on a continuous scale from precomputed values.
+
+        values is a dictionary of {canvas object id: value or None}.
+        See display_heatmap() for vmin and vmax.
+
+        """
+        ids = values.keys()
+        values = [values[i] for i in ids]
+        valid = [v for v in values if v is not None]
+        if vmin is None:
+            vmin = min(valid) if valid else 0.
+        if vmax is None:
+            vmax = max(valid) if valid else 1.
+        levels = palette.quantize(values, vmin, vmax, HEATMAP_LEVELS)
+        colours = dict(enumerate(palette.levels(HEATMAP_LEVELS)))
+        colours['missing'] = MISSING_COLOUR
+        groups = {id: 'missing' if level is None else level
+                  for id, level in zip(ids, levels)}
+        self.recolour(mode, groups, colours)
+        # List the value at the centre of every few levels, highest first.
+        step = float(vmax - vmin) / HEATMAP_LEVELS
+        entries = [(colours[n], '{:>10.4g}'.format(vmin + (n + 0.5) * step))
+                   for n in range(HEATMAP_LEVELS - 1, -1, -4)]
+        entries.append((MISSING_COLOUR, '{:>10}'.format('no value')))
+        self.show_legend(title, entries)
+
+    def display_gain(self):
+        """Sets cell colours by gain."""
+        self.display_heatmap('gain', 'Gain', lambda cell, base: cell.gain)
+
+    def display_bitshift(self):
+        """Sets cell colours by QT bitshift."""
+        # Fix the scale to the full bitshift range so colours always
+        # correspond to the same bitshift.
+        self.display_heatmap('bitshift', 'Bitshift',
+                             lambda cell, base: cell.qt.bitshift,
+                             qt.VALID_BITSHIFTS[0], qt.VALID_BITSHIFTS[-1])
+
+    def display_requested_correction(self):
+        """Sets cell colours by the last gain correction requested."""
+        self.display_heatmap('correction', 'Requested correction',
+            lambda cell, base: getattr(cell, 'requested_correction', None))
+
+    def display_gain_ratio(self):
+        """Sets cell colours by gain relative to the loaded input."""
+        def ratio(cell, base):
+            if base is None or not base.gain:
+                return None
+            return cell.gain / base.gain
+        self.display_heatmap('gainratio', 'Gain new/old', ratio)
+
+    def display_voltage_ratio(self):
+        """Sets cell colours by voltage relative to the loaded input."""
+        def ratio(cell, base):
+            if base is None or not base.voltage:
+                return None
+            return cell.voltage / float(base.voltage)
+        self.display_heatmap('voltageratio', 'Voltage new/old', ratio)
 
     def is_in_small_cell_area(self, x, y):
         small_width = self.small.width * fmsgeom.Small.ncolumns()
@@ -328,36 +471,47 @@ class ImageWindow(Frame):
             return False
         return True
 
-    def update_status_with_current_cell(self, event):
-        cell = self.compute_cell(event.x, event.y)
-        if cell.row != None and cell.column != None:
-            self.status.configure(text='Detector ' + str(cell.detector) + \
-                                       ' channel ' + str(cell.channel) + \
-                                       ' row ' + str(cell.row) + \
-                                       ' column ' + str(cell.column))
-    
-    def determine_cell(self, event):
-        if self.is_in_small_cell_area(event.x, event.y):
-            self.select_small_cell(event)
-        else:
-            self.determine_large_cell(event)
+    def find_cell_id(self, x, y):
+        """Returns the canvas id of the cell at (x, y), or None.
 
-    @classmethod
-    def dialog_title(cls, cell):
-         return 'Detector {} channel{:>4}'.format(cell.detector, cell.channel)
+        Small cells are drawn inside the hole in the large cells, so
+        the small-cell grid is checked first.
 
-    def select_small_cell(self, event):
-        """Determine which small cell was clicked and open a dialog."""
-        row = (self.small_yoffset - event.y) / self.small.height
-        row = fmsgeom.Small.nrows() - 1 - row
-        if event.x > self.xoffset:
-            column = (event.x - self.xoffset) / self.small.width
-        else:
-            column = (self.xoffset - event.x) / self.small.width
-        detector = NORTH_SMALL
-        if event.x > self.xoffset:
-            detector = SOUTH_SMALL
-        cell = self.detectors[detector].get_cell(row, column)
+        """
+        if self.is_in_small_cell_area(x, y):
+            return self.small_grid.find(x, y)
+        return self.large_grid.find(x, y)
+
+    def track_pointer(self, event):
+        """Note the cell under the pointer and schedule a status update.
+
+        Only moving onto a different cell schedules an update, and updates
+        are deferred until Tk is idle so fast motion is coalesced.
+
+        """
+        id = self.find_cell_id(event.x, event.y)
+        if id == self.hover:
+            return
+        self.hover = id
+        if not self.hover_pending:
+            self.hover_pending = True
+            self.after_idle(self.update_status_with_current_cell)
+
+    def update_status_with_current_cell(self):
+        """Show the properties of the cell under the pointer."""
+        self.hover_pending = False
+        cell = self.cells.get(self.hover)
+        if cell is None:
+            return
+        self.status.configure(text='Detector {} channel {} row {} column {} '
+            'voltage {} gain {:.3f} bitshift {}'.format(
+                cell.detector, cell.channel, cell.row, cell.column,
+                cell.voltage_int_to_str(cell.voltage), cell.gain,
+                cell.qt.bitshift))
+
+    def determine_cell(self, event):
+        """Determine which cell was clicked and open a dialog."""
+        cell = self.cells.get(self.find_cell_id(event.x, event.y))
         if cell is not None:
             d = dialog.CellDialog(self.tkroot,
                     self.dialog_title(cell), cell)
@@ -365,20 +519,77 @@ class ImageWindow(Frame):
             self.modified = d.modified or self.modified
             self.canvas.focus_set()
 
-    def determine_large_cell(self, event):
-        """Determine which large cell was clicked and open a dialog."""
-        row = (self.large_yoffset - event.y) / self.large.height
-        row = fmsgeom.Large.nrows() - 1 -row
-        if event.x > self.xoffset:
-            column = (event.x - self.xoffset) / self.large.width
-        else:
-            column = (self.xoffset - event.x) / self.large.width
-        detector = NORTH_LARGE
-        if event.x > self.xoffset:
-            detector = SOUTH_LARGE
-        cell = self.detectors[detector].get_cell(row, column)
-        if cell is not None:
-            d = dialog.CellDialog(self.tkroot,
-                    self.dialog_title(cell), cell)
-            self.modified = d.modified or self.modified
-            self.canvas.focus_set()
\ No newline at end of file
+    def start_selection(self, event):
+        """Start drawing a selection box."""
+        self.band_start = event.x, event.y
+        self.band = self.canvas.create_rectangle(event.x, event.y,
+            event.x, event.y, outline='white', dash=(4, 4))
+
+    def drag_selection(self, event):
+        """Resize the selection box to follow the pointer."""
+        if self.band is not None:
+            self.canvas.coords(self.band, self.band_start[0],
+                               self.band_start[1], event.x, event.y)
+
+    def end_selection(self, event):
+        """Select all cells touched by the selection box."""
+        if self.band is None:
+            return
+        self.canvas.delete(self.band)
+        self.band = None
+        x0, y0 = self.band_start
+        ids = self.canvas.find_overlapping(min(x0, event.x), min(y0, event.y),
+                                           max(x0, event.x), max(y0, event.y))
+        self.select([id for id in ids if id in self.cells])
+
+    def select(self, ids):
+        """Set the selected cells, highlighting their outlines."""
+        self.canvas.itemconfig('selected', outline='black', width=1)
+        self.canvas.dtag('selected')
+        for id in ids:
+            self.canvas.addtag_withtag('selected', id)
+        self.canvas.itemconfig('selected', outline='white', width=2)
+        self.selection = list(ids)
+        self.status.configure(text='{} cells selected'.format(len(ids)))
+
+    def select_eta_band(self):
+        """Prompt for a pseudorapidity range and select cells within it."""
+        low = tkSimpleDialog.askfloat('Select eta band', 'Minimum eta')
+        if low is None:
+            return
+        high = tkSimpleDialog.askfloat('Select eta band', 'Maximum eta')
+        if high is None:
+            return
+        self.select([id for id, cell in self.cells.iteritems()
+                     if low <= cell.pseudorapidity() <= high])
+
+    def select_qt_board(self):
+        """Prompt for a QT crate and slot and select cells read out by it."""
+        crate = tkSimpleDialog.askinteger('Select QT board', 'Crate (1-4)')
+        if crate is None:
+            return
+        slot = tkSimpleDialog.askinteger('Select QT board', 'Slot (1-11)')
+        if slot is None:
+            return
+        # The slot is shown in the range [1, 11], see CellDialog.
+        self.select([id for id, cell in self.cells.iteritems()
+                     if cell.qt.crate == crate and cell.qt.board == slot - 1])
+
+    def modify_selection(self):
+        """Open a dialog to change all the selected cells together."""
+        if not self.selection:
+            tkMessageBox.showinfo('Modify selection', 'No cells are selected')
+            return
+        cells = [self.cells[id] for id in self.selection]
+        d = dialog.BatchDialog(self.tkroot,
+                               'Modify {} cells'.format(len(cells)), cells)
+        self.modified = d.modified or self.modified
+        self.canvas.focus_set()
+
+    def what_if(self):
+        """Open a panel to try out a gain scale before committing to it."""
+        dialog.WhatIfDialog(self)
+
+    @classmethod
+    def dialog_title(cls, cell):
+         return 'Detector {} channel{:>4}'.format(cell.detector, cell.channel)
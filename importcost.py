@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""Report the time taken to import each fmsvoltages module.
+
+Each module is imported in a fresh Python process, so the times include
+everything the module imports in turn, as a script using it would see.
+Also reports whether importing the module pulled in ROOT or Tkinter,
+which should only happen for modules that really need them at import.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import json
+import os
+import subprocess
+import sys
+
+# Modules measured by default.
+MODULES = ['ROOT', 'Tkinter', 'calibration', 'cellinfo', 'corrections',
+           'fms.cell', 'fms.cellid', 'fms.detector', 'fms.geometry', 'files',
+           'lecroytools', 'librarycache', 'maketree', 'palette', 'postscript',
+           'qt', 'report', 'session', 'smallcellscript', 'watcher',
+           'fmsbatch', 'dialog', 'imagewindow', 'App']
+
+# Run in the child process: time the import and list heavy dependencies.
+PROBE = '''
+import sys, time
+start = time.time()
+import {0}
+elapsed = time.time() - start
+print elapsed, 'ROOT' in sys.modules, 'Tkinter' in sys.modules
+'''
+
+def measure(module):
+    """Returns (seconds, imports ROOT, imports Tkinter) for a module.
+
+    Returns None if the module cannot be imported.
+
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [directory] + filter(None, [env.get('PYTHONPATH')]))
+    process = subprocess.Popen([sys.executable, '-c', PROBE.format(module)],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env)
+    output, _ = process.communicate()
+    if process.returncode != 0:
+        return None
+    seconds, root, tk = output.split()[-3:]
+    return float(seconds), root == 'True', tk == 'True'
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=MODULES,
+        help='modules to measure')
+    parser.add_argument('--json', action='store_true',
+        help='print results as JSON')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse()
+    results = [(module, measure(module)) for module in args.modules]
+    if args.json:
+        json.dump([{'module': module, 'seconds': r[0], 'root': r[1],
+                    'tkinter': r[2]} if r else
+                   {'module': module, 'seconds': None}
+                   for module, r in results], sys.stdout, indent=1)
+        print
+    else:
+        print '{:<18}{:>10}  {}'.format('module', 'ms', 'loads')
+        for module, result in results:
+            if result is None:
+                print '{:<18}{:>10}'.format(module, 'failed')
+                continue
+            seconds, root, tk = result
+            loads = [name for name, loaded in [('ROOT', root),
+                                               ('Tkinter', tk)] if loaded]
+            print '{:<18}{:>10.1f}  {}'.format(module, seconds * 1000.,
+                                               ' '.join(loads))
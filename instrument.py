@@ -0,0 +1,123 @@
+"""Optional timers and counters for finding where time goes.
+
+Instrumentation is off unless the FMSVOLTAGES_PROFILE environment
+variable is set, in which case a report is written when the programme
+exits: a table to standard error and JSON to the file named by the
+variable (or to fmsvoltages-profile-<pid>.json in the current directory
+if it is set to 1). When off, timer() and count() do nothing, so they
+can be left in hot paths.
+
+Usage:
+ with instrument.timer('save.gains'):
+     ...
+ instrument.count('ROOT.TF1.Eval')
+Timer names are dotted, with the first part naming the stage.
+"""
+
+import atexit
+import json
+import os
+import sys
+import timeit
+
+# Name of the environment variable switching instrumentation on.
+VARIABLE = 'FMSVOLTAGES_PROFILE'
+
+ENABLED = bool(os.environ.get(VARIABLE))
+
+# {timer name: [calls, total seconds, maximum seconds]}
+timers = {}
+# {counter name: count}
+counters = {}
+
+class Timer(object):
+    """Context manager adding the time spent inside it to a named timer."""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exception):
+        elapsed = timeit.default_timer() - self.start
+        entry = timers.setdefault(self.name, [0, 0., 0.])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        return False
+
+
+class NullTimer(object):
+    """Context manager that does nothing, used when disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+def timer(name):
+    """Returns a context manager timing the enclosed block."""
+    if ENABLED:
+        return Timer(name)
+    return NULL_TIMER
+
+def count(name, n=1):
+    """Add n to a named counter."""
+    if ENABLED:
+        counters[name] = counters.get(name, 0) + n
+
+def timed(name):
+    """Decorator timing every call of a function."""
+    def decorate(function):
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorate
+
+def report():
+    """Returns a dictionary of all timers and counters."""
+    return {'timers': {name: {'calls': calls, 'total': total, 'max': longest}
+                       for name, (calls, total, longest) in timers.items()},
+            'counters': dict(counters)}
+
+def text():
+    """Returns the report as a table, slowest timers first."""
+    lines = ['{:<32}{:>8}{:>12}{:>12}'.format('timer', 'calls', 'total ms',
+                                              'max ms')]
+    for name, (calls, total, longest) in sorted(timers.items(),
+            key=lambda item: -item[1][1]):
+        lines.append('{:<32}{:>8}{:>12.2f}{:>12.2f}'.format(name, calls,
+            total * 1000., longest * 1000.))
+    if counters:
+        lines.append('{:<32}{:>8}'.format('counter', 'count'))
+        for name, n in sorted(counters.items()):
+            lines.append('{:<32}{:>8}'.format(name, n))
+    return '\n'.join(lines)
+
+def write(filename=None):
+    """Write the JSON report, and the table to standard error.
+
+    The JSON file name defaults to the one given by the environment
+    variable. Does nothing if nothing was recorded.
+
+    """
+    if not timers and not counters:
+        return
+    if filename is None:
+        filename = os.environ.get(VARIABLE)
+        if filename in (None, '', '1'):
+            filename = 'fmsvoltages-profile-{}.json'.format(os.getpid())
+    with open(filename, 'w') as file:
+        json.dump(report(), file, indent=1, sort_keys=True)
+    print >> sys.stderr, text()
+    print >> sys.stderr, 'Profile written to', filename
+
+if ENABLED:
+    atexit.register(write)
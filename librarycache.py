@@ -0,0 +1,158 @@
+"""Binary cache of the parsed library files.
+
+The library files (see files.LIB_NAMES) never change during a session,
+but parsing them as text is a large part of start-up. The parsed values
+are kept as marshalled tuples in a cache file, .fmslibrary.cache, in the
+directory of the info table (or in ~/.fms if that isn't writable). The
+cache is used while the modification time and size of every library
+file match those recorded, or failing that their SHA-1 digests match.
+Otherwise the files are parsed and the cache rewritten.
+
+Only the parsed values are cached, not indexes derived from them: the
+calibration.Table index by cell ID is rebuilt in a single pass when the
+cache is loaded, and the address index of cellinfo.Table is only used by
+scripts reading the info table directly, not through the cache.
+
+Set the FMSVOLTAGES_NOCACHE environment variable to always parse the
+text files.
+"""
+
+import hashlib
+import marshal
+import os
+import tempfile
+
+import calibration
+import cellinfo
+import instrument
+
+# Name of the cache file.
+NAME = '.fmslibrary.cache'
+
+# Change this whenever the cached values change meaning.
+VERSION = 1
+
+# Name of the environment variable disabling the cache.
+VARIABLE = 'FMSVOLTAGES_NOCACHE'
+
+# Library file types stored in the cache, see files.LIB_NAMES.
+TYPES = ['INFO', 'CURVE_LARGE', 'CURVE_SMALL']
+
+class Library(object):
+    """The parsed contents of the library files."""
+    def __init__(self, values):
+        """Constructor. values is {file type: list of value tuples}."""
+        # List of cellinfo.Cell for each entry in the info table.
+        self.info = [cellinfo.Cell.from_values(i) for i in values['INFO']]
+        # calibration.Table of all calibration curves.
+        self.calibration = calibration.Table.from_values(
+            values['CURVE_LARGE'], values['CURVE_SMALL'])
+
+
+def signature(path):
+    """Returns (modification time, size) of a file."""
+    status = os.stat(path)
+    return status.st_mtime, status.st_size
+
+def digest(path):
+    """Returns the SHA-1 digest of a file's contents."""
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def parse(paths):
+    """Returns {file type: list of value tuples} parsed from text files.
+
+    paths is {file type: path} for each of TYPES.
+    """
+    values = {}
+    with open(paths['INFO']) as file:
+        values['INFO'] = [cellinfo.Cell(line).values() for line in file
+                          if line.strip()]
+    for filetype, Channel in [('CURVE_LARGE', calibration.ChannelLarge),
+                              ('CURVE_SMALL', calibration.ChannelSmall)]:
+        with open(paths[filetype]) as file:
+            values[filetype] = [Channel(line).values() for line in file
+                                if line.strip()]
+    return values
+
+def locations(paths):
+    """Returns the possible cache file names, in order of preference."""
+    return [os.path.join(os.path.dirname(os.path.abspath(paths['INFO'])),
+                         NAME),
+            os.path.join(os.path.expanduser('~/.fms'), NAME)]
+
+def read(filename, paths):
+    """Returns the cache contents if valid for the files, otherwise None.
+
+    The second value returned is True if the cache is valid but the
+    recorded modification times or sizes need updating.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            cache = marshal.load(file)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None, False
+    if not isinstance(cache, dict) or cache.get('version') != VERSION:
+        return None, False
+    stale = False
+    for filetype in TYPES:
+        path = os.path.abspath(paths[filetype])
+        recorded = cache['files'].get(filetype)
+        if recorded is None or recorded[0] != path:
+            return None, False
+        if tuple(recorded[1]) != signature(path):
+            if recorded[2] != digest(path):
+                return None, False
+            stale = True
+    return cache, stale
+
+def write(filename, cache):
+    """Write the cache atomically. Returns False if it couldn't be written."""
+    directory = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(directory):
+            return False
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=NAME)
+        with os.fdopen(descriptor, 'wb') as file:
+            marshal.dump(cache, file)
+        # mkstemp() only gives the owner access, so give the permissions
+        # open() would. The umask can only be read by setting it.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.rename(temporary, filename)
+        return True
+    except (IOError, OSError):
+        return False
+
+def describe(paths):
+    """Returns {file type: (path, signature, digest)} for the files."""
+    return {filetype: (os.path.abspath(paths[filetype]),
+                       signature(paths[filetype]), digest(paths[filetype]))
+            for filetype in TYPES}
+
+def load(paths):
+    """Returns a Library for the files, using the cache where possible.
+
+    paths is {file type: path} for each of TYPES, e.g. a files.Files.
+    Raises IOError if a file cannot be read.
+    """
+    paths = {filetype: paths[filetype] for filetype in TYPES}
+    if os.environ.get(VARIABLE):
+        return Library(parse(paths))
+    candidates = locations(paths)
+    for filename in candidates:
+        cache, stale = read(filename, paths)
+        if cache is not None:
+            instrument.count('library.cache.hit')
+            if stale:
+                cache['files'] = describe(paths)
+                write(filename, cache)
+            return Library(cache['values'])
+    instrument.count('library.cache.miss')
+    cache = {'version': VERSION, 'files': describe(paths),
+             'values': parse(paths)}
+    for filename in candidates:
+        if write(filename, cache):
+            break
+    return Library(cache['values'])
@@ -1,11 +1,9 @@
 """ROOT tree generation utilities."""
 
-import ROOT
-# Only operate ROOT in batch mode to avoid some crashes I experienced on
-# RCF when using the programme over ssh.
-ROOT.gROOT.SetBatch(True)
-# May give to speed up on ROOT calls.
-ROOT.SetSignalPolicy(ROOT.kSignalFast)
+# ROOT is only imported when a tree is first created.
+from rootlib import ROOT
+
+import instrument
 
 # We only want one tree to be in existence, so keep it as a module-level
 # variable to create a sort-of-singleton.
@@ -97,6 +95,7 @@ def populate(before, after):
                 __entry.askedChange = j.requested_correction
             else:
                 __entry.askedChange = 0.
+            instrument.count('ROOT.TTree.Fill')
             __tree.Fill()
 
 def tree():
@@ -31,6 +31,7 @@ class Menus:
         file_menu.add_command(label = 'Save', command=application.save_all)
         file_menu.add_command(label = 'Export ROOT file', command=application.save_root)
         file_menu.add_command(label = 'Export PostScript file', command=application.save_postscript)
+        file_menu.add_command(label = 'Export HTML report', command=application.save_report)
         file_menu.add_command(label = 'Open', command=application.read_input)
         file_menu.add_separator()
         file_menu.add_command(label = 'Quit', command = application.exit)
@@ -43,7 +44,17 @@ class Menus:
         edit_menu.add_command(label = 'Show voltage', command = application.image_window.display_voltage)
         edit_menu.add_command(label = 'Show detector', command = application.image_window.display_detector)
         edit_menu.add_command(label = 'Show QT', command = application.image_window.display_qt_boards)
+        edit_menu.add_command(label = 'Show gain', command = application.image_window.display_gain)
+        edit_menu.add_command(label = 'Show bitshift', command = application.image_window.display_bitshift)
+        edit_menu.add_command(label = 'Show requested correction', command = application.image_window.display_requested_correction)
+        edit_menu.add_command(label = 'Show gain new/old', command = application.image_window.display_gain_ratio)
+        edit_menu.add_command(label = 'Show voltage new/old', command = application.image_window.display_voltage_ratio)
         edit_menu.add_command(label='Modify gains', command=application.apply_corrections_from_file)
+        edit_menu.add_command(label='What if...', command=application.image_window.what_if)
+        edit_menu.add_separator()
+        edit_menu.add_command(label='Select eta band', command=application.image_window.select_eta_band)
+        edit_menu.add_command(label='Select QT board', command=application.image_window.select_qt_board)
+        edit_menu.add_command(label='Modify selected cells', command=application.image_window.modify_selection)
         # Add a drop-down sub-menu to edit allowing to change
         # either all the small or all the large voltages using
         # an input file.
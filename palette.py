@@ -0,0 +1,63 @@
+"""Colour palettes for mapping cell values to colours.
+
+Used both for the SVG report pages and for colouring cells in the GUI.
+Colours are returned as Tk/SVG-compatible '#rrggbb' strings.
+"""
+
+import bisect
+
+# Control points for the continuous palette, as (fraction, (r, g, b)).
+# Runs dark blue -> cyan -> green -> yellow -> red, similar to the
+# ROOT 'colz' palette used in the PostScript output.
+GRADIENT = [
+    (0.00, (0x14, 0x14, 0x8c)),
+    (0.25, (0x00, 0xb4, 0xdc)),
+    (0.50, (0x28, 0xc8, 0x28)),
+    (0.75, (0xf0, 0xdc, 0x00)),
+    (1.00, (0xdc, 0x14, 0x14))
+]
+
+def gradient(fraction):
+    """Returns the colour at a fraction [0, 1] along the continuous palette.
+
+    Fractions outside [0, 1] are clamped to the ends of the palette.
+
+    """
+    fraction = min(max(fraction, 0.), 1.)
+    for (f0, c0), (f1, c1) in zip(GRADIENT[:-1], GRADIENT[1:]):
+        if fraction <= f1:
+            t = (fraction - f0) / (f1 - f0)
+            rgb = [int(round(a + t * (b - a))) for a, b in zip(c0, c1)]
+            return '#{:02x}{:02x}{:02x}'.format(*rgb)
+    return '#{:02x}{:02x}{:02x}'.format(*GRADIENT[-1][1])
+
+def levels(n):
+    """Returns a list of n colours evenly spaced along the palette."""
+    if n < 2:
+        return [gradient(0.)]
+    return [gradient(i / float(n - 1)) for i in range(n)]
+
+def quantize(values, vmin, vmax, n):
+    """Maps a sequence of values onto n palette levels in a single pass.
+
+    Returns a list of integer levels in the range [0, n), one per input
+    value. Values outside [vmin, vmax] go to the first or last level.
+    None values are mapped to None.
+
+    """
+    if vmax <= vmin:
+        return [None if v is None else 0 for v in values]
+    # Upper edges of each level except the last, so bisect gives the level.
+    edges = [vmin + (vmax - vmin) * i / float(n) for i in range(1, n)]
+    return [None if v is None else bisect.bisect_right(edges, v)
+            for v in values]
+
+def nearest(values, points):
+    """Maps values to the index of the nearest of a sorted list of points.
+
+    Equivalent to finding the minimum |value - point| for each value,
+    but uses a precomputed set of midpoints so each lookup is a bisection.
+
+    """
+    midpoints = [(a + b) / 2. for a, b in zip(points[:-1], points[1:])]
+    return [bisect.bisect_left(midpoints, v) for v in values]
@@ -5,17 +5,10 @@
 from collections import namedtuple
 import sys
 
-import tkFileDialog
-
-try:
-    import ROOT
-    # Only operate ROOT in batch mode to avoid some crashes I experienced on
-    # RCF when using the programme over ssh.
-    #ROOT.gROOT.SetBatch(True)
-    # May give to speed up on ROOT calls.
-    ROOT.SetSignalPolicy(ROOT.kSignalFast)
-except ImportError:
-    print 'Unable to locate ROOT'
+# ROOT is only imported when PostScript is first generated.
+from rootlib import ROOT
+
+import instrument
 
 DETECTORS = range(1, 5)
 
@@ -36,6 +29,21 @@ class BinsSmall:
 
 BINS = {1: BinsLarge, 2: BinsLarge, 3: BinsSmall, 4: BinsSmall}
 
+# Describes a row x column map: the histogram base name, its title and the
+# tree expression giving the value plotted for each cell. The value is
+# applied as the weight when projecting the tree onto the map.
+Map = namedtuple('Map', 'name title value')
+
+# The 2D maps drawn for each detector, one page per map.
+MAPS = [
+    Map('vmap', 'New voltage', 'newVoltage'),
+    Map('gmap', 'New gain', 'newGain'),
+    Map('bmap', 'New bitshift', 'newBitshift'),
+    Map('vChangeMap', 'Voltage change', 'newVoltage-oldVoltage'),
+    Map('gChangeMap', 'Gain change (new/old)', 'newGain/oldGain'),
+    Map('bChangeMap', 'Bitshift change', 'newBitshift-oldBitshift')
+]
+
 class BySubsystem:
     """Collection of histograms, one for each subsystem."""
     def __init__(self, generator, basename, title, fill, select):
@@ -57,6 +65,7 @@ class BySubsystem:
 
     def project(self, tree):
         for h in self.histograms.itervalues():
+            instrument.count('ROOT.TTree.Project')
             tree.Project(h.GetName(), h.fill, h.select)
 
     def draw(self, pad):
@@ -93,20 +102,8 @@ def generate(tree, name):
     # 2D gain change maps.
     canvas = ROOT.TCanvas('canvas', '', 1, 1, 800, 800)
     canvas.Print(name + '[')
-    histograms = [
-        BySubsystem(map2d, 'vmap', 'New voltage',
-                    'row:column', 'newVoltage'),
-        BySubsystem(map2d, 'gmap', 'New gain',
-                    'row:column', 'newGain'),
-        BySubsystem(map2d, 'bmap', 'New bitshift',
-                    'row:column', 'newBitshift'),
-        BySubsystem(map2d, 'vChangeMap', 'Voltage change',
-                    'row:column', 'newVoltage-oldVoltage'),
-        BySubsystem(map2d, 'gChangeMap', 'Gain change (new/old)',
-                    'row:column', 'newGain/oldGain'),
-        BySubsystem(map2d, 'bChangeMap', 'Bitshift change',
-                    'row:column', 'newBitshift-oldBitshift')
-    ]
+    histograms = [BySubsystem(map2d, i.name, i.title, 'row:column', i.value)
+                  for i in MAPS]
     for i in histograms:
         i.project(tree)
         i.draw(canvas)
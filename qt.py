@@ -2,6 +2,8 @@
 
 import os
 
+import instrument
+
 # Compose the expected file name for each QT crate
 FILENAMES = {i: 'qt{}_tac.dat'.format(i) for i in range(1, 5)}
 
@@ -157,6 +159,7 @@ class System:
         Returns None if the channel is not present in the system.
         
         """
+        instrument.count('qt.get_channel')
         if test.crate in self.crates:
             return self.crates[test.crate].get_entry(test.board, test.number)
         else:
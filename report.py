@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+"""HTML/SVG quality-assurance report generation.
+
+An alternative to postscript.generate() that doesn't need ROOT or a
+PostScript viewer. Each of the row x column maps in postscript.MAPS,
+plus a page of voltage histograms, is written as a standalone SVG file,
+and an index.html links them all together.
+
+Each page is cached by a hash of the values it displays, recorded in
+report.json in the output directory. When the report is regenerated,
+only pages whose values have changed are re-rendered.
+"""
+
+import hashlib
+import json
+import os
+
+import palette
+import postscript
+
+# Bump this when the page layout changes so cached pages are re-rendered.
+RENDER_VERSION = 1
+
+# Name of the cache file written alongside the pages.
+CACHE_NAME = 'report.json'
+
+# Page and panel dimensions, in pixels.
+PAGE_SIZE = 800
+PANEL_SIZE = PAGE_SIZE / 2
+MARGIN = 40
+
+def entries(before, after):
+    """Returns a list of dictionaries with 'before' and 'after' cell values.
+
+    The keys match the branch names of the tree made by maketree.populate(),
+    so the expressions in postscript.MAPS can be evaluated on each entry.
+
+    """
+    rows = []
+    for old, new in zip(before, after):
+        for i, j in zip(old.cells, new.cells):
+            rows.append({
+                'detector': i.detector,
+                'channel': i.channel,
+                'row': i.row,
+                'column': i.column,
+                'oldGain': i.gain,
+                'newGain': j.gain,
+                'oldVoltage': i.voltage,
+                'newVoltage': j.voltage,
+                'oldBitshift': i.qt.bitshift,
+                'newBitshift': j.qt.bitshift,
+                'askedChange': getattr(j, 'requested_correction', 0.)
+            })
+    return rows
+
+def evaluate(expression, rows):
+    """Evaluates a tree expression for each entry.
+
+    Returns a list of (detector, row, column, value) tuples.
+    Entries for which the expression cannot be evaluated (e.g. division by
+    a zero gain) are omitted, as they would be empty bins in ROOT.
+
+    """
+    code = compile(expression, '<map>', 'eval')
+    values = []
+    for entry in rows:
+        try:
+            value = eval(code, {}, entry)
+        except ZeroDivisionError:
+            continue
+        values.append((entry['detector'], entry['row'], entry['column'],
+                       value))
+    return values
+
+def digest(name, values):
+    """Returns a hash identifying a page from its name and input values."""
+    sha = hashlib.sha1()
+    sha.update('{} {}\n'.format(RENDER_VERSION, name))
+    for value in values:
+        sha.update(repr(value))
+        sha.update('\n')
+    return sha.hexdigest()
+
+def text(x, y, string, size=12, anchor='start'):
+    """Returns an SVG text element."""
+    return ('<text x="{}" y="{}" font-family="Helvetica" font-size="{}" '
+            'text-anchor="{}">{}</text>').format(x, y, size, anchor, string)
+
+def rect(x, y, width, height, fill, stroke='none'):
+    """Returns an SVG rectangle element."""
+    return ('<rect x="{:.1f}" y="{:.1f}" width="{:.1f}" height="{:.1f}" '
+            'fill="{}" stroke="{}"/>').format(x, y, width, height, fill,
+                                              stroke)
+
+def svg(elements):
+    """Wraps a list of elements in an SVG document."""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             ('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" '
+              'height="{0}">').format(PAGE_SIZE),
+             rect(0, 0, PAGE_SIZE, PAGE_SIZE, 'white')]
+    lines.extend(elements)
+    lines.append('</svg>')
+    return '\n'.join(lines) + '\n'
+
+def panel_origin(detector):
+    """Returns the top-left corner of the panel for a detector.
+
+    Detectors are laid out 2 x 2, in the same order as BySubsystem.draw().
+
+    """
+    n = detector - 1
+    return (n % 2) * PANEL_SIZE, (n / 2) * PANEL_SIZE
+
+def map_panel(detector, title, values):
+    """Returns SVG elements drawing a row x column map for one detector."""
+    bins = postscript.BINS[detector]
+    x0, y0 = panel_origin(detector)
+    elements = [text(x0 + PANEL_SIZE / 2, y0 + 20,
+                     '{} detector {}'.format(title, detector), 14, 'middle')]
+    values = [v for v in values if v[0] == detector]
+    if not values:
+        return elements
+    vmin = min(v[3] for v in values)
+    vmax = max(v[3] for v in values)
+    levels = palette.quantize([v[3] for v in values], vmin, vmax, 50)
+    colours = palette.levels(50)
+    # Leave room at the right for the colour scale.
+    width = (PANEL_SIZE - 2 * MARGIN - 30) / float(bins.column.n)
+    height = (PANEL_SIZE - 2 * MARGIN) / float(bins.row.n)
+    bottom = y0 + PANEL_SIZE - MARGIN
+    for (_, row, column, _), level in zip(values, levels):
+        elements.append(rect(x0 + MARGIN + column * width,
+                             bottom - (row + 1) * height,
+                             width, height, colours[level]))
+    # Frame and axis labels.
+    elements.append(rect(x0 + MARGIN, y0 + MARGIN, bins.column.n * width,
+                         bins.row.n * height, 'none', 'black'))
+    elements.append(text(x0 + MARGIN + bins.column.n * width / 2,
+                         bottom + 20, 'column', 11, 'middle'))
+    elements.append(text(x0 + 12, y0 + PANEL_SIZE / 2, 'row', 11, 'middle'))
+    # Colour scale.
+    scalex = x0 + PANEL_SIZE - MARGIN - 20
+    step = (PANEL_SIZE - 2 * MARGIN) / float(len(colours))
+    for n, colour in enumerate(colours):
+        elements.append(rect(scalex, bottom - (n + 1) * step, 10, step,
+                             colour))
+    elements.append(text(scalex + 12, y0 + MARGIN + 8, '{:.4g}'.format(vmax),
+                         9))
+    elements.append(text(scalex + 12, bottom, '{:.4g}'.format(vmin), 9))
+    return elements
+
+def histogram_panel(detector, rows):
+    """Returns SVG elements drawing old and new voltage histograms."""
+    bins = postscript.BINS[detector].volt
+    x0, y0 = panel_origin(detector)
+    elements = [text(x0 + PANEL_SIZE / 2, y0 + 20,
+                     'Voltage detector {}'.format(detector), 14, 'middle')]
+    binwidth = (bins.max - bins.min) / bins.n
+    def fill(key):
+        counts = bins.n * [0]
+        for entry in rows:
+            if entry['detector'] != detector:
+                continue
+            n = int((entry[key] - bins.min) / binwidth)
+            if 0 <= n < bins.n:
+                counts[n] += 1
+        return counts
+    old, new = fill('oldVoltage'), fill('newVoltage')
+    top = max(old + new + [1])
+    width = (PANEL_SIZE - 2 * MARGIN) / float(bins.n)
+    height = (PANEL_SIZE - 2 * MARGIN) / float(top)
+    bottom = y0 + PANEL_SIZE - MARGIN
+    for n, (i, j) in enumerate(zip(old, new)):
+        x = x0 + MARGIN + n * width
+        elements.append(rect(x, bottom - j * height, width, j * height,
+                             palette.gradient(0.25), 'white'))
+        elements.append(rect(x, bottom - i * height, width, i * height,
+                             'none', 'black'))
+    elements.append(rect(x0 + MARGIN, y0 + MARGIN, PANEL_SIZE - 2 * MARGIN,
+                         PANEL_SIZE - 2 * MARGIN, 'none', 'black'))
+    elements.append(text(x0 + MARGIN, bottom + 15, '{:g}'.format(bins.min),
+                         10))
+    elements.append(text(x0 + PANEL_SIZE - MARGIN, bottom + 15,
+                         '{:g}'.format(bins.max), 10, 'end'))
+    elements.append(text(x0 + PANEL_SIZE - MARGIN, y0 + MARGIN - 5,
+                         'new (filled), old (outline), max {}'.format(top),
+                         10, 'end'))
+    return elements
+
+def pages(rows):
+    """Returns a list of (name, title, values, render) for each report page.
+
+    values are the inputs used to hash the page and render is a function
+    returning the SVG document.
+
+    """
+    result = []
+    for m in postscript.MAPS:
+        values = evaluate(m.value, rows)
+        def render(title=m.title, values=values):
+            elements = []
+            for detector in postscript.DETECTORS:
+                elements.extend(map_panel(detector, title, values))
+            return svg(elements)
+        result.append((m.name, m.title, values, render))
+    voltages = [(e['detector'], e['oldVoltage'], e['newVoltage'])
+                for e in rows]
+    def render_voltages():
+        elements = []
+        for detector in postscript.DETECTORS:
+            elements.extend(histogram_panel(detector, rows))
+        return svg(elements)
+    result.append(('voltages', 'Voltage distributions', voltages,
+                   render_voltages))
+    return result
+
+def read_cache(directory):
+    """Returns the {page name: hash} dictionary from a previous report."""
+    try:
+        with open(os.path.join(directory, CACHE_NAME)) as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+def write_index(directory, listing):
+    """Writes index.html showing every page in the report."""
+    lines = ['<!DOCTYPE html>',
+             '<html><head><meta charset="utf-8">',
+             '<title>fmsvoltages QA report</title></head><body>',
+             '<h1>fmsvoltages QA report</h1>',
+             '<ul>']
+    for name, title in listing:
+        lines.append('<li><a href="#{0}">{1}</a></li>'.format(name, title))
+    lines.append('</ul>')
+    for name, title in listing:
+        lines.append('<h2 id="{0}">{1}</h2>'.format(name, title))
+        lines.append('<img src="{0}.svg" alt="{1}">'.format(name, title))
+    lines.append('</body></html>')
+    with open(os.path.join(directory, 'index.html'), 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+def generate(before, after, directory):
+    """Write the report for 'before' and 'after' detectors to a directory.
+
+    Arguments are as for maketree.populate().
+    Returns the list of page names that were (re-)rendered; pages whose
+    inputs are unchanged since the last report in the directory are kept.
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    cache = read_cache(directory)
+    rendered = []
+    listing = []
+    for name, title, values, render in pages(entries(before, after)):
+        listing.append((name, title))
+        filename = os.path.join(directory, name + '.svg')
+        key = digest(name, values)
+        if cache.get(name) == key and os.path.exists(filename):
+            continue
+        with open(filename, 'w') as file:
+            file.write(render())
+        cache[name] = key
+        rendered.append(name)
+    write_index(directory, listing)
+    with open(os.path.join(directory, CACHE_NAME), 'w') as file:
+        json.dump(cache, file, indent=1, sort_keys=True)
+    return rendered
@@ -0,0 +1,54 @@
+"""Deferred import of ROOT.
+
+Importing ROOT takes seconds, and many uses of the programme (e.g.
+reading tables or converting files) never need it. Modules that use ROOT
+should do
+ from rootlib import ROOT
+and use ROOT as normal. The real module is imported, and configured, the
+first time an attribute of it is used.
+
+I encountered the WEIRDEST bug importing from ROOT.
+The programme worked fine on my Mac, and generally fine on a remote Linux
+computer, to which I ssh'd. However, if I used Cmd-tab to move away from
+the X11 window displaying the programme from the remove machine, when I
+returned the window was completely unresponsive.
+After much head-scratching, I found this was remedied by replacing all
+  from ROOT import <something>
+with just
+  import ROOT
+No idea why it should interfere with X11, but it does, at least for me.
+The proxy below only ever does "import ROOT".
+"""
+
+import sys
+
+class LazyRoot(object):
+    """Stands in for the ROOT module until it is first used."""
+    def __init__(self):
+        # Set directly, as __setattr__ is forwarded to ROOT.
+        self.__dict__['root'] = None
+
+    def module(self):
+        """Returns the ROOT module, importing and configuring it if needed."""
+        if self.root is None:
+            import ROOT
+            # Only operate ROOT in batch mode to avoid some crashes I
+            # experienced on RCF when using the programme over ssh.
+            ROOT.gROOT.SetBatch(True)
+            # May give to speed up on ROOT calls.
+            ROOT.SetSignalPolicy(ROOT.kSignalFast)
+            self.__dict__['root'] = ROOT
+        return self.root
+
+    def loaded(self):
+        """Returns True if ROOT has been imported."""
+        return 'ROOT' in sys.modules
+
+    def __getattr__(self, name):
+        return getattr(self.module(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.module(), name, value)
+
+
+ROOT = LazyRoot()
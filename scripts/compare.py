@@ -1,46 +1,160 @@
 #!/usr/bin/env python
 
-"""Compare the contents of two voltage-gain files."""
+"""Compare the contents of voltage-gain files.
+
+Any number of gain files, or working directories containing
+largeCellGains.txt and smallCellGains.txt, can be given e.g. one per
+iteration. Cells are matched by (detector, channel), so files need not
+be in the same order or contain the same channels. Each file is
+compared with the one before it (or with the first, with --baseline),
+listing cells whose voltage or gain differs by more than the thresholds
+and channels present in only one file, followed by a summary for each
+detector. --json writes all the results to a file.
+"""
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import json
+import os
 import sys
 
-def detector(line):
-    return int(line[0])
+# Gain files read from a working directory.
+GAIN_FILES = ['largeCellGains.txt', 'smallCellGains.txt']
+
+# Maximum number of missing channels to list (all are in the JSON).
+MAX_LISTED = 20
+
+def read(filename):
+    """Returns {(detector, channel): (row, column, voltage, gain)}.
+
+    Small cell voltages are hexadecimal DAC values, large cell voltages
+    are decimal (and negative).
+
+    """
+    cells = {}
+    with open(filename) as file:
+        for line in file:
+            words = line.split()
+            if not words:
+                continue
+            detector = int(words[0])
+            base = 10 if detector < 3 else 16
+            cells[(detector, int(words[1]))] = (
+                int(words[2]), int(words[3]), int(words[4], base),
+                float(words[5]))
+    return cells
+
+def load(path):
+    """Read a gain file, or the gain files in a directory."""
+    if not os.path.isdir(path):
+        return read(path)
+    cells = {}
+    for name in GAIN_FILES:
+        filename = os.path.join(path, name)
+        if os.path.exists(filename):
+            cells.update(read(filename))
+    return cells
+
+def differ(old, new, deltav, deltag):
+    """Compare two sets of cells.
+
+    Returns a list of differing cells as dictionaries, a list of keys
+    only in old, a list of keys only in new, and per-detector summaries.
 
-def voltage(line):
-    if detector(line) < 3:
-        base = 10
-    else:
-        base = 16
-    return int(line.split()[4], base)
+    """
+    cells = []
+    summary = {}
+    for key in sorted(old.viewkeys() & new.viewkeys()):
+        row, column, voltage1, gain1 = old[key]
+        voltage2, gain2 = new[key][2:]
+        dv = voltage2 - voltage1
+        ratio = gain2 / gain1 if gain1 else None
+        stats = summary.setdefault(key[0], {'cells': 0, 'voltages': 0,
+            'gains': 0, 'max_dv': 0, 'sum_dv': 0, 'min_ratio': None,
+            'max_ratio': None})
+        stats['cells'] += 1
+        stats['sum_dv'] += abs(dv)
+        stats['max_dv'] = max(stats['max_dv'], abs(dv))
+        if ratio is not None:
+            if stats['min_ratio'] is None:
+                stats['min_ratio'] = stats['max_ratio'] = ratio
+            stats['min_ratio'] = min(ratio, stats['min_ratio'])
+            stats['max_ratio'] = max(ratio, stats['max_ratio'])
+        changed_v = abs(dv) > deltav
+        changed_g = abs(gain2 - gain1) > deltag * abs(gain1)
+        stats['voltages'] += changed_v
+        stats['gains'] += changed_g
+        if changed_v or changed_g:
+            cells.append({'detector': key[0], 'channel': key[1],
+                          'row': row, 'column': column,
+                          'voltage': [voltage1, voltage2], 'dv': dv,
+                          'gain': [gain1, gain2], 'ratio': ratio})
+    for stats in summary.itervalues():
+        stats['mean_dv'] = float(stats.pop('sum_dv')) / stats['cells']
+    return (cells, sorted(old.viewkeys() - new.viewkeys()),
+            sorted(new.viewkeys() - old.viewkeys()), summary)
 
-def gain(line):
-    return float(line.split()[5])
+def print_comparison(first, second, cells, removed, added, summary):
+    print '{} vs. {}'.format(first, second)
+    for cell in cells:
+        print ('  {detector} {channel:>3} ({row:>2}, {column:>2}) '
+               'voltage {voltage[0]} -> {voltage[1]} ({dv:+}) '
+               'gain {gain[0]} -> {gain[1]}'.format(**cell))
+    for label, keys in ('only in first', removed), ('only in second', added):
+        if keys:
+            print '  {} {}: {}{}'.format(len(keys), label,
+                ' '.join('{}/{}'.format(*key) for key in keys[:MAX_LISTED]),
+                ' ...' if len(keys) > MAX_LISTED else '')
+    print '  {:>8}{:>8}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('detector',
+        'cells', 'voltages', 'gains', 'mean |dV|', 'max |dV|', 'min G2/G1',
+        'max G2/G1')
+    for detector, stats in sorted(summary.iteritems()):
+        ratios = ['{:.4f}'.format(r) if r is not None else '-'
+                  for r in stats['min_ratio'], stats['max_ratio']]
+        print '  {:>8}{:>8}{:>10}{:>8}{:>10.2f}{:>10}{:>10}{:>10}'.format(
+            detector, stats['cells'], stats['voltages'], stats['gains'],
+            stats['mean_dv'], stats['max_dv'], *ratios)
 
 def parse():
-    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
-    parser.add_argument('file1')
-    parser.add_argument('file2')
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('paths', nargs='+',
+        help='gain files or working directories, in order')
     parser.add_argument('--deltav', type=int, default=0,
         help='minimum difference in voltage')
-    return parser.parse_args()
+    parser.add_argument('--deltag', type=float, default=0.,
+        help='minimum relative difference in gain')
+    parser.add_argument('--baseline', action='store_true',
+        help='compare every file with the first, not the one before it')
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help='only print the summaries')
+    parser.add_argument('--json', help='file to write results to')
+    args = parser.parse_args()
+    if len(args.paths) < 2:
+        parser.error('at least two files are needed')
+    return args
 
 if __name__ == '__main__':
     args = parse()
-    with open(args.file1) as file:
-        lines1 = file.read().splitlines()
-    with open(args.file2) as file:
-        lines2 = file.read().splitlines()
-    if len(lines1) != len(lines2):
-        print 'different numbers of lines'
-        quit()
-    for line1, line2 in zip(lines1, lines2):
-        differ = False
-        if abs(voltage(line1) - voltage(line2)) > args.deltav:
-            print 'different voltages:'
-            differ = True
-        if gain(line1) != gain(line2):
-            print 'different gains:'
-            differ = True
-        if differ: print line1, 'vs.', line2
+    results = []
+    try:
+        first = previous = load(args.paths[0])
+        for name, path in zip(args.paths, args.paths[1:]):
+            current = load(path)
+            if args.baseline:
+                name = args.paths[0]
+            cells, removed, added, summary = differ(
+                first if args.baseline else previous, current,
+                args.deltav, args.deltag)
+            print_comparison(name, path, [] if args.quiet else cells,
+                             removed, added, summary)
+            results.append({'first': name, 'second': path, 'cells': cells,
+                            'only_first': removed, 'only_second': added,
+                            'summary': summary})
+            previous = current
+    except (IOError, ValueError, IndexError) as err:
+        print >> sys.stderr, 'compare:', err
+        sys.exit(1)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=1, sort_keys=True)
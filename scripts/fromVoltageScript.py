@@ -2,135 +2,173 @@
 
 """Convert voltage scripts to voltage/gain files.
 
+Any mix of large-cell LeCroy scripts (fms_hv_large_*.sh) and small-cell
+scripts (setVoltages.txt) can be given, and largeCellGains.txt and/or
+smallCellGains.txt are written for the types of script given.
 For large cells, where there are multiple scripts, the names
 of all the scripts should be passed as command line arguments
 to properly access values for all cells.
+Gains are set to 1. Addresses not found in fmsCellInfoTable.txt are
+listed, as are cells for which no voltage was found.
 """
 
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 import os
 import re
 import sys
 
+# Import the fmsvoltages modules from the directory above this one.
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
 import cellinfo
+import files
 import fms.detector
 
-DETECTORS = {
-    1: fms.detector.LargeDetector(1),
-    2: fms.detector.LargeDetector(2),
-    3: fms.detector.SmallDetector(3),
-    4: fms.detector.SmallDetector(4)
-}
-
-INFOTABLE = cellinfo.Table(os.path.join(os.getenv('FMSVOLTAGES'), 'fmsCellInfoTable.txt'))
-
-# Regular expression pattern to look for a pattern like this:
-# (slot,channel)<whitespace>[-]voltage
-# Requires slot and channel to be 1 or 2 digits, voltage to be
-# no more than 4.
-RE_PATTERN = '\(([0-9]{1,2}),([0-9]{1,2})\)[ \t]*([\-]?[0-9]{1,4})'
+# Matches any line of interest in a voltage script, in a single search.
+# Large cells set a voltage with a line like
+#   echo -e "write (0,0) -1373\r"; sleep 2;
+# requiring slot and channel to be 1 or 2 digits, voltage no more than 4.
+# The telnet number is taken from the file name, or failing that from
+#   ) | telnet fms-serv.trg.bnl.local 7006 > ...
+# Small cells change device, chip/channel and set voltages with
+#   !SETdevice 0
+#   !setctrl 0 0
+#   !rdac EA 0x66
+TOKENS = re.compile(r'''
+    write\ \((?P<slot>[0-9]{1,2}),(?P<lecroy>[0-9]{1,2})\)[ \t]*
+        (?P<hv>-?[0-9]{1,4})
+  | telnet\ \S+\ (?P<telnet>700[5-8])
+  | !SETdevice\s+(?P<device>[0-9]+)
+  | !setctrl\s+(?P<chip>[0-9]+)\s+(?P<channel>[0-9]+)
+  | !rdac\s+(?P<address>[0-9A-Fa-f]+)\s+(?:0x)?(?P<dac>[0-9A-Fa-f]+)
+''', re.VERBOSE)
 
-def get_lecroy_from_voltage_script(line):
-    """Returns lecroy slot and channel and the voltage
-    
-    The input line should be formatted like
-       echo -e "write (0,0) -1373\r"; sleep 2;
-    where the slot and channel are in (slot, channel) and voltage
-    is the negative number following that.
-    Returns None for all values if the input is invalid.
-    """
-    try:
-        match = re.search(RE_PATTERN, line)
-        slot, channel, voltage = [int(i) for i in match.groups()]
-        return slot, channel, voltage
-    except:
-        return None, None, None
+# Telnet number in a LeCroy script name like fms_hv_large_north_1_7006.sh.
+TELNET_NAME = re.compile('(700[5-8])')
 
-def telnet_from_filename(filename):
-    """Extract telnet number from voltage script name.
-    
-    Filename format is fms_hv_large_north_1_7006.sh.
-    Telnet numbers are 7005 to 7008.
-    Returns None if the input is invalid.
-    """
-    try:
-        return int(re.search('(700[5-8]{1})', filename).group(0))
-    except:
-        return None
+class Importer(object):
+    """Sets cell voltages from the addresses in voltage scripts."""
+    def __init__(self, table):
+        """Constructor. table is a cellinfo.Table."""
+        self.table = table
+        self.detectors = {
+            1: fms.detector.LargeDetector(1),
+            2: fms.detector.LargeDetector(2),
+            3: fms.detector.SmallDetector(3),
+            4: fms.detector.SmallDetector(4)
+        }
+        # Descriptions of addresses not found in the table.
+        self.unmatched = []
+        # IDs (see fms.cellid) of cells whose voltage was set.
+        self.found = set()
 
-def process_large(filename):
-    """Processes a single file with large cell information."""
-    with open(filename) as file:
-        lines = [line for line in file.read().splitlines() if 'write (' in line]
-    for line in lines:
-        slot, channel, voltage = get_lecroy_from_voltage_script(line)
-        if None in [slot, channel, voltage]:
-            continue
-        cell = fms.cell.Large()
-        cell.lecroy.telnet = telnet_from_filename(filename)
-        cell.lecroy.slot, cell.lecroy.channel = slot, channel
-        info = INFOTABLE.from_address(cell)
-        if not info:
-            print filename, cell.detector, cell.channel, cell.lecroy.telnet, cell.lecroy.slot, cell.lecroy.channel
-        cell = DETECTORS[info.detector].get_cell(info.row, info.column)
+    def set_voltage(self, info, voltage):
+        """Set the voltage of the cell described by a cellinfo.Cell."""
+        cell = self.detectors[info.detector].get_cell(info.row, info.column)
+        if cell is None:
+            return
         cell.voltage = abs(voltage)
         cell.gain = 1.
+        self.found.add(cell.id)
 
-def process_small(filename):
-    # Detector number keyed by 'device number'.
-    # Small detector 3 is device 1, detector 4 is device 0.
-    detector = {1: 3, 0: 4}
-    # We need to process the lines one-by-one so we can track
-    # when the device, chip or channel change.
-    # Construct a Small cell to use to search the info table.
-    searchcell = fms.cell.Small()
-    with open(filename) as file:
-        lines = file.read().splitlines()
-    for line in lines:
-        # Change in device is done by a line like
-        # !SETdevice 0
-        if '!SETdevice' in line:
-            searchcell.device = int(line.split()[1])
-        # Change in chip/channel is done by a line like
-        # !setctrl 0 0
-        elif '!setctrl' in line:
-            words = line.split()
-            searchcell.chip = int(words[1])
-            searchcell.channel = int(words[2])
-        # Setting channel voltage is done by a line like
-        # !rdac EA 0x66
-        elif '!rdac' in line:
-            words = line.split()
-            searchcell.address = int(words[1], 16)
-            searchcell.voltage = int(words[2], 16)
-            info = INFOTABLE.from_address(searchcell)
-            if info is None:
-                print 'Failed to locate channel:'
-                print searchcell.device, searchcell.chip, searchcell.channel, hex(searchcell.address)
-            # The info lets us get the detector, row and column
-            # for the cell with this device/chip/channel/address
-            else:
-                cell = DETECTORS[info.detector].get_cell(info.row, info.column)
-                cell.voltage = searchcell.voltage
-                cell.gain = 1.
+    def process(self, filename):
+        """Read a script. Returns 'large', 'small' or None if neither."""
+        telnet = None
+        match = TELNET_NAME.search(os.path.basename(filename))
+        if match:
+            telnet = int(match.group(1))
+        # LeCroy settings are kept until the telnet number is known.
+        lecroy = []
+        device, chip, channel = None, None, None
+        kind = None
+        with open(filename) as file:
+            for line in file:
+                token = TOKENS.search(line)
+                if token is None:
+                    continue
+                group = token.groupdict()
+                if group['hv'] is not None:
+                    lecroy.append((int(group['slot']), int(group['lecroy']),
+                                   int(group['hv'])))
+                elif group['telnet'] is not None:
+                    telnet = telnet or int(group['telnet'])
+                elif group['device'] is not None:
+                    device = int(group['device'])
+                elif group['chip'] is not None:
+                    chip, channel = int(group['chip']), int(group['channel'])
+                else:
+                    kind = 'small'
+                    address = int(group['address'], 16)
+                    info = self.table.find_small(device, chip, channel,
+                                                 address)
+                    if info is None:
+                        self.unmatched.append(
+                            '{}: device {} chip {} channel {} address {}'
+                            .format(filename, device, chip, channel,
+                                    hex(address)))
+                    else:
+                        self.set_voltage(info, int(group['dac'], 16))
+        if lecroy:
+            kind = 'large'
+            if telnet is None:
+                self.unmatched.append('{}: no telnet number'.format(filename))
+                return kind
+            for slot, channel, voltage in lecroy:
+                info = self.table.find_large(telnet, slot, channel)
+                if info is None:
+                    self.unmatched.append(
+                        '{}: telnet {} slot {} channel {}'.format(
+                            filename, telnet, slot, channel))
+                else:
+                    self.set_voltage(info, voltage)
+        return kind
 
-def process(filename):
-    if 'fms_hv_large_' in filename:
-        process_large(filename)
-        return 'large'
-    elif 'setVoltages' in filename:
-        process_small(filename)
-        return 'small'
-    return None
+    def missing(self, numbers):
+        """Returns the (detector, row, column) of cells without voltages."""
+        return [(cell.detector, cell.row, cell.column)
+                for number in numbers
+                for cell in self.detectors[number].cells
+                if cell.id not in self.found]
+
+    def write(self, filename, numbers):
+        """Write the gain table for the numbered detectors to a file."""
+        with open(filename, 'w') as file:
+            for number in numbers:
+                self.detectors[number].write_gain_table(file)
+
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('scripts', nargs='+', help='voltage scripts')
+    parser.add_argument('-i', '--info', help='fmsCellInfoTable.txt to use '
+        '(default: located as for the main programme)')
+    parser.add_argument('-o', '--output', default='.',
+        help='directory to write gain files to')
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    processed = [process(filename) for filename in sys.argv[1:]]
-    if 'large' in processed:
-        with open('largeCellGains.txt', 'w') as file:
-            DETECTORS[1].write_gain_table(file)
-        with open('largeCellGains.txt', 'a') as file:
-            DETECTORS[2].write_gain_table(file)
-    if 'small' in processed:
-        with open('smallCellGains.txt', 'w') as file:
-            DETECTORS[3].write_gain_table(file)
-        with open('smallCellGains.txt', 'a') as file:
-            DETECTORS[4].write_gain_table(file)
+    args = parse()
+    info = args.info or files.locate(files.LIB_NAMES['INFO'])
+    if not info:
+        sys.exit('fromVoltageScript: could not locate {}, give it with '
+                 '-i'.format(files.LIB_NAMES['INFO']))
+    try:
+        table = cellinfo.Table(info)
+    except IOError as err:
+        sys.exit('fromVoltageScript: {}'.format(err))
+    importer = Importer(table)
+    processed = [importer.process(filename) for filename in args.scripts]
+    for kind, name, numbers in [('large', 'largeCellGains.txt', [1, 2]),
+                                ('small', 'smallCellGains.txt', [3, 4])]:
+        if kind not in processed:
+            continue
+        importer.write(os.path.join(args.output, name), numbers)
+        missing = importer.missing(numbers)
+        if missing:
+            print 'No voltage found for {} {} cells'.format(len(missing),
+                                                            kind)
+    for address in importer.unmatched:
+        print 'Failed to locate channel:', address
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""Apply a change in detector-to-QT mapping to all the files that use it.
+
+Takes the old and new channel-to-QT mappings, in the fmsMap format
+ detector channel qtcrate qtslot qtchannel
+(with detectors numbered 8 to 11 and QT slots from 1), and writes in one
+go:
+ - qt1_tac.dat to qt4_tac.dat, with each channel's pedestal and bitshift
+   moved from its old QT address to its new one,
+ - fmsCellInfoTable.txt with the new QT crate, slot, daughter card and
+   daughter channel of each cell, if --info is given,
+ - fmsMap.txt, the new mapping for the database.
+QT addresses used by neither mapping keep their values, and addresses
+that are no longer used are reset. Every cell is checked to have the
+same pedestal and bitshift after remapping as before.
+"""
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import os
+import sys
+
+import qt
+
+# Offset between fmsMap detector numbers [8, 11] and the info table [1, 4].
+DETECTOR_OFFSET = 7
+
+# Pedestal and bitshift written to QT addresses no longer used by any cell.
+UNUSED = (-1, 0)
+
+def read_map(filename):
+    """Returns {(detector, channel): (qtcrate, qtslot, qtchannel)}.
+
+    Detectors are numbered [1, 4] and QT slots [0, 10], as in qt.py.
+    Raises ValueError if two cells share a QT address.
+
+    """
+    channels = {}
+    addresses = {}
+    with open(filename) as file:
+        for line in file:
+            words = line.split()
+            if not words:
+                continue
+            detector, channel, crate, slot, number = [int(i) for i in words]
+            key = (detector - DETECTOR_OFFSET, channel)
+            address = (crate, slot - 1, number)
+            if address in addresses:
+                raise ValueError('{}: {} and {} share QT address {}'.format(
+                    filename, addresses[address], key, address))
+            addresses[address] = key
+            channels[key] = address
+    return channels
+
+def index_qt(system):
+    """Returns {(qtcrate, qtslot, qtchannel): qt.Channel} for a qt.System."""
+    return {(crate.number, entry.board, entry.number): entry
+            for crate in system.crates.itervalues()
+            for entry in crate.entries}
+
+def remap_qt(system, old, new):
+    """Move the pedestal and bitshift of each cell to its new QT address.
+
+    old and new are mappings from read_map(). Returns a list of problems.
+
+    """
+    entries = index_qt(system)
+    problems = []
+    # Read every value before changing any, as channels can swap places.
+    values = {}
+    for key, address in old.iteritems():
+        if address in entries:
+            values[key] = (entries[address].pedestal,
+                           entries[address].bitshift)
+        else:
+            problems.append('{}: old QT address {} not in QT files'.format(
+                key, address))
+    for address in set(old.itervalues()) - set(new.itervalues()):
+        if address in entries:
+            entries[address].pedestal, entries[address].bitshift = UNUSED
+    for key, address in new.iteritems():
+        if key not in values:
+            continue
+        if address not in entries:
+            problems.append('{}: new QT address {} not in QT files'.format(
+                key, address))
+            continue
+        entries[address].pedestal, entries[address].bitshift = values[key]
+    # Check each cell kept its values.
+    for key, value in values.iteritems():
+        entry = entries.get(new.get(key))
+        if entry is not None and (entry.pedestal, entry.bitshift) != value:
+            problems.append('{}: pedestal/bitshift {} became {}'.format(
+                key, value, (entry.pedestal, entry.bitshift)))
+    return problems
+
+def remap_info(lines, new):
+    """Returns info table lines with QT information from a new mapping.
+
+    Lines for cells not in the mapping are unchanged.
+
+    """
+    remapped = []
+    for line in lines:
+        words = line.split()
+        key = (int(words[0]), int(words[1])) if words else None
+        if key not in new:
+            remapped.append(line)
+            continue
+        crate, slot, number = new[key]
+        words[4:8] = [crate, slot + 1, number / 8, number % 8]
+        remapped.append('{}{:>4}{:>3}{:>3}{:>2}{:>3}{:>2}{:>2}{:>5}{:>3}{:>3}'
+                        '{:>3}'.format(*words))
+    return remapped
+
+def map_lines(mapping):
+    """Returns fmsMap format lines for a mapping, sorted by channel."""
+    return ['{} {} {} {} {}'.format(detector + DETECTOR_OFFSET, channel,
+                                    crate, slot + 1, number)
+            for (detector, channel), (crate, slot, number)
+            in sorted(mapping.iteritems())]
+
+def write_lines(filename, lines):
+    with open(filename, 'w') as file:
+        for line in lines:
+            file.write(line + '\n')
+
+def parse():
+    """Parse and return command line arguments."""
+    parser = ArgumentParser(description=__doc__.split('\n')[0],
+        formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('map1', help='old channel-to-QT mapping')
+    parser.add_argument('map2', help='new channel-to-QT mapping')
+    parser.add_argument('qtdir',
+        help='directory containing old qt#_tac.dat files')
+    parser.add_argument('newdir', help='output directory')
+    parser.add_argument('--info', help='fmsCellInfoTable.txt to update')
+    parser.add_argument('-f', '--force', action='store_true',
+        help='write output even if problems are found')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse()
+    try:
+        old = read_map(args.map1)
+        new = read_map(args.map2)
+        system = qt.System(args.qtdir)
+        info = None
+        if args.info:
+            with open(args.info) as file:
+                info = file.read().splitlines()
+    except (IOError, ValueError) as err:
+        sys.exit('remap: {}'.format(err))
+    problems = ['{}: not in new mapping'.format(key)
+                for key in sorted(old.viewkeys() - new.viewkeys())]
+    problems.extend(remap_qt(system, old, new))
+    for problem in problems:
+        print problem
+    if problems and not args.force:
+        sys.exit('remap: {} problems, nothing written (use --force to write '
+                 'anyway)'.format(len(problems)))
+    if not os.path.isdir(args.newdir):
+        os.makedirs(args.newdir)
+    system.write(args.newdir)
+    if info is not None:
+        write_lines(os.path.join(args.newdir, 'fmsCellInfoTable.txt'),
+                    remap_info(info, new))
+    write_lines(os.path.join(args.newdir, 'fmsMap.txt'), map_lines(new))
+    moved = sum(old[key] != new.get(key, old[key]) for key in old)
+    print 'Moved {} of {} channels'.format(moved, len(old))
@@ -1,51 +1,57 @@
 #!/usr/bin/env python
 
 """Converts Steve's format for gains corrections to one based on row and
-column number.
+column number, merging several correction files if given.
 
 Steve uses these 4 columns:
  eastOrWest detector channel correction
 whereas I use these 4:
  detector row column correction.
 
-The first argument should be the input file from Steve.
+The input files can be in either format, which is guessed from their
+contents unless --format is given; a file that fits both formats is an
+error without --format. Where several are given, the corrections for
+each cell are multiplied, or averaged with --method geometric.
+Corrections for positions with no cell are dropped. The last argument
+is the output file.
 """
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import os
 import sys
 
-def process(line):
-    """Process a single line from an input file.
-    
-    Line format is:
-        side detector channel gain
-    side is east or west and detector is 1 or 2 for large, 3 or 4 for small.
-    
-    Returns (detector, channel), correction
-    """
-    side, detector, channel, correction = line.split()
-    return (int(detector), int(channel)), float(correction)
+# Import the fmsvoltages modules from the directory above this one.
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import corrections
 
 if __name__ == '__main__':
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
-    parser.add_argument('infile', help='correction file in Steve\'s format')
+    parser.add_argument('infiles', nargs='+', metavar='infile',
+        help='correction file in Steve\'s or row/column format')
     parser.add_argument('outfile', help='correction file in row/column format')
+    parser.add_argument('--format', choices=corrections.FORMATS,
+        default=corrections.AUTO, help='format of the input files')
+    parser.add_argument('--method', choices=corrections.METHODS,
+        default=corrections.PRODUCT,
+        help='how to combine corrections from several files')
+    parser.add_argument('--weights', type=float, nargs='+',
+        help='weight of each input file for --method geometric')
     args = parser.parse_args()
-    with open(args.infile) as file:
-        # Remove lines with 1 at the start, as those are for the FPD
-        input = [line for line in file.read().splitlines()
-                 if not line.startswith('1')]
-    # Accumulate gains for all large and small channels.
-    # Key by (detector, channel number).
-    channels = dict(process(line) for line in input)
-    # There are 17 columns per row for large detectors and
-    # 12 columns per row for small detectors.
-    nColumns = {1: 17, 2: 17, 3: 12, 4: 12}
-    outFile = open(args.outfile, 'w')
-    for (detector, channel), correction in sorted(channels.iteritems()):
-        # Channel is in range [1, N] and column in range [0, n).
-        column = (channel - 1) % nColumns[detector]
-        row = (channel - 1) / nColumns[detector]
-        string = "{} {} {} {}\n".format(detector, row, column, str(correction))
-        outFile.write(string)
-    outFile.close()
\ No newline at end of file
+    try:
+        sources = [corrections.load(name, args.format)
+                   for name in args.infiles]
+        for name, factors in zip(args.infiles, sources):
+            invalid = corrections.invalid(factors)
+            if invalid:
+                print '{}: dropped {} corrections for positions with no ' \
+                      'cell'.format(name, len(invalid))
+        factors = corrections.merge([corrections.valid(factors)
+                                     for factors in sources],
+                                    args.method, args.weights)
+    except (IOError, ValueError, IndexError) as err:
+        sys.exit('toRowColumn: {}'.format(err))
+    with open(args.outfile, 'w') as file:
+        for line in corrections.to_lines(factors):
+            file.write(line + '\n')
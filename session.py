@@ -0,0 +1,387 @@
+"""The state of an fmsvoltages iteration, independent of any GUI.
+
+A Session holds the detectors, reads the library and working directory
+files, applies gain corrections and writes the full set of output files.
+The Tk application (App.py) and the command line tool (fmsbatch.py)
+both drive a Session, so this module must not import Tkinter.
+"""
+
+import collections
+import copy
+import hashlib
+import os
+
+from fms.cell import Base
+import fms.cellid as cellid
+from fms.detector import * # NORTH_LARGE etc
+from corrections import parse as parse_corrections
+import files
+import instrument
+import lecroytools
+import librarycache
+import qt
+import smallcellscript
+import staging
+
+# Input file types of the gain files and of the QT files, with crate numbers.
+GAIN_TYPES = ['GAIN_LARGE', 'GAIN_SMALL']
+QT_TYPES = {'QT{}'.format(crate): crate for crate in qt.FILENAMES}
+
+# Decimal places of gains in the gain files.
+GAIN_PLACES = 5
+
+# Outcomes of reloading a value changed in an input file: the value in
+# memory was replaced, or it had also been changed here and was kept.
+UPDATED = 'updated'
+KEPT = 'kept'
+
+def parse_values(lines, filetype):
+    """Returns the values in the lines of an input file.
+
+    Gain files give {cell ID: (voltage, gain)}, leaving out positions
+    outside the detectors (see fms.cellid), and QT files give
+    {(crate, board, channel): (pedestal, bitshift)}.
+    Raises ValueError for a malformed line.
+    """
+    values = {}
+    for line in lines:
+        words = line.split()
+        if not words:
+            continue
+        if filetype in QT_TYPES:
+            if len(words) != 4:
+                raise ValueError('Bad QT line {!r}'.format(line))
+            entry = qt.Channel.from_string(line, QT_TYPES[filetype])
+            values[(entry.crate, entry.board, entry.number)] = \
+                (entry.pedestal, entry.bitshift)
+        else:
+            if len(words) != 6:
+                raise ValueError('Bad gain line {!r}'.format(line))
+            cell = Base()
+            cell.set_from_string(line)
+            id = cellid.from_position(cell.detector, cell.row, cell.column)
+            if id is not None:
+                values[id] = cell.voltage, round(cell.gain, GAIN_PLACES)
+    return values
+
+def read_snapshot(path, filetype):
+    """Returns (SHA-1 digest, parse_values()) for an input file."""
+    with open(path, 'rb') as file:
+        contents = file.read()
+    return (hashlib.sha1(contents).hexdigest(),
+            parse_values(contents.splitlines(), filetype))
+
+class Session(object):
+    """Detectors and the files they were read from."""
+    def __init__(self):
+        """Constructor. Creates empty detectors."""
+        # This is the main level of organising all the FMS data.
+        self.detectors = {
+            NORTH_LARGE: LargeDetector(NORTH_LARGE),
+            SOUTH_LARGE: LargeDetector(SOUTH_LARGE),
+            NORTH_SMALL: SmallDetector(NORTH_SMALL),
+            SOUTH_SMALL: SmallDetector(SOUTH_SMALL)
+        }
+        # Copy of the detectors as they were when input was read.
+        self.initial = None
+        # The files.Files locating library and input files.
+        self.files = None
+        # The qt.System read from the input directory.
+        self.qt = None
+        # {file type: read_snapshot()} of each input file as last read,
+        # saved or reloaded, to tell which values others have changed.
+        self.snapshots = {}
+
+    @instrument.timed('library')
+    def read_library(self):
+        """Read library files.
+
+        These contain geometrical and calibration information that
+        isn't modified by the user.
+        Raises IOError if the files cannot be found or read.
+        """
+        # Create a new file set and populate it with all the library files.
+        self.files = files.Files()
+        # Parsed contents, from the binary cache if it is up to date.
+        library = librarycache.load(self.files)
+        for detector in self.detectors.itervalues():
+            # Initialise miscellaneous cell info
+            detector.set_info_entries(library.info)
+            # Set calibration information
+            detector.set_calibration(library.calibration)
+
+    @instrument.timed('input')
+    def read_input(self, path):
+        """Read modifiable input files from a directory.
+
+        See files.Files for list of files and their meanings.
+        Returns a sorted list of the names of missing files, in which case
+        nothing is read, or an empty list on success.
+        Raises IOError if a file cannot be read.
+        """
+        # Finish or discard any interrupted save to the directory.
+        if path and os.path.isdir(path):
+            staging.recover(path)
+        # Search the path for all the input files.
+        foundall, missing = self.files.locate_input(path)
+        if not foundall:
+            return sorted(missing)
+        # Read contents of gain/voltage files.
+        # This must come first, as it also sets the row and column numbers.
+        with instrument.timer('input.gains'):
+            with self.files.open_file('GAIN_LARGE') as file:
+                largegains = file.readlines()
+                for x in NORTH_LARGE, SOUTH_LARGE:
+                    self.detectors[x].set_voltages(largegains)
+            with self.files.open_file('GAIN_SMALL') as file:
+                smallgains = file.readlines()
+                for x in NORTH_SMALL, SOUTH_SMALL:
+                    self.detectors[x].set_voltages(smallgains)
+        # Set QT information
+        with instrument.timer('input.qt'):
+            qtdirname = os.path.dirname(self.files['QT1'])
+            self.qt = qt.System(qtdirname)
+            for det in self.detectors.itervalues():
+                det.set_qt(self.qt)
+        # Now that the detector information is complete,
+        # let's keep a copy of the initial detector state.
+        # This is required for when we make a ROOT
+        # tree with initial and final information.
+        with instrument.timer('input.deepcopy'):
+            self.initial = copy.deepcopy(self.detectors)
+        with instrument.timer('input.snapshot'):
+            self.snapshot(files.INPUT_NAMES)
+        return []
+
+    def input_paths(self):
+        """Returns {file type: path} of the input files read."""
+        return {filetype: self.files[filetype]
+                for filetype in files.INPUT_NAMES}
+
+    def snapshot(self, filetypes):
+        """Record the contents of input files as the values on disk."""
+        for filetype in filetypes:
+            self.snapshots[filetype] = read_snapshot(self.files[filetype],
+                                                     filetype)
+
+    def changed_files(self, filetypes=None):
+        """Returns the sorted input file types changed on disk.
+
+        Only the given file types are checked, by default all of them.
+        A file has changed if its contents differ from when it was last
+        read, saved or reloaded. Files that can't be read are left out.
+        """
+        if filetypes is None:
+            filetypes = files.INPUT_NAMES
+        changed = []
+        for filetype in sorted(filetypes):
+            try:
+                if staging.digest(self.files[filetype]) != \
+                   self.snapshots[filetype][0]:
+                    changed.append(filetype)
+            except IOError:
+                continue
+        return changed
+
+    def reload_targets(self, filetype):
+        """Returns {key: (current, initial)} for an input file's values.
+
+        Keys are as from parse_values(). The objects holding the values
+        are cells for gain files and qt.Channels for QT files, and the
+        initial one is None if there is none.
+        """
+        if filetype in QT_TYPES:
+            crate = self.qt.crates[QT_TYPES[filetype]]
+            initial = {(cell.qt.crate, cell.qt.board, cell.qt.number): cell.qt
+                       for detector in self.initial.itervalues()
+                       for cell in detector.cells}
+            return {(entry.crate, entry.board, entry.number):
+                    (entry, initial.get((entry.crate, entry.board,
+                                         entry.number)))
+                    for entry in crate.entries}
+        initial = {cell.id: cell for detector in self.initial.itervalues()
+                   for cell in detector.cells}
+        return {cell.id: (cell, initial.get(cell.id))
+                for detector in self.detectors.itervalues()
+                for cell in detector.cells}
+
+    @instrument.timed('reload')
+    def reload(self, filetypes):
+        """Re-read input files and apply the values changed in them.
+
+        Each value that changed on disk since the file was last read,
+        saved or reloaded replaces the value in memory, unless that was
+        also changed here and not saved, in which case it is kept. The
+        initial state takes the new value either way, so changes since
+        loading still only show changes made here. Values for cells or
+        QT channels that don't exist are ignored.
+        Returns {file type: collections.Counter of UPDATED and KEPT}.
+        Raises IOError or ValueError if a file cannot be read, in which
+        case nothing is changed.
+        """
+        snapshots = {filetype: read_snapshot(self.files[filetype], filetype)
+                     for filetype in filetypes}
+        outcomes = {}
+        for filetype, (digest, values) in snapshots.iteritems():
+            before = self.snapshots[filetype][1]
+            targets = self.reload_targets(filetype)
+            if filetype in QT_TYPES:
+                names = 'pedestal', 'bitshift'
+            else:
+                names = 'voltage', 'gain'
+            outcomes[filetype] = collections.Counter()
+            for key, value in values.iteritems():
+                if value == before.get(key) or key not in targets:
+                    continue
+                current, initial = targets[key]
+                mine = tuple(getattr(current, i) for i in names)
+                if filetype in GAIN_TYPES:
+                    mine = mine[0], round(mine[1], GAIN_PLACES)
+                if mine == before.get(key):
+                    for name, i in zip(names, value):
+                        setattr(current, name, i)
+                    outcomes[filetype][UPDATED] += 1
+                elif mine != value:
+                    outcomes[filetype][KEPT] += 1
+                if initial is not None:
+                    for name, i in zip(names, value):
+                        setattr(initial, name, i)
+        self.snapshots.update(snapshots)
+        return outcomes
+
+    def corrections(self, lines):
+        """Returns uncomputed Corrections for all detectors.
+
+        See Detector.corrections() for the format of lines.
+        """
+        return self.factor_corrections(parse_corrections(lines))
+
+    def factor_corrections(self, factors):
+        """Returns uncomputed Corrections for all detectors.
+
+        factors is a dictionary of gain factors keyed by
+        (detector, row, column), as returned by corrections.parse().
+        """
+        split = collections.defaultdict(dict)
+        for (number, row, column), factor in factors.iteritems():
+            split[number][(row, column)] = factor
+        corrections = []
+        for number, detector in self.detectors.iteritems():
+            corrections.extend(detector.factor_corrections(split[number]))
+        return corrections
+
+    def apply_corrections(self, lines, engine=None):
+        """Compute and apply gain corrections.
+
+        Returns a collections.Counter of Correction outcomes.
+        """
+        return self.apply_factors(parse_corrections(lines), engine)
+
+    def apply_factors(self, factors, engine=None):
+        """Compute and apply gain corrections from factor_corrections() input.
+
+        Returns a collections.Counter of Correction outcomes.
+        """
+        corrections = self.factor_corrections(factors)
+        with instrument.timer('corrections.compute'):
+            Correction.compute_all(corrections, engine)
+        with instrument.timer('corrections.commit'):
+            return collections.Counter(i.commit() for i in corrections)
+
+    def output_paths(self, outdir):
+        """Returns the paths save_all() writes to in a directory."""
+        return [os.path.join(outdir, name) for name in files.OUTPUT_NAMES]
+
+    def save_root(self, filename):
+        """Populate and write a ROOT file."""
+        import maketree
+        with instrument.timer('save.tree.populate'):
+            maketree.populate(self.initial.itervalues(),
+                              self.detectors.itervalues())
+        with instrument.timer('save.tree.write'):
+            maketree.write(filename)
+
+    def write_gains(self, outdir):
+        """Write the large and small cell gain files to a directory."""
+        with instrument.timer('save.gains'):
+            for name, numbers in [('largeCellGains.txt',
+                                   [NORTH_LARGE, SOUTH_LARGE]),
+                                  ('smallCellGains.txt',
+                                   [NORTH_SMALL, SOUTH_SMALL])]:
+                with open(os.path.join(outdir, name), 'w') as file:
+                    for number in numbers:
+                        self.detectors[number].write_gain_table(file)
+
+    def write_qt(self, outdir):
+        """Write the QT files to a directory."""
+        with instrument.timer('save.qt'):
+            self.qt.write(outdir)
+
+    def write_lecroy(self, outdir):
+        """Write the LeCroy scripts for large cells to a directory."""
+        with instrument.timer('save.lecroy'):
+            for i, number in [(7005, NORTH_LARGE), (7006, NORTH_LARGE),
+                              (7007, SOUTH_LARGE), (7008, SOUTH_LARGE)]:
+                printer = lecroytools.Printer(i)
+                printer.generate(self.detectors[number], outdir)
+
+    def write_small_cell_script(self, outdir):
+        """Write the script for small cells to a directory."""
+        with instrument.timer('save.smallcells'):
+            smallcellscript.generate(self.detectors[NORTH_SMALL],
+                                     self.detectors[SOUTH_SMALL],
+                                     outdir)
+
+    @instrument.timed('save')
+    def save_all(self, outdir, root=True):
+        """Write all output files to a directory, replacing existing ones.
+
+        A ROOT file, tree.root, is also written unless root is False.
+        Files are written to a staging directory and only replace the
+        existing ones once all are written (see staging.py), so a save
+        failing before then leaves them all unchanged, and one failing
+        while they are replaced is finished by staging.recover().
+        Returns the staging manifest of the files written.
+        """
+        stage = staging.Staging(outdir)
+        try:
+            self.write_gains(stage.directory)
+            self.write_qt(stage.directory)
+            self.write_lecroy(stage.directory)
+            self.write_small_cell_script(stage.directory)
+            if root:
+                self.save_root(os.path.join(stage.directory, 'tree.root'))
+            with instrument.timer('save.publish'):
+                manifest = stage.publish()
+        except Exception:
+            stage.abort()
+            raise
+        # The manifest is written, so the save must now be finished, not
+        # aborted: if this fails, recover() finishes it next time.
+        with instrument.timer('save.rollforward'):
+            stage.roll_forward()
+        # Input files saved over are now the values on disk.
+        with instrument.timer('save.snapshot'):
+            self.snapshot([filetype for filetype in self.snapshots
+                           if self.saved_over(filetype, outdir)])
+        return manifest
+
+    def saved_over(self, filetype, outdir):
+        """Returns True if saving to a directory replaces an input file."""
+        path = self.files[filetype]
+        return os.path.exists(path) and os.path.samefile(
+            path, os.path.join(outdir, os.path.basename(path)))
+
+    def stats(self):
+        """Returns a dictionary summarising changes since input was read."""
+        cells = modified = shifted = 0
+        for old, new in zip(self.initial.itervalues(),
+                            self.detectors.itervalues()):
+            for i, j in zip(old.cells, new.cells):
+                cells += 1
+                if i.voltage != j.voltage or i.qt.bitshift != j.qt.bitshift:
+                    modified += 1
+                if i.qt.bitshift != j.qt.bitshift:
+                    shifted += 1
+        return {'cells': cells, 'modified': modified,
+                'bitshift_changes': shifted}
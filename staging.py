@@ -0,0 +1,144 @@
+"""Replace a set of files in a directory without leaving it half-updated.
+
+New files are first written to a staging directory, .fmssave, inside
+the output directory. When all are written and synced to disk, a
+manifest listing them is written, and only then are they renamed over
+the old files. If the programme stops before the manifest is written,
+the old files are untouched and the staging directory is discarded next
+time. If it stops after, the next recover() finishes moving the new
+files into place. Either way the directory never mixes old and new
+voltages and bitshifts once recovered.
+
+The manifest of the last completed save is kept as .fmssave.json.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# Name of the staging directory inside the output directory.
+DIRECTORY = '.fmssave'
+
+# Name of the manifest in the staging directory.
+MANIFEST = 'MANIFEST.json'
+
+# Name the manifest is kept under in the output directory.
+RECORD = '.fmssave.json'
+
+def digest(path):
+    """Returns the SHA-1 digest of a file's contents."""
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def sync(path):
+    """Flush a file's contents to disk."""
+    with open(path, 'rb') as file:
+        os.fsync(file.fileno())
+
+def recover(outdir):
+    """Complete or discard an interrupted save in a directory.
+
+    Returns True if new files were moved into place.
+    """
+    staging = os.path.join(outdir, DIRECTORY)
+    if not os.path.isdir(staging):
+        return False
+    if not os.path.exists(os.path.join(staging, MANIFEST)):
+        shutil.rmtree(staging)
+        return False
+    roll_forward(outdir)
+    return True
+
+def roll_forward(outdir):
+    """Move staged files listed in the manifest into place.
+
+    Files already moved are skipped, so this can be repeated.
+    """
+    staging = os.path.join(outdir, DIRECTORY)
+    with open(os.path.join(staging, MANIFEST)) as file:
+        manifest = json.load(file)
+    for name in manifest['files']:
+        staged = os.path.join(staging, name)
+        if os.path.exists(staged):
+            os.rename(staged, os.path.join(outdir, name))
+    os.rename(os.path.join(staging, MANIFEST), os.path.join(outdir, RECORD))
+    shutil.rmtree(staging)
+
+
+class Staging(object):
+    """A staging directory for replacing files in an output directory.
+
+    Usage:
+     staging = Staging(outdir)
+     ... write files to staging.directory ...
+     staging.publish()
+     staging.roll_forward()
+    or staging.abort() before publish() completes to leave the output
+    directory unchanged. Once publish() has returned, the save must only
+    be finished, never aborted, as recover() does if roll_forward() fails.
+    """
+    def __init__(self, outdir):
+        """Create the staging directory, first recovering any earlier save."""
+        self.outdir = outdir
+        recover(outdir)
+        self.directory = os.path.join(outdir, DIRECTORY)
+        os.mkdir(self.directory)
+
+    def names(self):
+        """Returns the sorted names of the staged files."""
+        return sorted(name for name in os.listdir(self.directory)
+                      if name != MANIFEST)
+
+    def finish(self, name, files):
+        """Sync a staged file and add its manifest entry to files."""
+        path = os.path.join(self.directory, name)
+        sync(path)
+        files[name] = {'size': os.path.getsize(path), 'sha1': digest(path)}
+
+    def publish(self):
+        """Sync the staged files and write the manifest marking them complete.
+
+        The output directory is unchanged. Returns the manifest, {"time": ..., "files": {name: {"size": ...,
+        "sha1": ...}}}.
+        """
+        files = {}
+        # Syncing is I/O bound, so sync all the files at once. (Joining a
+        # multiprocessing ThreadPool waits up to 0.1 s, longer than this.)
+        threads = [threading.Thread(target=self.finish, args=(name, files))
+                   for name in self.names()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(files) != len(threads):
+            raise IOError('failed to sync files in ' + self.directory)
+        manifest = {'time': time.time(), 'files': files}
+        # Write the manifest under another name and rename it, so it only
+        # appears once complete: its presence is what marks the save done.
+        temporary = os.path.join(self.directory, '.' + MANIFEST)
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(temporary, os.path.join(self.directory, MANIFEST))
+        return manifest
+
+    def roll_forward(self):
+        """Move the published files into the output directory."""
+        roll_forward(self.outdir)
+
+    def commit(self):
+        """Replace the files in the output directory with the staged ones.
+
+        Returns the manifest, see publish().
+        """
+        manifest = self.publish()
+        self.roll_forward()
+        return manifest
+
+    def abort(self):
+        """Discard the staged files. Only call before publish() completes."""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,158 @@
+"""Watch the input files for changes made by other programmes.
+
+On Linux the directories holding the files are watched with inotify,
+called through ctypes, so a change is seen as soon as the file that was
+written is closed or renamed into place. Elsewhere, or if inotify is
+unavailable, the modification time and size of each file are compared
+every time the watcher is polled.
+
+inotify doesn't see changes made by other machines to a network file
+system, so set the FMSVOLTAGES_POLL environment variable to always poll.
+
+Watchers only report files that may have changed; Session.changed_files()
+checks which really did.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+# Name of the environment variable forcing polling.
+VARIABLE = 'FMSVOLTAGES_POLL'
+
+# inotify constants, from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# Layout of struct inotify_event, which is followed by the file name.
+EVENT = struct.Struct('iIII')
+
+def signature(path):
+    """Returns (modification time, size) of a file, or None if absent."""
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return status.st_mtime, status.st_size
+
+
+class Watcher(object):
+    """Finds changed files by comparing modification times and sizes.
+
+    A file is only reported once its signature is the same on two
+    successive polls, so a file still being written isn't reported.
+    """
+    def __init__(self, paths):
+        """Start watching files. paths is {file type: path}."""
+        self.paths = dict(paths)
+        self.signatures = {filetype: signature(path)
+                           for filetype, path in self.paths.iteritems()}
+        # Signatures seen once since they last changed.
+        self.pending = {}
+
+    def poll(self):
+        """Returns the set of file types changed since the last poll."""
+        changed = set()
+        for filetype, path in self.paths.iteritems():
+            current = signature(path)
+            if current == self.signatures[filetype]:
+                self.pending.pop(filetype, None)
+            elif current == self.pending.get(filetype):
+                self.signatures[filetype] = current
+                del self.pending[filetype]
+                changed.add(filetype)
+            else:
+                self.pending[filetype] = current
+        return changed
+
+    def close(self):
+        """Stop watching."""
+        pass
+
+
+class InotifyWatcher(Watcher):
+    """Finds changed files from inotify events on their directories.
+
+    Raises OSError if inotify can't be used.
+    """
+    # Events signalling a file has been written: closed after writing,
+    # or renamed into place as by staging.py.
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO
+
+    def __init__(self, paths):
+        self.paths = dict(paths)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.descriptor = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # {watch descriptor: {file name: file type}}
+        self.watches = {}
+        try:
+            directories = {}
+            for filetype, path in self.paths.iteritems():
+                directory, name = os.path.split(os.path.abspath(path))
+                directories.setdefault(directory, {})[name] = filetype
+            for directory, names in directories.iteritems():
+                watch = libc.inotify_add_watch(self.descriptor, directory,
+                                               self.MASK)
+                if watch < 0:
+                    raise OSError(ctypes.get_errno(),
+                                  'cannot watch ' + directory)
+                self.watches[watch] = names
+        except:
+            self.close()
+            raise
+
+    def events(self):
+        """Returns all waiting (watch descriptor, mask, file name) events."""
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.descriptor, 4096)
+            except OSError as err:
+                if err.errno == errno.EAGAIN:
+                    return events
+                raise
+            offset = 0
+            while offset < len(buffer):
+                watch, mask, cookie, length = EVENT.unpack_from(buffer,
+                                                                offset)
+                offset += EVENT.size
+                name = buffer[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((watch, mask, name))
+
+    def poll(self):
+        changed = set()
+        for watch, mask, name in self.events():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so any file may have changed.
+                changed.update(self.paths)
+            elif name in self.watches.get(watch, {}):
+                changed.add(self.watches[watch][name])
+        return changed
+
+    def close(self):
+        if self.descriptor >= 0:
+            os.close(self.descriptor)
+            self.descriptor = -1
+
+
+def watch(paths):
+    """Returns an InotifyWatcher for the files if possible, else a Watcher.
+
+    paths is {file type: path}.
+    """
+    if not os.environ.get(VARIABLE):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return Watcher(paths)